@@ -1,8 +1,29 @@
+#include <limits.h>
 #include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
 #include <sys/personality.h>
 
 int main(int argc, char *argv[], char *envp[]) {
     personality(ADDR_NO_RANDOMIZE);
+#ifdef BINARY_PATH
     argv[0] = BINARY_PATH;
+#else
+    /* BINARY_NAME is next to the wrapper, so one build serves every instance */
+    static char path[PATH_MAX];
+    ssize_t length = readlink("/proc/self/exe", path, sizeof(path) - 1);
+    if (length < 0) {
+        return 1;
+    }
+    path[length] = '\0';
+
+    char *slash = strrchr(path, '/');
+    if (slash == NULL ||
+        (slash - path) + 1 + strlen(BINARY_NAME) >= sizeof(path)) {
+        return 1;
+    }
+    strcpy(slash + 1, BINARY_NAME);
+    argv[0] = path;
+#endif
     execve(argv[0], argv, envp);
 }
@@ -0,0 +1,147 @@
+"""
+Content-addressed cache of build artifacts.
+
+Instances of a compiled problem usually build identical binaries, since
+templating only touches some of their files. Builds are keyed by a hash of
+the command, the tools it runs and the contents of its inputs. The files a
+build creates or changes are stored under that key, and later builds with the
+same key copy them into place instead of running the build again.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+from hashlib import sha256
+from os.path import dirname, isdir, join, relpath
+from shutil import which
+
+from shell_manager.util import BUILD_CACHE_ROOT
+
+logger = logging.getLogger(__name__)
+
+# Set to False to always build from scratch.
+enabled = True
+
+# Builds served from and added to the cache by this process.
+stats = {"hits": 0, "misses": 0}
+
+# Directories that are never build inputs or outputs.
+IGNORED_DIRECTORIES = ["__pre_templated"]
+
+
+def list_files(root="."):
+    """
+    Returns the paths of every file under root, relative to root.
+    """
+
+    result = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            d for d in dirnames if d not in IGNORED_DIRECTORIES)
+        for filename in sorted(filenames):
+            result.append(relpath(join(directory, filename), root))
+    return result
+
+
+def tool_id(name):
+    """
+    Identifies the installed version of a tool by its path, size and
+    modification time.
+    """
+
+    path = which(name)
+    if path is None:
+        return [name]
+
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def hash_inputs(parts, paths, root="."):
+    """
+    Computes a cache key.
+
+    Args:
+        parts: JSON serializable values the build depends on, such as the
+               command and the tools it runs
+        paths: the input files of the build, relative to root or absolute
+        root: the directory the build runs in
+    Returns:
+        The hex digest of the key
+    """
+
+    digest = sha256(json.dumps(parts, sort_keys=True).encode("utf-8"))
+    for path in sorted(set(paths)):
+        digest.update(b"\0" + path.encode("utf-8") + b"\0")
+        with open(join(root, path), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _snapshot(root):
+    snapshot = {}
+    for path in list_files(root):
+        stat = os.lstat(join(root, path))
+        snapshot[path] = (stat.st_size, stat.st_mtime_ns, stat.st_mode)
+    return snapshot
+
+
+def _copy_tree(source, destination, paths):
+    for path in paths:
+        target = join(destination, path)
+        if not isdir(dirname(target)):
+            os.makedirs(dirname(target))
+        # the target may be a hard link to a problem source
+        if os.path.lexists(target):
+            os.unlink(target)
+        shutil.copy2(join(source, path), target)
+
+
+def cached_build(key, build, root="."):
+    """
+    Runs a build unless an identical build is cached, in which case its
+    artifacts are copied into root instead.
+
+    Args:
+        key: the key from hash_inputs
+        build: a function running the build in root
+        root: the directory the build runs in
+    Returns:
+        True if the artifacts came from the cache
+    """
+
+    if not enabled:
+        build()
+        return False
+
+    entry = join(BUILD_CACHE_ROOT, key[:2], key)
+    if isdir(entry):
+        logger.debug("...Using cached build '%s'.", key)
+        _copy_tree(entry, root, list_files(entry))
+        stats["hits"] += 1
+        return True
+
+    before = _snapshot(root)
+    build()
+    after = _snapshot(root)
+    stats["misses"] += 1
+
+    outputs = [path for path, state in after.items() if before.get(path) != state]
+
+    # other processes may store the same build concurrently, so the entry is
+    # assembled aside and moved into place in one step
+    if not isdir(dirname(entry)):
+        os.makedirs(dirname(entry), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=dirname(entry))
+    try:
+        _copy_tree(root, staging, outputs)
+        os.rename(staging, entry)
+        logger.debug("...Cached build '%s' with outputs %s.", key, outputs)
+    except OSError as e:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return False
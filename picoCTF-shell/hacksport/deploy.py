@@ -10,13 +10,44 @@ PROBLEM_FILES_DIR = "problem_files"
 STATIC_FILE_ROOT = "static"
 XINETD_SERVICE_PATH = "/etc/xinetd.d/"
 SERVICED_SERVICE_PATH = "/usr/lib/systemd/system"
+PORT_STATE_FILE = "ports.json"
 
 # will be set to the configuration module during deployment
 deploy_config = None
-port_map = {}
-inv_port_map = {}
-current_problem = None
-current_instance = None
+
+# the context of the instance being generated by this process
+_active_context = None
+
+
+class DeployContext(object):
+    """
+    Everything the generation of a single problem instance depends on.
+
+    Contexts are created by the deploying process, which reserves any port the
+    instance needs, and handed to the process generating the instance.
+    """
+
+    def __init__(self, config, problem, instance, port=None, ports=None):
+        """
+        Args:
+            config: the deployment configuration
+            problem: the problem name
+            instance: the instance number
+            port: the port reserved for the instance, if any
+            ports: the PortRegistry to reserve a port from on demand. Only
+                   available in the deploying process.
+        """
+
+        self.config = config
+        self.problem = problem
+        self.instance = instance
+        self.port = port
+        self.ports = ports
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["ports"] = None
+        return state
 
 
 def get_deploy_context():
@@ -25,20 +56,26 @@ def get_deploy_context():
     config, port_map, problem, instance
     """
 
-    global deploy_config, port_map, inv_port_map, current_problem, current_instance
+    context = _active_context
+    if context is None:
+        return {
+            "config": deploy_config,
+            "port_map": {},
+            "inv_port_map": {},
+            "problem": None,
+            "instance": None
+        }
 
+    ports = context.ports
     return {
-        "config": deploy_config,
-        "port_map": port_map,
-        "inv_port_map": inv_port_map,
-        "problem": current_problem,
-        "instance": current_instance
+        "config": context.config,
+        "port_map": ports.port_map if ports is not None else {},
+        "inv_port_map": ports.inv_port_map if ports is not None else {},
+        "problem": context.problem,
+        "instance": context.instance
     }
 
 
-port_random = None
-
-
 # checks if the port is being used by a system process
 def check_if_port_in_use(port):
     import socket, errno
@@ -52,59 +89,210 @@ def check_if_port_in_use(port):
     return False
 
 
-def give_port():
+class PortRegistry(object):
     """
-    Returns a random port and registers it.
+    Tracks the ports assigned to deployed instances and hands out new ones.
+    Only the deploying process reserves ports, so no two instances generated
+    in parallel can be given the same port.
+
+    The usable ports are built once into a list with an index of each port's
+    position, so reserving a random port and registering a known one both
+    take constant time.
     """
-    global port_random
 
-    context = get_deploy_context()
-    # default behavior
-    if context["config"] is None:
-        return randint(LOWEST_PORT, HIGHEST_PORT)
+    def __init__(self, config):
+        self.config = config
+        self.port_map = {}
+        self.inv_port_map = {}
+        self.port_random = None
+        self._free = None
+        self._free_index = None
+
+    def _banned(self):
+        banned = set()
+        for port_range in self.config.banned_ports:
+            banned.update(range(port_range["start"], port_range["end"] + 1))
+        return banned
+
+    def _build_free(self):
+        banned = self._banned()
+
+        # sorted so the seeded choice is deterministic
+        self._free = [
+            port for port in range(LOWEST_PORT, HIGHEST_PORT)
+            if port not in banned and port not in self.port_map
+        ]
+        self._free_index = {port: i for i, port in enumerate(self._free)}
+
+    def _restore_free(self, free):
+        """
+        Resume from a saved free list, dropping the ports that have been
+        taken or banned since it was saved and adding back the ones that
+        are usable again: ports of removed instances, ports no longer banned
+        and ports skipped while they were in use.
+        """
+
+        banned = self._banned()
+        self._free = [int(port) for port in free]
+        self._free_index = {port: i for i, port in enumerate(self._free)}
+
+        # sorted so the swaps do not depend on the order instances were found
+        for port in sorted(banned | set(self.port_map)):
+            self._take(port)
+
+        for port in range(LOWEST_PORT, HIGHEST_PORT):
+            if port not in self._free_index and port not in banned and \
+                    port not in self.port_map:
+                self._free_index[port] = len(self._free)
+                self._free.append(port)
+
+    def _take(self, port):
+        """
+        Remove a port from the free list by swapping it with the last one.
+        """
+
+        i = self._free_index.pop(port, None)
+        if i is None:
+            return
+
+        last = self._free.pop()
+        if last != port:
+            self._free[i] = last
+            self._free_index[last] = i
+
+    def register(self, port, problem, instance):
+        """
+        Record the port of an already deployed instance.
+        """
+
+        self.port_map[port] = (problem, instance)
+        self.inv_port_map[(problem, instance)] = port
+        if self._free is not None:
+            self._take(port)
+
+    def reserve(self, problem, instance):
+        """
+        Returns a random port for an instance and registers it.
+        """
+
+        # if this instance already has a port, reuse it
+        if (problem, instance) in self.inv_port_map:
+            return self.inv_port_map[(problem, instance)]
+
+        # during real deployment, let's register a port
+        if self.port_random is None:
+            self.port_random = Random(self.config.deploy_secret)
+        if self._free is None:
+            self._build_free()
+
+        if not self._free:
+            raise Exception(
+                "All usable ports are taken. Cannot deploy any more instances.")
+
+        # in case the port chosen is in use, try again.
+        while self._free:
+            port = self._free[self.port_random.randrange(len(self._free))]
+            self._take(port)
+            if check_if_port_in_use(port):
+                continue
+            self.register(port, problem, instance)
+            return port
+        raise Exception(
+            "Unable to assigned a port to this problem. All ports are either taken or used by the system."
+        )
 
-    if "banned_ports_parsed" not in context["config"]:
-        banned_ports_result = []
-        for port_range in context["config"].banned_ports:
-            banned_ports_result.extend(
-                list(range(port_range["start"], port_range["end"] + 1)))
+    def _secret_hash(self):
+        return sha1(self.config.deploy_secret.encode("utf-8")).hexdigest()
 
-        context["config"]["banned_ports_parsed"] = banned_ports_result
+    def save(self, path=None):
+        """
+        Store the position of the seeded port generator and the order of the
+        free ports it picks from next to the deployed instances, so the next
+        deployment continues the same sequence.
 
-    # during real deployment, let's register a port
-    if port_random is None:
-        port_random = Random(context["config"].deploy_secret)
+        Args:
+            path: the state file. Defaults to PORT_STATE_FILE in DEPLOYED_ROOT.
+        """
 
-    # if this instance already has a port, reuse it
-    if (context["problem"], context["instance"]) in inv_port_map:
-        return inv_port_map[(context["problem"], context["instance"])]
+        if self.port_random is None:
+            return
 
-    if len(context["port_map"].items()) + len(
-            context["config"].banned_ports_parsed) == HIGHEST_PORT + 1:
-        raise Exception(
-            "All usable ports are taken. Cannot deploy any more instances.")
-
-    # Added used ports to banned_ports_parsed.
-    for port in port_map:
-        context["config"].banned_ports_parsed.append(port)
-
-    # in case the port chosen is in use, try again.
-    loop_var = HIGHEST_PORT - len(context["config"].banned_ports_parsed) + 1
-    while loop_var > 0:
-        # Get a random port that is random, not in the banned list, not in use, and not assigned before.
-        port = port_random.choice([
-            i for i in range(LOWEST_PORT, HIGHEST_PORT)
-            if i not in context["config"].banned_ports_parsed
-        ])
-        if check_if_port_in_use(port):
-            loop_var -= 1
-            context["config"].banned_ports_parsed.append(port)
-            continue
-        context["port_map"][port] = (context["problem"], context["instance"])
-        return port
-    raise Exception(
-        "Unable to assigned a port to this problem. All ports are either taken or used by the system."
-    )
+        if path is None:
+            path = join(DEPLOYED_ROOT, PORT_STATE_FILE)
+
+        version, internal, gauss_next = self.port_random.getstate()
+        state = {
+            "secret_sha1": self._secret_hash(),
+            "random": [version, list(internal), gauss_next],
+            "free": self._free
+        }
+
+        with open(path, "w") as f:
+            f.write(json.dumps(state))
+
+    @classmethod
+    def load(cls, config, deployed, path=None):
+        """
+        Create a registry of the deployed instances' ports, resuming the
+        generator saved by a previous deployment with the same secret.
+
+        Args:
+            config: the deployment configuration
+            deployed: a list of (port, problem, instance) of the deployed
+                      instances
+            path: the state file. Defaults to PORT_STATE_FILE in DEPLOYED_ROOT.
+        """
+
+        registry = cls(config)
+        for port, problem, instance in deployed:
+            registry.register(port, problem, instance)
+
+        if path is None:
+            path = join(DEPLOYED_ROOT, PORT_STATE_FILE)
+
+        if isfile(path):
+            try:
+                with open(path) as f:
+                    state = json.loads(f.read())
+                if state["secret_sha1"] == registry._secret_hash():
+                    version, internal, gauss_next = state["random"]
+                    registry.port_random = Random()
+                    registry.port_random.setstate((version, tuple(internal),
+                                                   gauss_next))
+                    if state.get("free") is not None:
+                        registry._restore_free(state["free"])
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning("Ignoring invalid port state '%s'.", path)
+
+        return registry
+
+
+def give_port(context=None):
+    """
+    Returns the port of the instance being generated, reserving one if the
+    deploying process did not.
+
+    Args:
+        context: the DeployContext of the instance. Defaults to the instance
+                 this process is generating.
+    """
+
+    if context is None:
+        context = _active_context
+
+    # default behavior
+    if context is None or context.config is None:
+        return randint(LOWEST_PORT, HIGHEST_PORT)
+
+    if context.port is None:
+        if context.ports is None:
+            raise Exception(
+                "No port was reserved for instance {} of '{}'.".format(
+                    context.instance, context.problem))
+        context.port = context.ports.reserve(context.problem,
+                                             context.instance)
+
+    return context.port
 
 
 import functools
@@ -114,9 +302,10 @@ import os
 import shutil
 import traceback
 from abc import ABCMeta
+from concurrent.futures import ProcessPoolExecutor
 from copy import copy, deepcopy
 from grp import getgrnam
-from hashlib import md5, sha1
+from hashlib import md5, sha1, sha256
 from importlib.machinery import SourceFileLoader
 # These are below because of a circular import issue with problem.py and give_port
 # [TODO] cleanup
@@ -125,6 +314,7 @@ from pwd import getpwnam
 from random import randint, Random
 from time import sleep
 
+from hacksport import build_cache
 from hacksport.operations import create_user, execute
 from hacksport.problem import (Compiled, Directory, ExecutableFile, File,
                                FlaskApp, PHPApp, WebService, PreTemplatedFile,
@@ -134,7 +324,7 @@ from jinja2 import Environment, FileSystemLoader, Template
 from shell_manager.bundle import get_bundle, get_bundle_root
 from shell_manager.util import (DEPLOYED_ROOT, FatalException, get_attributes,
                                 get_problem, get_problem_root, HACKSPORTS_ROOT,
-                                sanitize_name, STAGING_ROOT)
+                                sanitize_name, STAGING_ROOT, WEB_CONTENT_ROOT)
 from spur import RunProcessError
 
 logger = logging.getLogger(__name__)
@@ -162,7 +352,12 @@ def challenge_meta(attributes):
     return ChallengeMeta
 
 
-def update_problem_class(Class, problem_object, seed, user, instance_directory):
+def update_problem_class(Class,
+                         problem_object,
+                         seed,
+                         user,
+                         instance_directory,
+                         context=None):
     """
     Changes the metaclass of the given class to introduce necessary fields before
     object instantiation.
@@ -173,22 +368,26 @@ def update_problem_class(Class, problem_object, seed, user, instance_directory):
         seed: The seed for the Random object
         user: The linux username for this challenge instance
         instance_directory: The deployment directory for this instance
+        context: The DeployContext of this instance
 
     Returns:
         The updated class described above
     """
 
+    config = deploy_config if context is None else context.config
+
     random = Random(seed)
     attributes = deepcopy(problem_object)
 
     # pass configuration options in as class fields
-    attributes.update(dict(deploy_config))
+    attributes.update(dict(config))
 
     attributes.update({
         "random": random,
         "user": user,
         "directory": instance_directory,
-        "server": deploy_config.hostname
+        "server": config.hostname,
+        "deploy_context": context
     })
 
     return challenge_meta(attributes)(Class.__name__, Class.__bases__,
@@ -305,17 +504,20 @@ def create_instance_user(problem_name, instance_number):
     return username, new
 
 
-def generate_instance_deployment_directory(username):
+def generate_instance_deployment_directory(username, config=None):
     """
     Generates the instance deployment directory for the given username
     """
 
+    if config is None:
+        config = deploy_config
+
     directory = username
-    if deploy_config.obfuscate_problem_directories:
+    if config.obfuscate_problem_directories:
         directory = username + "_" + md5(
-            (username + deploy_config.deploy_secret).encode()).hexdigest()
+            (username + config.deploy_secret).encode()).hexdigest()
 
-    root_dir = deploy_config.problem_directory_root
+    root_dir = config.problem_directory_root
 
     if not isdir(root_dir):
         os.makedirs(root_dir)
@@ -404,10 +606,78 @@ def template_file(in_file_path, out_file_path, **kwargs):
     template = env.get_template(os.path.basename(in_file_path))
     output = template.render(**kwargs)
 
+    if os.path.isfile(out_file_path):
+        with open(out_file_path, newline="") as f:
+            if f.read() == output:
+                return
+
+        # staged files may be hard links to the problem sources, so the file
+        # is replaced instead of written through
+        if os.stat(out_file_path).st_nlink > 1:
+            temporary_path = out_file_path + ".templated"
+            with open(temporary_path, "w") as f:
+                f.write(output)
+            shutil.copymode(out_file_path, temporary_path)
+            os.replace(temporary_path, out_file_path)
+            return
+
     with open(out_file_path, "w") as f:
         f.write(output)
 
 
+def stage_tree(source, destination, mode="copy"):
+    """
+    Recursively copies a directory into a staging directory.
+
+    Args:
+        source: The directory to copy
+        destination: The directory to create
+        mode: "copy" copies every file. "link" hard-links them instead,
+              falling back to a copy for files that cannot be linked.
+    """
+
+    if mode != "link":
+        shutil.copytree(source, destination)
+        return
+
+    def link(source_path, destination_path):
+        try:
+            os.link(source_path, destination_path)
+        except OSError:
+            shutil.copy2(source_path, destination_path)
+
+    shutil.copytree(source, destination, copy_function=link)
+
+
+def install_web_file(source, destination):
+    """
+    Copies a web accessible file to its destination in the web root. Each
+    distinct file is stored once in WEB_CONTENT_ROOT and hard-linked to every
+    destination, so instances serving the same static files share them.
+    """
+
+    digest = sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+
+    content_path = join(WEB_CONTENT_ROOT, digest[:2], digest)
+    if not isfile(content_path):
+        if not isdir(os.path.dirname(content_path)):
+            os.makedirs(os.path.dirname(content_path))
+        shutil.copy2(source, content_path)
+
+    # never write through an existing link into the shared content
+    if os.path.lexists(destination):
+        os.unlink(destination)
+
+    try:
+        os.link(content_path, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
 def template_staging_directory(staging_directory, problem):
     """
     Templates every file in the staging directory recursively other than
@@ -452,7 +722,7 @@ def template_staging_directory(staging_directory, problem):
 
 
 def deploy_files(staging_directory, instance_directory, file_list, username,
-                 problem_class):
+                 is_service):
     """
     Copies the list of files from the staging directory to the instance directory.
     Will properly set permissions and setgid files based on their type.
@@ -488,7 +758,7 @@ def deploy_files(staging_directory, instance_directory, file_list, username,
         # set the permissions appropriately
         os.chmod(output_path, f.permissions)
 
-    if issubclass(problem_class, Service):
+    if is_service:
         os.chown(instance_directory, default.pw_uid, user.pw_gid)
         os.chmod(instance_directory, 0o750)
 
@@ -522,7 +792,8 @@ def generate_instance(problem_object,
                       problem_directory,
                       instance_number,
                       staging_directory,
-                      deployment_directory=None):
+                      deployment_directory=None,
+                      context=None):
     """
     Runs the setup functions of Problem in the correct order
 
@@ -534,12 +805,37 @@ def generate_instance(problem_object,
         deployment_directory: The directory that will be deployed to. Defaults to a deterministic, unique
                               directory generated for each problem,instance pair using the configuration options
                               PROBLEM_DIRECTORY_ROOT and OBFUSCATE_PROBLEM_DIRECTORIES
+        context: The DeployContext of the instance. Defaults to a context
+                 that reserves ports from a fresh PortRegistry.
 
     Returns:
         A dict containing (problem, staging_directory, deployment_directory, files,
                            web_accessible_files, service_file, socket_file)
     """
 
+    global _active_context
+
+    if context is None:
+        context = DeployContext(
+            deploy_config,
+            problem_object["name"],
+            instance_number,
+            ports=PortRegistry(deploy_config))
+
+    previous_context = _active_context
+    _active_context = context
+    try:
+        return _generate_instance(problem_object, problem_directory,
+                                  instance_number, staging_directory,
+                                  deployment_directory, context)
+    finally:
+        _active_context = previous_context
+
+
+def _generate_instance(problem_object, problem_directory, instance_number,
+                       staging_directory, deployment_directory, context):
+    config = context.config
+
     logger.debug("Generating instance %d of problem '%s'.", instance_number,
                  problem_object["name"])
     logger.debug("...Using staging directory %s", staging_directory)
@@ -552,15 +848,18 @@ def generate_instance(problem_object,
         logger.debug("...Using existing problem user '%s'.", username)
 
     if deployment_directory is None:
-        deployment_directory = generate_instance_deployment_directory(username)
+        deployment_directory = generate_instance_deployment_directory(
+            username, config)
     logger.debug("...Using deployment directory '%s'.", deployment_directory)
 
-    seed = generate_seed(problem_object['name'], deploy_config.deploy_secret,
+    seed = generate_seed(problem_object['name'], config.deploy_secret,
                          str(instance_number))
     logger.debug("...Generated random seed '%s' for deployment.", seed)
 
+    staging_mode = config.get("staging_mode", "copy")
+
     copy_path = join(staging_directory, PROBLEM_FILES_DIR)
-    shutil.copytree(problem_directory, copy_path)
+    stage_tree(problem_directory, copy_path, staging_mode)
 
     pretemplated_directory = join(copy_path, "__pre_templated")
 
@@ -575,7 +874,7 @@ def generate_instance(problem_object,
                                  join(copy_path, "challenge.py")).load_module()
 
     Problem = update_problem_class(challenge.Problem, problem_object, seed,
-                                   username, deployment_directory)
+                                   username, deployment_directory, context)
 
     # run methods in proper order
     problem = Problem()
@@ -588,7 +887,7 @@ def generate_instance(problem_object,
     logger.debug("...Running problem initialize.")
     problem.initialize()
 
-    shutil.copytree(copy_path, pretemplated_directory)
+    stage_tree(copy_path, pretemplated_directory, staging_mode)
 
     web_accessible_files = []
 
@@ -602,7 +901,7 @@ def generate_instance(problem_object,
         else:
             source_path = join(copy_path, source_name)
 
-        problem_hash = problem_object["name"] + deploy_config.deploy_secret + str(
+        problem_hash = problem_object["name"] + config.deploy_secret + str(
             instance_number)
         problem_hash = md5(problem_hash.encode("utf-8")).hexdigest()
 
@@ -611,10 +910,10 @@ def generate_instance(problem_object,
         link_template = "<a href='{}'>{}</a>"
 
         web_accessible_files.append((source_path,
-                                     join(deploy_config.web_root,
+                                     join(config.web_root,
                                           destination_path)))
         uri_prefix = "//"
-        uri = join(uri_prefix, deploy_config.hostname, destination_path)
+        uri = join(uri_prefix, config.hostname, destination_path)
 
         if not raw:
             return link_template.format(
@@ -682,60 +981,176 @@ def generate_instance(problem_object,
     }
 
 
-def deploy_problem(problem_directory,
-                   instances=None,
+def is_service_problem(problem_directory):
+    """
+    Determines whether the challenge in problem_directory is a Service and
+    therefore needs a port.
+    """
+
+    problem_directory = os.path.abspath(problem_directory)
+
+    cwd = os.getcwd()
+    os.chdir(problem_directory)
+    try:
+        challenge = SourceFileLoader(
+            "challenge", join(problem_directory, "challenge.py")).load_module()
+        return issubclass(challenge.Problem, Service)
+    finally:
+        os.chdir(cwd)
+
+
+def plan_instances(problem_directory,
+                   instances,
+                   ports,
                    test=False,
-                   deployment_directory=None,
-                   debug=False,
-                   restart_xinetd=True):
+                   deployment_directory=None):
     """
-    Deploys the problem specified in problem_directory.
+    Prepares the generation of a problem's instances. This runs in the
+    deploying process, which creates the instance users and reserves ports
+    so neither happens concurrently.
 
     Args:
         problem_directory: The directory storing the problem
-        instances: The list of instances to deploy. Defaults to [0]
-        test: Whether the instances are test instances. Defaults to False.
+        instances: The list of instances to generate
+        ports: The PortRegistry to reserve ports from
+        test: Whether the instances are test instances
         deployment_directory: If not None, the challenge will be deployed here
-                              instead of their home directory
-        debug: Output debug info
-        restart_xinetd: Whether to restart xinetd upon deployment of this set
-                        of instances for a problem. Defaults True as used by
-                        tests, but typically is used with False from
-                        deploy_problems, which takes in multiple problems.
 
+    Returns:
+        A list of jobs to pass to generate_instance_job
     """
 
-    if instances is None:
-        instances = [0]
-    global current_problem, current_instance
-
     problem_object = get_problem(problem_directory)
+    is_service = is_service_problem(problem_directory)
 
-    is_web = isinstance(problem_object, WebService)
-    current_problem = problem_object["name"]
-
-    instance_list = []
-
-    need_restart_xinetd = False
-    need_restart_serviced = False
-
-    logger.debug("Beginning to deploy problem '%s'.", problem_object["name"])
-
+    jobs = []
     for instance_number in instances:
-        current_instance = instance_number
         staging_directory = generate_staging_directory(
             problem_name=problem_object["name"],
             instance_number=instance_number)
-        if test and deployment_directory is None:
-            deployment_directory = join(staging_directory, "deployed")
 
-        instance = generate_instance(
-            problem_object,
-            problem_directory,
-            instance_number,
-            staging_directory,
-            deployment_directory=deployment_directory)
-        instance_list.append((instance_number, instance))
+        username, new = create_instance_user(problem_object["name"],
+                                             instance_number)
+        if new:
+            logger.debug("...Created problem user '%s'.", username)
+
+        if deployment_directory is not None:
+            instance_directory = deployment_directory
+        elif test:
+            instance_directory = join(staging_directory, "deployed")
+        else:
+            instance_directory = generate_instance_deployment_directory(
+                username)
+
+        port = None
+        if is_service:
+            port = ports.reserve(problem_object["name"], instance_number)
+
+        context = DeployContext(
+            deploy_config, problem_object["name"], instance_number, port=port)
+
+        jobs.append({
+            "problem_object": problem_object,
+            "problem_directory": problem_directory,
+            "instance_number": instance_number,
+            "staging_directory": staging_directory,
+            "deployment_directory": instance_directory,
+            "context": context
+        })
+
+    return jobs
+
+
+def generate_instance_job(job):
+    """
+    Generates the instance described by a job from plan_instances. May run in
+    a worker process.
+
+    Returns:
+        A dict describing the generated instance, which unlike the problem
+        object can be sent back to the deploying process.
+    """
+
+    cache_stats = dict(build_cache.stats)
+
+    instance = generate_instance(
+        job["problem_object"],
+        job["problem_directory"],
+        job["instance_number"],
+        job["staging_directory"],
+        deployment_directory=job["deployment_directory"],
+        context=job["context"])
+
+    problem = instance["problem"]
+    is_service = isinstance(problem, Service)
+
+    return {
+        "problem_object": job["problem_object"],
+        "instance_number": job["instance_number"],
+        "user": problem.user,
+        "server": problem.server,
+        "description": problem.description,
+        "flag": problem.flag,
+        "flag_sha1": problem.flag_sha1,
+        "is_service": is_service,
+        "is_web": isinstance(problem, WebService),
+        "port": problem.port if is_service else None,
+        "staging_directory": instance["staging_directory"],
+        "deployment_directory": instance["deployment_directory"],
+        "files": instance["files"],
+        "web_accessible_files": instance["web_accessible_files"],
+        "service_file": instance["service_file"],
+        "socket_file": instance["socket_file"],
+        "build_cache": {
+            name: build_cache.stats[name] - count
+            for name, count in cache_stats.items()
+        }
+    }
+
+
+def generate_instances(jobs, workers=1):
+    """
+    Generates the instances of the given jobs across a pool of worker
+    processes. Nothing is installed, so if any instance fails the exception
+    is raised before the system is changed.
+
+    Args:
+        jobs: The jobs from plan_instances
+        workers: The number of worker processes. 1 generates in this process.
+
+    Returns:
+        The results of generate_instance_job, in the order of jobs
+    """
+
+    if workers <= 1 or len(jobs) <= 1:
+        return [generate_instance_job(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(generate_instance_job, jobs))
+
+
+def install_instance(instance, test=False, debug=False):
+    """
+    Installs a generated instance: copies its files into place, installs its
+    service and writes its deployment information.
+
+    Args:
+        instance: A result of generate_instance_job
+        test: Whether the instance is a test instance
+        debug: Keep the staging directory
+
+    Returns:
+        Whether xinetd must be restarted. systemd is reloaded here when
+        restart_xinetd is set.
+    """
+
+    problem_object = instance["problem_object"]
+    instance_number = instance["instance_number"]
+    problem_path = join(instance["staging_directory"], PROBLEM_FILES_DIR)
+    deployment_directory = instance["deployment_directory"]
+
+    need_restart_xinetd = False
+    need_restart_serviced = False
 
     deployment_json_dir = join(DEPLOYED_ROOT,
                                sanitize_name(problem_object["name"]))
@@ -745,100 +1160,145 @@ def deploy_problem(problem_directory,
     # ensure that the deployed files are not world-readable
     os.chmod(DEPLOYED_ROOT, 0o750)
 
-    # all instances generated without issue. let's do something with them
-    for instance_number, instance in instance_list:
-        problem_path = join(instance["staging_directory"], PROBLEM_FILES_DIR)
-        problem = instance["problem"]
-        deployment_directory = instance["deployment_directory"]
-
-        logger.debug("...Copying problem files %s to deployment directory %s.",
-                     instance["files"], deployment_directory)
-        deploy_files(problem_path, deployment_directory, instance["files"],
-                     problem.user, problem.__class__)
-
-        if test:
-            logger.info("Test instance %d information:", instance_number)
-            logger.info("...Description: %s", problem.description)
-            logger.info("...Deployment Directory: %s", deployment_directory)
-
-            logger.debug("Cleaning up test instance side-effects.")
-            logger.debug("...Killing user processes.")
-            # This doesn't look great.
-            try:
-                execute("killall -u {}".format(problem.user))
-                sleep(0.1)
-            except RunProcessError as e:
-                pass
+    logger.debug("...Copying problem files %s to deployment directory %s.",
+                 instance["files"], deployment_directory)
+    deploy_files(problem_path, deployment_directory, instance["files"],
+                 instance["user"], instance["is_service"])
+
+    if test:
+        logger.info("Test instance %d information:", instance_number)
+        logger.info("...Description: %s", instance["description"])
+        logger.info("...Deployment Directory: %s", deployment_directory)
+
+        logger.debug("Cleaning up test instance side-effects.")
+        logger.debug("...Killing user processes.")
+        # This doesn't look great.
+        try:
+            execute("killall -u {}".format(instance["user"]))
+            sleep(0.1)
+        except RunProcessError as e:
+            pass
+
+        logger.debug("...Removing test user '%s'.", instance["user"])
+        execute(["userdel", instance["user"]])
+
+        deployment_json_dir = instance["staging_directory"]
+    else:
+        # copy files to the web root
+        logger.debug("...Copying web accessible files: %s",
+                     instance["web_accessible_files"])
+        for source, destination in instance["web_accessible_files"]:
+            if not os.path.isdir(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            install_web_file(source, destination)
+
+        if instance["service_file"] is not None:
+            install_user_service(instance["service_file"],
+                                 instance["socket_file"], instance["is_web"])
+            # set to true, this will signal restart xinetd
+            if instance["is_web"]:
+                need_restart_serviced = True
+            else:
+                need_restart_xinetd = True
+
+        # keep the staging directory if run with debug flag
+        # this can still be cleaned up by running "shell_manager clean"
+        if not debug:
+            shutil.rmtree(instance["staging_directory"])
+
+    deployment_info = {
+        "user":
+        instance["user"],
+        "deployment_directory":
+        deployment_directory,
+        "service":
+        None if instance["service_file"] is None else
+        os.path.basename(instance["service_file"]),
+        "socket":
+        None if instance["socket_file"] is None else os.path.basename(
+            instance["socket_file"]),
+        "server":
+        instance["server"],
+        "description":
+        instance["description"],
+        "flag":
+        instance["flag"],
+        "flag_sha1":
+        instance["flag_sha1"],
+        "instance_number":
+        instance_number,
+        "should_symlink":
+        not instance["is_service"] and len(instance["files"]) > 0,
+        "files": [f.to_dict() for f in instance["files"]]
+    }
 
-            logger.debug("...Removing test user '%s'.", problem.user)
-            execute(["userdel", problem.user])
+    if instance["is_service"]:
+        deployment_info["port"] = instance["port"]
+        logger.debug("...Port %d has been allocated.", instance["port"])
 
-            deployment_json_dir = instance["staging_directory"]
-        else:
-            # copy files to the web root
-            logger.debug("...Copying web accessible files: %s",
-                         instance["web_accessible_files"])
-            for source, destination in instance["web_accessible_files"]:
-                if not os.path.isdir(os.path.dirname(destination)):
-                    os.makedirs(os.path.dirname(destination))
-                shutil.copy2(source, destination)
-
-            if instance["service_file"] is not None:
-                install_user_service(instance["service_file"],
-                                     instance["socket_file"], is_web)
-                # set to true, this will signal restart xinetd
-                if is_web:
-                    need_restart_serviced = True
-                else:
-                    need_restart_xinetd = True
-
-            # keep the staging directory if run with debug flag
-            # this can still be cleaned up by running "shell_manager clean"
-            if not debug:
-                shutil.rmtree(instance["staging_directory"])
-
-        unique = problem_object["name"] + problem_object["author"] + str(
-            instance_number) + deploy_config.deploy_secret
-
-        deployment_info = {
-            "user":
-            problem.user,
-            "deployment_directory":
-            deployment_directory,
-            "service":
-            None if instance["service_file"] is None else
-            os.path.basename(instance["service_file"]),
-            "socket":
-            None if instance["socket_file"] is None else os.path.basename(
-                instance["socket_file"]),
-            "server":
-            problem.server,
-            "description":
-            problem.description,
-            "flag":
-            problem.flag,
-            "flag_sha1":
-            problem.flag_sha1,
-            "instance_number":
-            instance_number,
-            "should_symlink":
-            not isinstance(problem, Service) and len(instance["files"]) > 0,
-            "files": [f.to_dict() for f in instance["files"]]
-        }
+    instance_info_path = os.path.join(deployment_json_dir,
+                                      "{}.json".format(instance_number))
+    with open(instance_info_path, "w") as f:
+        f.write(json.dumps(deployment_info, indent=4, separators=(", ", ": ")))
 
-        if isinstance(problem, Service):
-            deployment_info["port"] = problem.port
-            logger.debug("...Port %d has been allocated.", problem.port)
+    logger.debug("The instance deployment information can be found at '%s'.",
+                 instance_info_path)
 
-        instance_info_path = os.path.join(deployment_json_dir,
-                                          "{}.json".format(instance_number))
-        with open(instance_info_path, "w") as f:
-            f.write(
-                json.dumps(deployment_info, indent=4, separators=(", ", ": ")))
+    return need_restart_xinetd, need_restart_serviced
 
-        logger.debug(
-            "The instance deployment information can be found at '%s'.",
-            instance_info_path)
+
+def deploy_problem(problem_directory,
+                   instances=None,
+                   test=False,
+                   deployment_directory=None,
+                   debug=False,
+                   restart_xinetd=True,
+                   workers=1,
+                   ports=None):
+    """
+    Deploys the problem specified in problem_directory.
+
+    Args:
+        problem_directory: The directory storing the problem
+        instances: The list of instances to deploy. Defaults to [0]
+        test: Whether the instances are test instances. Defaults to False.
+        deployment_directory: If not None, the challenge will be deployed here
+                              instead of their home directory
+        debug: Output debug info
+        restart_xinetd: Whether to restart xinetd upon deployment of this set
+                        of instances for a problem. Defaults True as used by
+                        tests, but typically is used with False from
+                        deploy_problems, which takes in multiple problems.
+        workers: The number of processes generating instances. Defaults to 1.
+        ports: The PortRegistry to reserve ports from. Defaults to an empty
+               registry.
+
+    Returns:
+        Whether xinetd must be restarted. systemd is reloaded here when
+        restart_xinetd is set.
+    """
+
+    if instances is None:
+        instances = [0]
+    if ports is None:
+        ports = PortRegistry(deploy_config)
+
+    logger.debug("Beginning to deploy problem '%s'.", problem_directory)
+
+    jobs = plan_instances(
+        problem_directory,
+        instances,
+        ports,
+        test=test,
+        deployment_directory=deployment_directory)
+
+    # all instances generated without issue. let's do something with them
+    need_restart_xinetd = False
+    need_restart_serviced = False
+    for instance in generate_instances(jobs, workers=workers):
+        xinetd, serviced = install_instance(instance, test=test, debug=debug)
+        need_restart_xinetd |= xinetd
+        need_restart_serviced |= serviced
 
     # restart xinetd
     if restart_xinetd and need_restart_xinetd:
@@ -846,18 +1306,20 @@ def deploy_problem(problem_directory,
     if restart_xinetd and need_restart_serviced:
         execute(["systemctl", "daemon-reload"], timeout=60)
 
-    logger.info("Problem instances %s were successfully deployed for '%s'.",
-                instances, problem_object["name"])
+    if jobs:
+        logger.info("Problem instances %s were successfully deployed for '%s'.",
+                    instances, jobs[0]["problem_object"]["name"])
     return need_restart_xinetd
 
 
 def deploy_problems(args, config):
     """ Main entrypoint for problem deployment """
 
-    global deploy_config, port_map, inv_port_map
+    global deploy_config
     deploy_config = config
 
     need_restart_xinetd = False
+    need_restart_serviced = False
 
     try:
         user = getpwnam(deploy_config.default_user)
@@ -898,17 +1360,17 @@ def deploy_problems(args, config):
                     raise FatalException
         problem_names = bundle_problems
 
-    # before deploying problems, load in port_map and already_deployed instances
+    # before deploying problems, load in the ports and already deployed instances
+    deployed_ports = []
     already_deployed = {}
     for path, problem in get_all_problems().items():
         already_deployed[path] = []
         for instance in get_all_problem_instances(path):
             already_deployed[path].append(instance["instance_number"])
             if "port" in instance:
-                port_map[instance["port"]] = (problem["name"],
-                                              instance["instance_number"])
-                inv_port_map[(problem["name"],
-                              instance["instance_number"])] = instance["port"]
+                deployed_ports.append((instance["port"], problem["name"],
+                                       instance["instance_number"]))
+    ports = PortRegistry.load(deploy_config, deployed_ports)
 
     lock_file = join(HACKSPORTS_ROOT, "deploy.lock")
     if os.path.isfile(lock_file):
@@ -926,7 +1388,13 @@ def deploy_problems(args, config):
     else:
         instance_list = list(range(0, args.num_instances))
 
+    workers = getattr(args, "workers", None) or 1
+    build_cache.enabled = not getattr(args, "no_build_cache", False)
+
     try:
+        # plan every problem first so instances of different problems can be
+        # generated side by side
+        jobs = []
         for problem_name in problem_names:
             if args.redeploy:
                 todo_instance_list = instance_list
@@ -937,30 +1405,57 @@ def deploy_problems(args, config):
                     set(already_deployed.get(problem_name, [])))
 
             if args.dry and isdir(problem_name):
-                need_restart_xinetd = deploy_problem(
-                    problem_name,
-                    instances=todo_instance_list,
-                    test=args.dry,
-                    deployment_directory=args.deployment_directory,
-                    debug=args.debug,
-                    restart_xinetd=False)
+                problem_directory = problem_name
             elif isdir(join(get_problem_root(problem_name, absolute=True))):
-                need_restart_xinetd = deploy_problem(
-                    join(get_problem_root(problem_name, absolute=True)),
-                    instances=todo_instance_list,
-                    test=args.dry,
-                    deployment_directory=args.deployment_directory,
-                    debug=args.debug,
-                    restart_xinetd=False)
+                problem_directory = join(
+                    get_problem_root(problem_name, absolute=True))
             else:
                 logger.error("Problem '%s' doesn't appear to be installed.",
                              problem_name)
                 raise FatalException
+
+            logger.debug("Beginning to deploy problem '%s'.", problem_name)
+            jobs.extend(
+                plan_instances(
+                    problem_directory,
+                    todo_instance_list,
+                    ports,
+                    test=args.dry,
+                    deployment_directory=args.deployment_directory))
+
+        logger.debug("Generating %d instances with %d workers.", len(jobs),
+                     workers)
+
+        deployed = {}
+        cache_stats = {"hits": 0, "misses": 0}
+        for instance in generate_instances(jobs, workers=workers):
+            for name, count in instance["build_cache"].items():
+                cache_stats[name] += count
+
+            xinetd, serviced = install_instance(
+                instance, test=args.dry, debug=args.debug)
+            need_restart_xinetd |= xinetd
+            need_restart_serviced |= serviced
+            deployed.setdefault(instance["problem_object"]["name"],
+                                []).append(instance["instance_number"])
+
+        if not args.dry:
+            ports.save()
+
+        for name, instances in deployed.items():
+            logger.info(
+                "Problem instances %s were successfully deployed for '%s'.",
+                instances, name)
+
+        if build_cache.enabled and (cache_stats["hits"] or
+                                    cache_stats["misses"]):
+            logger.info("Build cache: %d hits, %d misses.",
+                        cache_stats["hits"], cache_stats["misses"])
     finally:
         # Restart xinetd unless specified. Service must be manually restarted
         if not args.no_restart and need_restart_xinetd:
             execute(["service", "xinetd", "restart"], timeout=60)
-        if not args.no_restart and need_restart_systemd:
+        if not args.no_restart and need_restart_serviced:
             execute(["systemctl", "daemon-reload"], timeout=60)
 
         logger.debug("Releasing lock file %s", lock_file)
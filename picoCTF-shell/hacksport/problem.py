@@ -5,9 +5,10 @@ Challenge deployment and problem types.
 import os
 from abc import ABCMeta, abstractmethod, abstractproperty
 from hashlib import md5
-from os.path import join
+from os.path import basename, dirname, join
 from shutil import copy2
 
+from hacksport import build_cache
 from hacksport.deploy import give_port
 from hacksport.operations import execute
 from shell_manager.util import EXTRA_ROOT
@@ -157,6 +158,9 @@ class Compiled(Challenge):
     compiler_flags = []
     compiler_sources = []
 
+    # files besides compiler_sources that a direct compilation may read
+    compiler_header_extensions = (".h", ".hh", ".hpp")
+
     makefile = None
 
     program_name = None
@@ -176,12 +180,25 @@ class Compiled(Challenge):
             raise Exception("Must specify program_name for compiled challenge.")
 
         if self.makefile is not None:
-            execute(["make", "-f", self.makefile])
+            make_cmd = ["make", "-f", self.makefile]
+            # a Makefile may read anything, so every file is an input
+            key = build_cache.hash_inputs(
+                [make_cmd, build_cache.tool_id("make"),
+                 build_cache.tool_id(self.compiler)],
+                build_cache.list_files())
+            build_cache.cached_build(key, lambda: execute(make_cmd))
         elif len(self.compiler_sources) > 0:
             compile_cmd = [self.compiler
                           ] + self.compiler_flags + self.compiler_sources
             compile_cmd += ["-o", self.program_name]
-            execute(compile_cmd)
+            headers = [
+                path for path in build_cache.list_files()
+                if path.endswith(self.compiler_header_extensions)
+            ]
+            key = build_cache.hash_inputs(
+                [compile_cmd, build_cache.tool_id(self.compiler)],
+                self.compiler_sources + headers)
+            build_cache.cached_build(key, lambda: execute(compile_cmd))
 
         if not isinstance(self, Remote):
             # only add the setgid executable if Remote is not handling it
@@ -215,7 +232,7 @@ class Service(Challenge):
         Provides port on-demand with caching
         """
         if not hasattr(self, '_port'):
-            self._port = give_port()
+            self._port = give_port(getattr(self, "deploy_context", None))
         return self._port
 
     def service(self):
@@ -255,11 +272,21 @@ class Remote(Service):
         Returns the name of the file generated
         """
 
-        source_path = "no_aslr_wrapper.c"
-        execute([
-            "gcc", "-o", output, "-DBINARY_PATH=\"{}\"".format(exec_path),
-            join(EXTRA_ROOT, source_path)
-        ])
+        source_path = join(EXTRA_ROOT, "no_aslr_wrapper.c")
+        with open(source_path) as f:
+            relocatable = "BINARY_NAME" in f.read()
+
+        # a wrapper that finds the binary next to itself builds the same for
+        # every instance, so one cached build serves them all
+        if relocatable and dirname(exec_path) == self.directory:
+            binary = "-DBINARY_NAME=\"{}\"".format(basename(exec_path))
+        else:
+            binary = "-DBINARY_PATH=\"{}\"".format(exec_path)
+
+        compile_cmd = ["gcc", "-o", output, binary, source_path]
+        key = build_cache.hash_inputs(
+            [compile_cmd, build_cache.tool_id("gcc")], [source_path])
+        build_cache.cached_build(key, lambda: execute(compile_cmd))
         self.files.append(ExecutableFile(output))
 
         return output
@@ -3,16 +3,27 @@ import logging
 import os
 import shutil
 import socket
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from itertools import zip_longest
 from os.path import join
 
 from hacksport.operations import execute
 from shell_manager.bundle import get_bundle, get_bundle_root
 from shell_manager.util import (BUNDLE_ROOT, DEPLOYED_ROOT, get_problem,
                                 get_problem_root, HACKSPORTS_ROOT, PROBLEM_ROOT,
-                                STAGING_ROOT)
+                                STAGING_ROOT, WEB_CONTENT_ROOT)
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for an instance to accept a connection.
+probe_timeout = 2
+
+# Problems whose instances are probed at once.
+status_workers = 16
+
+# Services queried per systemctl call.
+systemctl_batch_size = 500
+
 
 def get_all_problems():
     """ Returns a dictionary of name:object mappings """
@@ -95,52 +106,155 @@ def clean(args, config):
         logger.info("Removing the stale lock file")
         os.remove(lock_file)
 
+    # remove shared web files that are no longer linked into the web root
+    if os.path.isdir(WEB_CONTENT_ROOT):
+        removed = 0
+        for root, dirnames, filenames in os.walk(WEB_CONTENT_ROOT):
+            for filename in filenames:
+                path = join(root, filename)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+        if removed > 0:
+            logger.info("Removed %d unused web files", removed)
+
     # TODO: potentially perform more cleaning
 
 
-def status(args, config):
-    """ Main entrypoint for status """
+def check_connection(port, timeout=None):
+    """
+    Checks whether a local port accepts connections.
+
+    Args:
+        port: the port to connect to
+        timeout: seconds to wait for the connection, defaults to probe_timeout
+    Returns:
+        True if the connection succeeded
+    """
+
+    try:
+        with socket.create_connection(("localhost", port),
+                                      timeout=timeout or probe_timeout):
+            return True
+    except OSError:
+        return False
+
+
+def get_failed_services(services):
+    """
+    Queries systemd for the services that have failed with as few calls to
+    systemctl as possible.
+
+    Args:
+        services: the service names
+    Returns:
+        The set of failed services. Services systemctl did not report on are
+        considered failed.
+    """
+
+    services = sorted(set(services))
+    failed = set()
+    for i in range(0, len(services), systemctl_batch_size):
+        batch = services[i:i + systemctl_batch_size]
+        result = execute(["systemctl", "is-failed"] + batch, allow_error=True)
+        states = result.output.decode("utf-8").splitlines()
+        if len(states) != len(batch):
+            logger.warning("systemctl reported %d of %d services.",
+                           len(states), len(batch))
+        for service, state in zip_longest(batch, states[:len(batch)]):
+            if state is None or state.strip() == "failed":
+                failed.add(service)
+    return failed
+
+
+def get_instance_status(instance, failed_services, timeout=None):
+    """ Returns the status of a single deployed instance """
+
+    status = {
+        "instance_number": instance["instance_number"],
+        "port": instance["port"] if "port" in instance else None,
+        "flag": instance["flag"]
+    }
+
+    status["connection"] = False
+    if "port" in instance:
+        status["connection"] = check_connection(instance["port"], timeout)
+
+    status["service"] = instance["service"] not in failed_services
+
+    if status["port"] is not None and not status["connection"]:
+        status["service"] = False
+
+    return status
+
+
+def get_problem_status(problem, instances, failed_services, timeout=None):
+    """ Returns the status of a problem and each of its instances """
+
+    return {
+        "name": problem["name"],
+        "instances": [
+            get_instance_status(instance, failed_services, timeout)
+            for instance in instances
+        ]
+    }
+
+
+def iter_problem_statuses(problems, workers=None, timeout=None):
+    """
+    Probes problems concurrently, yielding statuses as each problem finishes.
+    Problems that have not been probed yet are skipped once the caller stops
+    iterating.
+
+    Args:
+        problems: a dictionary of path:problem mappings
+        workers: problems probed at once, defaults to status_workers
+        timeout: seconds to wait for each connection
+    Yields:
+        (path, problem status) tuples in completion order
+    """
+
+    instances = {
+        path: get_all_problem_instances(path)
+        for path in problems
+    }
+    failed_services = get_failed_services(
+        instance["service"] for path_instances in instances.values()
+        for instance in path_instances if instance["service"])
+
+    with ThreadPoolExecutor(max_workers=workers or status_workers) as pool:
+        futures = {
+            pool.submit(get_problem_status, problem, instances[path],
+                        failed_services, timeout): path
+            for path, problem in problems.items()
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            for future in futures:
+                future.cancel()
 
-    bundles = get_all_bundles()
-    problems = get_all_problems()
 
-    def get_instance_status(instance):
-        status = {
-            "instance_number": instance["instance_number"],
-            "port": instance["port"] if "port" in instance else None,
-            "flag": instance["flag"]
-        }
+def is_online(problem_status):
+    """ Returns whether every instance of a problem is running """
 
-        status["connection"] = False
-        if "port" in instance:
-            try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.connect(("localhost", instance["port"]))
-                s.close()
-                status["connection"] = True
-            except ConnectionRefusedError as e:
-                pass
-        if instance["service"]:
-            result = execute(["systemctl", "is-failed", instance["service"]], allow_error=True)
-        else:
-            result = execute(["systemctl", "is-failed"], allow_error=True)
-        status["service"] = result.return_code == 1
+    return all(instance["service"] for instance in problem_status["instances"])
 
-        if status["port"] is not None and not status["connection"]:
-            status["service"] = False
 
-        return status
+def status(args, config):
+    """ Main entrypoint for status """
 
-    def get_problem_status(path, problem):
-        problem_status = {"name": problem["name"]}
-        instances = get_all_problem_instances(path)
-        instance_statuses = []
-        for instance in instances:
-            instance_statuses.append(get_instance_status(instance))
+    bundles = get_all_bundles()
+    problems = get_all_problems()
 
-        problem_status["instances"] = instance_statuses
+    def get_statuses(selected):
+        statuses = dict(
+            iter_problem_statuses(selected, timeout=args.timeout))
+        return [(path, statuses[path]) for path in selected]
 
-        return problem_status
+    def print_line(data):
+        print(json.dumps(data), flush=True)
 
     def print_problem_status(problem, path, prefix=""):
 
@@ -174,11 +288,10 @@ def status(args, config):
             pprint("  {} ({})".format(problem['name'], problem_path))
 
     def get_bundle_status(bundle):
-        problem_statuses = []
-        for problem_path in bundle["problems"]:
-            problem = problems.get(problem_path)
-            problem_statuses.append(get_problem_status(problem_path, problem))
-        bundle["problems"] = problem_statuses
+        selected = {path: problems.get(path) for path in bundle["problems"]}
+        bundle["problems"] = [
+            problem_status for _, problem_status in get_statuses(selected)
+        ]
         return bundle
 
     if args.problem is not None:
@@ -187,8 +300,10 @@ def status(args, config):
             print("Could not find problem \"{}\"".format(args.problem))
             return
 
-        problem_status = get_problem_status(args.problem, problem)
-        if args.json:
+        problem_status = get_statuses({args.problem: problem})[0][1]
+        if args.ndjson:
+            print_line(dict(problem_status, path=args.problem))
+        elif args.json:
             print(json.dumps(problem_status, indent=4))
         else:
             print_problem_status(problem_status, args.problem, prefix="")
@@ -199,31 +314,53 @@ def status(args, config):
             print("Could not find bundle \"{}\"".format(args.bundle))
             return
 
-        if args.json:
+        if args.ndjson:
+            selected = {
+                path: problems[path]
+                for path in bundle["problems"] if path in problems
+            }
+            for path, problem_status in iter_problem_statuses(
+                    selected, timeout=args.timeout):
+                print_line(dict(problem_status, path=path,
+                                bundle=args.bundle))
+        elif args.json:
             print(json.dumps(get_bundle_status(bundle), indent=4))
         else:
             print_bundle(bundle, args.bundle, prefix="")
 
     else:
         return_code = 0
-        if args.json:
+        if args.json and not args.ndjson:
             result = {
                 "bundles":
                 bundles,
                 "problems":
-                list(
-                    map(lambda tup: get_problem_status(*tup), problems.items()))
+                [problem_status for _, problem_status in get_statuses(problems)]
             }
             print(json.dumps(result, indent=4))
         elif args.errors_only:
-            for path, problem in problems.items():
-                problem_status = get_problem_status(path, problem)
+            errors = 0
+            for path, problem_status in iter_problem_statuses(
+                    problems, timeout=args.timeout):
+                if is_online(problem_status):
+                    continue
 
-                # Determine if any problem instance is offline
-                for instance_status in problem_status["instances"]:
-                    if not instance_status["service"]:
-                        print_problem_status(problem_status, path, prefix="  ")
-                        return_code = 1
+                return_code = 1
+                errors += 1
+                if args.ndjson:
+                    print_line(dict(problem_status, path=path))
+                else:
+                    print_problem_status(problem_status, path, prefix="  ")
+
+                # Stop probing once there is enough to report
+                if args.max_errors is not None and errors >= args.max_errors:
+                    break
+        elif args.ndjson:
+            for path, problem_status in iter_problem_statuses(
+                    problems, timeout=args.timeout):
+                if not is_online(problem_status):
+                    return_code = 1
+                print_line(dict(problem_status, path=path))
         else:
             print("** Installed Bundles [{}] **".format(len(bundles)))
             shown_problems = []
@@ -231,13 +368,10 @@ def status(args, config):
                 print_bundle(bundle, path, prefix="  ")
 
             print("** Installed Problems [{}] **".format(len(problems)))
-            for path, problem in problems.items():
-                problem_status = get_problem_status(path, problem)
-
+            for path, problem_status in get_statuses(problems):
                 # Determine if any problem instance is offline
-                for instance_status in problem_status["instances"]:
-                    if not instance_status["service"]:
-                        return_code = 1
+                if not is_online(problem_status):
+                    return_code = 1
 
                 print_problem_status(problem_status, path, prefix="  ")
 
@@ -5,6 +5,7 @@ Shell Manager -- Tools for deploying and packaging problems.
 
 import json
 import logging
+import os
 from argparse import ArgumentParser
 
 import coloredlogs
@@ -131,6 +132,16 @@ def main():
         "--no-restart",
         action="store_true",
         help="do not restart xinetd after deployment.")
+    deploy_parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of processes generating instances in parallel.")
+    deploy_parser.add_argument(
+        "--no-build-cache",
+        action="store_true",
+        help="compile every instance from scratch.")
     deploy_parser.add_argument(
         "problem_paths", nargs="*", type=str, help="paths to problems.")
     deploy_parser.set_defaults(func=deploy_problems)
@@ -198,6 +209,22 @@ def main():
         "--errors-only",
         action="store_true",
         help="Only print problems with failing service status.")
+    status_parser.add_argument(
+        "-n",
+        "--max-errors",
+        type=int,
+        default=None,
+        help="Stop after reporting this many failing problems. Used with --errors-only.")
+    status_parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="Stream the status of each problem as a line of json as soon as it is known.")
+    status_parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=None,
+        help="Seconds to wait for an instance to accept a connection.")
     status_parser.set_defaults(func=status)
 
     publish_parser = subparsers.add_parser(
@@ -11,7 +11,7 @@ from os import chmod, listdir, sep, unlink
 from os.path import isdir, isfile, join
 from shutil import copy2, copytree
 
-from voluptuous import All, Length, MultipleInvalid, Range, Required, Schema, ALLOW_EXTRA
+from voluptuous import All, In, Length, MultipleInvalid, Range, Required, Schema, ALLOW_EXTRA
 
 logger = logging.getLogger(__name__)
 
@@ -22,12 +22,17 @@ EXTRA_ROOT = join(HACKSPORTS_ROOT, "extra")
 STAGING_ROOT = join(HACKSPORTS_ROOT, "staging")
 DEPLOYED_ROOT = join(HACKSPORTS_ROOT, "deployed")
 BUNDLE_ROOT = join(HACKSPORTS_ROOT, "bundles")
+BUILD_CACHE_ROOT = join(HACKSPORTS_ROOT, "build_cache")
+WEB_CONTENT_ROOT = join(HACKSPORTS_ROOT, "web_content")
 
 
 class ConfigDict(dict):
     # Neat trick to allow configuration fields to be accessed as attributes
     def __getattr__(self, attr):
-        return self[attr]
+        try:
+            return self[attr]
+        except KeyError:
+            raise AttributeError(attr)
 
     def __setattr__(self, attr, value):
         self[attr] = value
@@ -64,6 +69,13 @@ default_config = ConfigDict({
     "obfuscate_problem_directories":
     False,
 
+    # how problem files are staged: "copy" copies every file, "link"
+    # hard-links them so only files replaced by templating or compilation
+    # are written. Only use "link" if no challenge modifies its source files
+    # in place.
+    "staging_mode":
+    "copy",
+
     # list of port ranges that should not be assigned to any instances
     # this bans the first ports 0-1024 and 4242 for shellinaboxd
     "banned_ports": [{
@@ -114,7 +126,8 @@ config_schema = Schema(
         Required("web_root"): str,
         Required("problem_directory_root"): str,
         Required("obfuscate_problem_directories"): bool,
-        Required("banned_ports"): list
+        Required("banned_ports"): list,
+        "staging_mode": In(["copy", "link"])
     },
     extra=True)
 
@@ -0,0 +1,127 @@
+import os
+
+# hacksport.problem can only be imported after hacksport.deploy
+import hacksport.deploy
+import hacksport.problem
+import pytest
+from hacksport import build_cache
+from hacksport.problem import Compiled, Remote
+
+
+class Program(Compiled):
+    program_name = "program"
+    compiler_sources = ["program.c"]
+
+
+class RemoteProgram(Remote):
+    program_name = "program"
+    remove_aslr = True
+
+
+@pytest.fixture
+def cache(monkeypatch, tmpdir):
+    monkeypatch.setattr(build_cache, "BUILD_CACHE_ROOT",
+                        str(tmpdir.join("cache")))
+    monkeypatch.setattr(build_cache, "enabled", True)
+    monkeypatch.setitem(build_cache.stats, "hits", 0)
+    monkeypatch.setitem(build_cache.stats, "misses", 0)
+    return tmpdir
+
+
+class TestBuildCache:
+    """
+    Tests for reusing the artifacts of identical builds.
+    """
+
+    def build_in(self, root, key):
+        builds = []
+
+        def build():
+            builds.append(root)
+            root.join("program").write("binary of " + root.basename)
+
+        root.join("program.c").write("int main() {}", ensure=True)
+        hit = build_cache.cached_build(key, build, root=str(root))
+        return hit, builds
+
+    def test_hit_and_miss(self, cache):
+        hit, builds = self.build_in(cache.join("first"), "a" * 64)
+        assert not hit and len(builds) == 1
+
+        hit, builds = self.build_in(cache.join("second"), "a" * 64)
+        assert hit and builds == []
+        assert cache.join("second", "program").read() == "binary of first"
+
+        hit, builds = self.build_in(cache.join("third"), "b" * 64)
+        assert not hit and len(builds) == 1
+
+        assert build_cache.stats == {"hits": 1, "misses": 2}
+        assert os.listdir(str(cache.join("cache", "aa", "a" * 64))) == [
+            "program"
+        ], "An input was cached as an output."
+
+    def test_disabled(self, cache, monkeypatch):
+        monkeypatch.setattr(build_cache, "enabled", False)
+
+        self.build_in(cache.join("first"), "a" * 64)
+        hit, builds = self.build_in(cache.join("second"), "a" * 64)
+
+        assert not hit and len(builds) == 1
+        assert not cache.join("cache").check()
+
+    def compile_keys(self, monkeypatch, tmpdir, problem):
+        keys = []
+        monkeypatch.setattr(build_cache, "cached_build",
+                            lambda key, build, root=".": keys.append(key))
+        monkeypatch.chdir(str(tmpdir))
+        problem.compiler_setup()
+        return keys[-1]
+
+    def test_key_inputs(self, cache, monkeypatch):
+        cache.join("program.c").write("int main() { return 0; }")
+        cache.join("program.h").write("#define A 1")
+        problem = Program()
+        key = self.compile_keys(monkeypatch, cache, problem)
+
+        assert self.compile_keys(monkeypatch, cache, problem) == key
+
+        problem.compiler_flags = ["-O2"]
+        flagged = self.compile_keys(monkeypatch, cache, problem)
+        assert flagged != key
+
+        cache.join("program.c").write("int main() { return 1; }")
+        edited = self.compile_keys(monkeypatch, cache, problem)
+        assert edited != flagged
+
+        cache.join("program.h").write("#define A 2")
+        assert self.compile_keys(monkeypatch, cache, problem) != edited
+
+    def test_no_aslr_wrapper_shared(self, cache, monkeypatch):
+        source = cache.join("extra", "no_aslr_wrapper.c")
+        source.write("argv[0] = BINARY_NAME;", ensure=True)
+        monkeypatch.setattr(hacksport.problem, "EXTRA_ROOT",
+                            str(cache.join("extra")))
+
+        commands = []
+        monkeypatch.setattr(hacksport.problem, "execute", commands.append)
+        monkeypatch.setattr(
+            build_cache, "cached_build",
+            lambda key, build, root=".": commands.append(key) or build())
+
+        def wrap(directory):
+            problem = RemoteProgram()
+            problem.files = []
+            problem.directory = directory
+            problem.remote_setup()
+            return commands[-2:]
+
+        first_key, first_command = wrap("/problems/one")
+        second_key, _ = wrap("/problems/two")
+        assert first_key == second_key
+        assert '-DBINARY_NAME="program"' in first_command
+
+        # a wrapper source that can only embed the full path
+        source.write("argv[0] = BINARY_PATH;")
+        third_key, third_command = wrap("/problems/three")
+        assert third_key != first_key
+        assert '-DBINARY_PATH="/problems/three/program"' in third_command
@@ -0,0 +1,164 @@
+import pickle
+import time
+from copy import deepcopy
+
+import hacksport.deploy
+from hacksport.deploy import (DeployContext, generate_instances,
+                              plan_instances, PortRegistry)
+from shell_manager.util import default_config
+
+
+def slow_job(job):
+    # earlier jobs finish last
+    time.sleep(0.05 * (3 - job["instance_number"]))
+    return job["instance_number"]
+
+
+class TestDeploy:
+    """
+    Tests for planning instances in the deploying process and generating
+    them in workers.
+    """
+
+    def fake_problem(self, monkeypatch, tmpdir, is_service):
+        monkeypatch.setattr(hacksport.deploy, "deploy_config", default_config)
+        monkeypatch.setattr(hacksport.deploy, "get_problem",
+                            lambda directory: {"name": "problem"})
+        monkeypatch.setattr(hacksport.deploy, "is_service_problem",
+                            lambda directory: is_service)
+        monkeypatch.setattr(
+            hacksport.deploy, "generate_staging_directory",
+            lambda problem_name, instance_number: str(
+                tmpdir.join("staging", str(instance_number))))
+        monkeypatch.setattr(
+            hacksport.deploy, "create_instance_user",
+            lambda name, instance_number: ("user{}".format(instance_number),
+                                           False))
+        monkeypatch.setattr(hacksport.deploy,
+                            "generate_instance_deployment_directory",
+                            lambda username: str(tmpdir.join(username)))
+        monkeypatch.setattr(hacksport.deploy, "check_if_port_in_use",
+                            lambda port: False)
+
+    def test_context_pickling(self):
+        ports = PortRegistry(default_config)
+        context = DeployContext(default_config, "problem", 1, ports=ports)
+        context.port = ports.reserve("problem", 1)
+
+        copy = pickle.loads(pickle.dumps(context))
+
+        assert copy.ports is None
+        assert copy.port == context.port
+        assert (copy.problem, copy.instance) == ("problem", 1)
+        assert context.ports is ports, "Pickling changed the context."
+
+    def test_service_ports_reserved(self, monkeypatch, tmpdir):
+        self.fake_problem(monkeypatch, tmpdir, True)
+        ports = PortRegistry(default_config)
+
+        jobs = plan_instances("problem", [0, 1], ports)
+
+        assigned = [job["context"].port for job in jobs]
+        assert None not in assigned
+        assert len(set(assigned)) == 2
+        assert ports.inv_port_map == {
+            ("problem", 0): assigned[0],
+            ("problem", 1): assigned[1]
+        }
+        assert all(job["context"].ports is None for job in jobs)
+        assert jobs[1]["deployment_directory"] == str(tmpdir.join("user1"))
+
+    def test_plain_problem_no_port(self, monkeypatch, tmpdir):
+        self.fake_problem(monkeypatch, tmpdir, False)
+        ports = PortRegistry(default_config)
+
+        jobs = plan_instances("problem", [0], ports, test=True)
+
+        assert jobs[0]["context"].port is None
+        assert ports.port_map == {}
+        assert jobs[0]["deployment_directory"] == str(
+            tmpdir.join("staging", "0", "deployed"))
+
+    def test_results_in_job_order(self, monkeypatch):
+        monkeypatch.setattr(hacksport.deploy, "generate_instance_job",
+                            slow_job)
+        jobs = [{"instance_number": i} for i in range(4)]
+
+        assert generate_instances(jobs, workers=4) == [0, 1, 2, 3]
+        assert generate_instances(jobs, workers=1) == [0, 1, 2, 3]
+
+
+class TestPortRegistry:
+    """
+    Tests for handing out ports across deployments.
+    """
+
+    def reserve_all(self, registry, instances):
+        return [registry.reserve("problem", i) for i in instances]
+
+    def deployed(self, registry):
+        return [(port, problem, instance)
+                for port, (problem, instance) in registry.port_map.items()]
+
+    def test_resumed_sequence(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(hacksport.deploy, "check_if_port_in_use",
+                            lambda port: False)
+        path = str(tmpdir.join("ports.json"))
+
+        expected = self.reserve_all(PortRegistry(default_config), range(6))
+
+        first = PortRegistry(default_config)
+        ports = self.reserve_all(first, range(3))
+        first.save(path)
+
+        second = PortRegistry.load(default_config, self.deployed(first), path)
+        ports += self.reserve_all(second, range(3, 5))
+        second.save(path)
+
+        # instances are found in directory order
+        deployed = sorted(self.deployed(second), reverse=True)
+        third = PortRegistry.load(default_config, deployed, path)
+        ports += self.reserve_all(third, range(5, 6))
+
+        assert ports == expected
+        assert third.reserve("problem", 0) == expected[0]
+
+    def test_released_ports_reused(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(hacksport.deploy, "LOWEST_PORT", 5000)
+        monkeypatch.setattr(hacksport.deploy, "HIGHEST_PORT", 5004)
+        in_use = {5001}
+        monkeypatch.setattr(hacksport.deploy, "check_if_port_in_use",
+                            lambda port: port in in_use)
+        path = str(tmpdir.join("ports.json"))
+
+        first = PortRegistry(default_config)
+        ports = self.reserve_all(first, range(3))
+        assert sorted(ports) == [5000, 5002, 5003]
+        first.save(path)
+
+        # instance 0 is removed and 5001 is no longer in use
+        in_use.clear()
+        deployed = [d for d in self.deployed(first) if d[2] != 0]
+        second = PortRegistry.load(default_config, deployed, path)
+        reused = self.reserve_all(second, range(3, 5))
+        assert sorted(reused) == sorted([5001, ports[0]])
+
+    def test_state_ignored(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(hacksport.deploy, "check_if_port_in_use",
+                            lambda port: False)
+        path = tmpdir.join("ports.json")
+
+        first = PortRegistry(default_config)
+        self.reserve_all(first, range(3))
+        first.save(str(path))
+
+        config = deepcopy(default_config)
+        config.deploy_secret = "another secret"
+        other = PortRegistry.load(config, [], str(path))
+        assert other.port_random is None and other._free is None
+        assert self.reserve_all(other, range(3)) == self.reserve_all(
+            PortRegistry(config), range(3))
+
+        path.write("{")
+        registry = PortRegistry.load(default_config, [], str(path))
+        assert registry.port_random is None
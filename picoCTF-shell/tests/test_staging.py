@@ -0,0 +1,113 @@
+import os
+
+import hacksport.deploy
+import hacksport.status
+from hacksport.deploy import install_web_file, stage_tree, template_file
+from hacksport.status import clean
+
+
+def inode(path):
+    return os.stat(str(path)).st_ino
+
+
+def make_source(tmpdir):
+    source = tmpdir.join("source")
+    source.join("flag.txt").write("{{ flag }}", ensure=True)
+    source.join("nested", "data").write("data", ensure=True)
+    return source
+
+
+class TestStaging:
+    """
+    Tests for sharing files between problem sources, staging directories and
+    the web root.
+    """
+
+    def test_stage_tree_links(self, tmpdir):
+        source = make_source(tmpdir)
+
+        stage_tree(str(source), str(tmpdir.join("linked")), mode="link")
+        stage_tree(str(source), str(tmpdir.join("copied")))
+
+        for path in ["flag.txt", "nested/data"]:
+            assert inode(tmpdir.join("linked", path)) == inode(source.join(path))
+            assert inode(tmpdir.join("copied", path)) != inode(source.join(path))
+            assert tmpdir.join("copied", path).read() == source.join(path).read()
+
+    def test_stage_tree_link_fallback(self, tmpdir, monkeypatch):
+        source = make_source(tmpdir)
+
+        def fail(source_path, destination_path):
+            raise OSError("Invalid cross-device link")
+
+        monkeypatch.setattr(os, "link", fail)
+        stage_tree(str(source), str(tmpdir.join("staged")), mode="link")
+
+        staged = tmpdir.join("staged", "nested", "data")
+        assert staged.read() == "data"
+        assert inode(staged) != inode(source.join("nested", "data"))
+
+    def test_template_file_breaks_links(self, tmpdir):
+        source = make_source(tmpdir)
+        os.chmod(str(source.join("flag.txt")), 0o640)
+        staged = tmpdir.join("staged")
+        stage_tree(str(source), str(staged), mode="link")
+
+        template_file(str(staged.join("nested", "data")),
+                      str(staged.join("nested", "data")))
+        assert inode(staged.join("nested", "data")) == inode(
+            source.join("nested", "data")), "An unchanged file was replaced."
+
+        path = str(staged.join("flag.txt"))
+        template_file(path, path, flag="secret")
+
+        assert staged.join("flag.txt").read() == "secret"
+        assert source.join("flag.txt").read() == "{{ flag }}"
+        assert os.stat(path).st_nlink == 1
+        assert os.stat(path).st_mode & 0o777 == 0o640
+        assert not staged.join("flag.txt.templated").check()
+
+    def web_root(self, tmpdir, monkeypatch):
+        content = tmpdir.join("web_content")
+        monkeypatch.setattr(hacksport.deploy, "WEB_CONTENT_ROOT", str(content))
+        monkeypatch.setattr(hacksport.status, "WEB_CONTENT_ROOT", str(content))
+        monkeypatch.setattr(hacksport.status, "STAGING_ROOT",
+                            str(tmpdir.join("staging")))
+        monkeypatch.setattr(hacksport.status, "HACKSPORTS_ROOT", str(tmpdir))
+        return content
+
+    def test_install_web_file_dedup(self, tmpdir, monkeypatch):
+        content = self.web_root(tmpdir, monkeypatch)
+        tmpdir.join("a.js").write("shared")
+        tmpdir.join("b.js").write("shared")
+        tmpdir.join("c.js").write("other")
+        web = tmpdir.mkdir("web")
+
+        install_web_file(str(tmpdir.join("a.js")), str(web.join("one.js")))
+        install_web_file(str(tmpdir.join("b.js")), str(web.join("two.js")))
+        install_web_file(str(tmpdir.join("c.js")), str(web.join("three.js")))
+
+        assert inode(web.join("one.js")) == inode(web.join("two.js"))
+        assert inode(web.join("one.js")) != inode(web.join("three.js"))
+        assert len(content.listdir()) == 2
+
+        # replacing a destination leaves the shared content alone
+        install_web_file(str(tmpdir.join("c.js")), str(web.join("one.js")))
+        assert web.join("one.js").read() == "other"
+        assert web.join("two.js").read() == "shared"
+
+    def test_clean_unused_web_files(self, tmpdir, monkeypatch):
+        content = self.web_root(tmpdir, monkeypatch)
+        tmpdir.join("a.js").write("used")
+        tmpdir.join("b.js").write("unused")
+        web = tmpdir.mkdir("web")
+
+        install_web_file(str(tmpdir.join("a.js")), str(web.join("a.js")))
+        install_web_file(str(tmpdir.join("b.js")), str(web.join("b.js")))
+        web.join("b.js").remove()
+
+        clean(None, None)
+
+        remaining = [path.read() for path in content.visit(lambda p: p.isfile())]
+        assert remaining == ["used"]
+        assert web.join("a.js").read() == "used"
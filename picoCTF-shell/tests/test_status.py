@@ -0,0 +1,115 @@
+import json
+from argparse import Namespace
+
+import hacksport.status
+import pytest
+from hacksport.status import get_failed_services, status
+
+
+class Result:
+
+    def __init__(self, output):
+        self.output = output.encode("utf-8")
+
+
+def status_args(**kwargs):
+    args = {
+        "problem": None,
+        "bundle": None,
+        "json": None,
+        "errors_only": False,
+        "max_errors": None,
+        "ndjson": False,
+        "timeout": None,
+        "all": False
+    }
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+def problem_status(path, online):
+    return {
+        "name": path,
+        "instances": [{
+            "instance_number": 0,
+            "port": None,
+            "flag": "flag",
+            "service": online,
+            "connection": False
+        }]
+    }
+
+
+class TestStatus:
+    """
+    Tests for querying and reporting the status of deployed problems.
+    """
+
+    def test_failed_services_batched(self, monkeypatch):
+        calls = []
+
+        def execute(cmd, allow_error=False):
+            batch = cmd[2:]
+            calls.append(batch)
+            states = {"a": "active", "b": "failed", "c": "inactive"}
+            # systemctl stops reporting on the unknown service d.
+            return Result("\n".join(
+                states[service] for service in batch if service in states))
+
+        monkeypatch.setattr(hacksport.status, "execute", execute)
+        monkeypatch.setattr(hacksport.status, "systemctl_batch_size", 2)
+
+        failed = get_failed_services(["d", "b", "a", "c", "a"])
+
+        assert calls == [["a", "b"], ["c", "d"]]
+        assert failed == {"b", "d"}
+
+    def fake_problems(self, monkeypatch, statuses):
+        probed = []
+
+        def iter_problem_statuses(problems, workers=None, timeout=None):
+            for path in sorted(problems):
+                probed.append(path)
+                yield path, statuses[path]
+
+        monkeypatch.setattr(hacksport.status, "get_all_problems",
+                            lambda: {path: {"name": path}
+                                     for path in statuses})
+        monkeypatch.setattr(hacksport.status, "get_all_bundles", lambda: {
+            "bundle": {
+                "name": "bundle",
+                "problems": sorted(statuses) + ["missing"]
+            }
+        })
+        monkeypatch.setattr(hacksport.status, "iter_problem_statuses",
+                            iter_problem_statuses)
+        return probed
+
+    def test_max_errors_stops_probing(self, monkeypatch, capsys):
+        statuses = {
+            "p{}".format(i): problem_status("p{}".format(i), i == 1)
+            for i in range(5)
+        }
+        probed = self.fake_problems(monkeypatch, statuses)
+
+        with pytest.raises(SystemExit) as exit:
+            status(status_args(errors_only=True, max_errors=2, ndjson=True),
+                   None)
+        assert exit.value.code == 1
+
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)["path"] for line in lines] == ["p0", "p2"]
+        assert probed == ["p0", "p1", "p2"]
+
+    def test_bundle_ndjson(self, monkeypatch, capsys):
+        statuses = {
+            "p0": problem_status("p0", True),
+            "p1": problem_status("p1", False)
+        }
+        self.fake_problems(monkeypatch, statuses)
+
+        status(status_args(bundle="bundle", ndjson=True), None)
+
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)["path"] for line in lines] == ["p0", "p1"]
+        assert all(json.loads(line)["bundle"] == "bundle" for line in lines)
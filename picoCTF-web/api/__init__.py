@@ -5,6 +5,7 @@ Imports and setup functionality
 import api.logger
 import api.setup
 import api.achievement
+import api.achievement_queue
 import api.user
 import api.team
 import api.group
@@ -14,6 +15,10 @@ import api.common
 import api.cache
 import api.problem
 import api.stats
+import api.scoring
+import api.scoreboard
+import api.solve_state
+import api.symlinks
 import api.utilities
 import api.problem_feedback
 import api.admin
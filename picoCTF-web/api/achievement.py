@@ -1,5 +1,9 @@
 """ Module for interacting with the achievements """
 
+import os
+import sys
+import threading
+import time
 from importlib.machinery import SourceFileLoader
 from datetime import datetime
 from os.path import join
@@ -11,6 +15,11 @@ from api.common import (check, InternalException, safe_fail,
                         SevereInternalException, validate, WebException)
 from voluptuous import Range, Required, Schema
 
+log = api.logger.use(__name__)
+
+# Seconds between checks for changed processor files and achievements.
+processor_reload_interval = 5
+
 achievement_schema = Schema({
     Required("name"):
     check(("The achievement's display name must be a string.", [str])),
@@ -255,6 +264,158 @@ def set_achievement_disabled(aid, disabled):
     return update_achievement(aid, {"disabled": disabled})
 
 
+class ProcessorRegistry(object):
+    """
+    The processor modules of every achievement, loaded once per worker and
+    reloaded when their files change.
+    """
+
+    def __init__(self):
+        self.base_path = None
+        # aid: processor path relative to the base path
+        self.paths = {}
+        # processor path: (module, mtime)
+        self.processors = {}
+        # processor path: timing counters
+        self.timings = {}
+        self.checked = None
+        self.lock = threading.RLock()
+
+    def load_all(self):
+        """
+        Load every achievement processor, logging the ones that are invalid.
+        Reloads processors whose files changed since they were loaded.
+        """
+
+        with self.lock:
+            self.base_path = api.config.get_settings()["achievements"][
+                "processor_base_path"]
+            self.paths = {
+                achievement["aid"]: achievement["processor"]
+                for achievement in get_all_achievements(show_disabled=True)
+            }
+            self.checked = time.time()
+
+            for path in set(self.paths.values()):
+                # One broken processor must not keep the others from loading.
+                try:
+                    self.load(path)
+                except Exception as error:
+                    log.error("Could not load achievement processor %s: %s",
+                              path, error)
+
+    def load(self, path):
+        """
+        Returns the processor module at a path, loading it if it is new or
+        its file changed.
+
+        Args:
+            path: the processor path relative to the base path
+        Returns:
+            The processor module
+        """
+
+        full_path = join(self.base_path, path)
+        try:
+            mtime = os.stat(full_path).st_mtime
+        except FileNotFoundError:
+            raise InternalException("Achievement processor is offline.")
+
+        with self.lock:
+            loaded = self.processors.get(path)
+            if loaded is not None and loaded[1] == mtime:
+                return loaded[0]
+
+            # Start from a fresh module so removed names do not linger.
+            sys.modules.pop(path[:-3], None)
+            try:
+                module = SourceFileLoader(path[:-3], full_path).load_module()
+            except Exception as error:
+                raise InternalException(
+                    "Achievement processor {} could not be loaded: {}".format(
+                        path, error))
+            if not callable(getattr(module, "process", None)):
+                raise InternalException(
+                    "Achievement processor {} has no process function.".format(
+                        path))
+
+            self.processors[path] = (module, mtime)
+            return module
+
+    def get(self, aid):
+        """
+        Returns the processor module for a given achievement.
+
+        Args:
+            aid: the achievement id
+        Returns:
+            The processor module
+        """
+
+        with self.lock:
+            if self.checked is None or \
+                    time.time() - self.checked > processor_reload_interval:
+                self.load_all()
+
+            if aid not in self.paths:
+                # Added since the last check, or missing altogether.
+                self.paths[aid] = get_achievement(
+                    aid=aid, show_disabled=True)["processor"]
+
+            path = self.paths[aid]
+            loaded = self.processors.get(path)
+            return loaded[0] if loaded is not None else self.load(path)
+
+    def run(self, aid, data):
+        """
+        Run the processor of an achievement and count the time it took.
+
+        Returns:
+            The processor's (earned, instance information) result.
+        """
+
+        processor = self.get(aid)
+        path = self.paths[aid]
+
+        start = time.time()
+        try:
+            return processor.process(api, data)
+        finally:
+            elapsed = time.time() - start
+            with self.lock:
+                timing = self.timings.setdefault(path, {
+                    "calls": 0,
+                    "total": 0.0,
+                    "max": 0.0
+                })
+                timing["calls"] += 1
+                timing["total"] += elapsed
+                timing["max"] = max(timing["max"], elapsed)
+
+    def get_stats(self):
+        """
+        Returns the calls, total, mean and max run time of each processor
+        in this worker.
+        """
+
+        with self.lock:
+            return {
+                path: dict(timing, mean=timing["total"] / timing["calls"])
+                for path, timing in self.timings.items()
+            }
+
+
+processors = ProcessorRegistry()
+
+
+def load_processors():
+    """
+    Load and validate every achievement processor.
+    """
+
+    processors.load_all()
+
+
 def get_processor(aid):
     """
     Returns the processor module for a given achievement.
@@ -265,13 +426,15 @@ def get_processor(aid):
         The processor module
     """
 
-    try:
-        path = get_achievement(aid=aid, show_disabled=True)["processor"]
-        base_path = api.config.get_settings()["achievements"][
-            "processor_base_path"]
-        return SourceFileLoader(path[:-3], join(base_path, path)).load_module()
-    except FileNotFoundError:
-        raise InternalException("Achievement processor is offline.")
+    return processors.get(aid)
+
+
+def get_processor_stats():
+    """
+    Returns the timing counters of each achievement processor.
+    """
+
+    return processors.get_stats()
 
 
 @log_action
@@ -291,10 +454,7 @@ def process_achievement(aid, data):
     if data.get("tid", None) is None:
         data["tid"] = api.user.get_user(uid=data["uid"])["tid"]
 
-    get_achievement(aid=aid, show_disabled=True)
-    processor = get_processor(aid)
-
-    return processor.process(api, data)
+    return processors.run(aid, data)
 
 
 def insert_earned_achievement(aid, data):
@@ -324,40 +484,74 @@ def insert_earned_achievement(aid, data):
     })
 
 
-def process_achievements(event, data):
+def process_team_events(tid, events):
     """
-    Process achievements of a type with data.
+    Process the achievements of a batch of events from one team.
 
     Args:
-        event: event type, e.g., submit
-        data: dictionary with additional information necessary for assessment
+        tid: the team id
+        events: a list of {"event": event type, "data": event data}
     """
 
+    earned = get_earned_aids(tid=tid)
+    achievements = {}
+
+    for event in events:
+        if event["event"] not in achievements:
+            achievements[event["event"]] = get_all_achievements(
+                event=event["event"])
+
+        for achievement in achievements[event["event"]]:
+            aid = achievement["aid"]
+            if aid in earned and not achievement.get("multiple", False):
+                continue
+
+            data = dict(event["data"])
+            acquired, instance_info = process_achievement(aid, data)
+
+            data.update({
+                "name": achievement.get("name"),
+                "description": achievement.get("description")
+            })
+            data.update(instance_info)
+            if acquired:
+                insert_earned_achievement(aid, data)
+                earned.add(aid)
+
+
+def _event_data(data):
     if data.get("uid", None) is None:
         data["uid"] = api.user.get_user()["uid"]
 
     if data.get("tid", None) is None:
         data["tid"] = api.user.get_user(uid=data["uid"])["tid"]
 
-    eligible_achievements = [
-        achievement for achievement in get_all_achievements(event=event) \
-            if achievement["aid"] not in get_earned_aids(tid=data["tid"]) \
-            or achievement.get("multiple", False)]
+    return data
 
-    for achievement in eligible_achievements:
-        aid = achievement["aid"]
 
-        acquired, instance_info = process_achievement(aid, data)
+def process_achievements(event, data):
+    """
+    Process achievements of a type with data.
 
-        info = {
-            "name": achievement.get("name"),
-            "description": achievement.get("description")
-        }
+    Args:
+        event: event type, e.g., submit
+        data: dictionary with additional information necessary for assessment
+    """
+
+    data = _event_data(data)
+    process_team_events(data["tid"], [{"event": event, "data": data}])
+
+
+def queue_achievements(event, data):
+    """
+    Queue an event so its achievements are processed in the background.
+
+    Args:
+        event: event type, e.g., submit
+        data: dictionary with additional information necessary for assessment
+    """
 
-        info.update(instance_info)
-        data.update(info)
-        if acquired:
-            insert_earned_achievement(aid, data)
+    api.achievement_queue.push(event, _event_data(data))
 
 
 def insert_achievement(achievement):
@@ -384,7 +578,7 @@ def insert_achievement(achievement):
         raise WebException("achievement with identical name already exists.")
 
     db.achievements.insert_one(achievement)
-    api.cache.fast_cache.clear()
+    api.cache.clear_local()
 
     return achievement["aid"]
 
@@ -417,6 +611,6 @@ def update_achievement(aid, updated_achievement):
     achievement["aid"] = aid
 
     db.achievements.update_one({"aid": aid}, {'$push' : achievement})
-    api.cache.fast_cache.clear()
+    api.cache.clear_local()
 
     return achievement
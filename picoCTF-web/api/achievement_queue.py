@@ -0,0 +1,367 @@
+"""
+Durable queue of achievement events.
+
+Requests push the events that may earn achievements and return right away.
+A pool of workers, usually run by the achievements daemon, claims every
+pending event of one team at a time and processes them as a single batch.
+"""
+
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import api
+from api.common import InternalException
+from pymongo.errors import DuplicateKeyError
+
+log = api.logger.use(__name__)
+
+# Seconds a claimed batch may go unacknowledged before it is retried.
+claim_timeout = 300
+
+# Failed attempts after which an event is left in the queue for inspection.
+max_attempts = 3
+
+# Worker threads used to drain the queue.
+workers = 4
+
+__queue = None
+
+_local_worker = {"thread": None}
+_local_worker_lock = threading.Lock()
+
+
+class MongoQueue(object):
+    """
+    Stores pending events in the achievement_queue collection.
+    """
+
+    def push(self, event, data):
+        """
+        Add an event for a team to the queue.
+
+        Args:
+            event: event type, e.g., submit
+            data: the event data, including tid and uid
+        """
+
+        db = api.common.get_conn()
+        db.achievement_queue.insert_one({
+            "event": event,
+            "tid": data["tid"],
+            "data": data,
+            "owner": None,
+            "claimed": None,
+            "attempts": 0,
+            "created": datetime.utcnow()
+        })
+
+    def claim(self, owner):
+        """
+        Claim every pending event of the team with the oldest event.
+
+        A team is only processed by one worker at a time: the claim is
+        guarded by a lock document with a unique tid in achievement_locks.
+
+        Args:
+            owner: a unique token identifying the worker
+        Returns:
+            (tid, [{"event": event, "data": data}]) or None if the queue is
+            empty.
+        """
+
+        db = api.common.get_conn()
+        locked = []
+
+        while True:
+            pending = {"owner": None, "attempts": {"$lt": max_attempts}}
+            first = db.achievement_queue.find_one(
+                dict(pending, tid={"$nin": locked}),
+                sort=[("created", 1)])
+            if first is None:
+                return None
+
+            tid = first["tid"]
+            if not self._lock(tid, owner):
+                locked.append(tid)
+                continue
+
+            pending["tid"] = tid
+            db.achievement_queue.update_many(
+                pending, {"$set": {
+                    "owner": owner,
+                    "claimed": datetime.utcnow()
+                }})
+
+            events = list(
+                db.achievement_queue.find({
+                    "owner": owner
+                }).sort("created", 1))
+            if len(events) == 0:
+                # Another worker processed the team since it was found.
+                self._unlock(owner)
+                continue
+
+            return tid, [{
+                "event": event["event"],
+                "data": event["data"]
+            } for event in events]
+
+    def _lock(self, tid, owner):
+        """
+        Take the lock of a team for a worker.
+
+        Returns:
+            True if the lock was taken, False if another worker holds it.
+        """
+
+        db = api.common.get_conn()
+        now = datetime.utcnow()
+
+        # The TTL monitor only runs once a minute.
+        db.achievement_locks.delete_many({"tid": tid, "expireAt": {"$lt": now}})
+        try:
+            db.achievement_locks.insert_one({
+                "tid": tid,
+                "owner": owner,
+                "expireAt": now + timedelta(seconds=claim_timeout)
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def _unlock(self, owner):
+        db = api.common.get_conn()
+        db.achievement_locks.delete_many({"owner": owner})
+
+    def ack(self, owner):
+        """
+        Remove the events claimed by a worker once they are processed.
+        """
+
+        db = api.common.get_conn()
+        db.achievement_queue.delete_many({"owner": owner})
+        self._unlock(owner)
+
+    def release(self, owner):
+        """
+        Return the events claimed by a worker to the queue after a failure.
+        """
+
+        db = api.common.get_conn()
+        db.achievement_queue.update_many({
+            "owner": owner
+        }, {
+            "$set": {
+                "owner": None
+            },
+            "$inc": {
+                "attempts": 1
+            }
+        })
+        self._unlock(owner)
+
+    def expire_claims(self):
+        """
+        Return batches claimed by workers that died to the queue.
+        """
+
+        db = api.common.get_conn()
+        db.achievement_locks.delete_many({
+            "expireAt": {
+                "$lt": datetime.utcnow()
+            }
+        })
+        db.achievement_queue.update_many({
+            "owner": {
+                "$ne": None
+            },
+            "claimed": {
+                "$lt": datetime.utcnow() - timedelta(seconds=claim_timeout)
+            }
+        }, {
+            "$set": {
+                "owner": None
+            },
+            "$inc": {
+                "attempts": 1
+            }
+        })
+
+    def size(self):
+        """
+        Returns the number of events that will still be processed.
+        """
+
+        db = api.common.get_conn()
+        return db.achievement_queue.count_documents({
+            "attempts": {
+                "$lt": max_attempts
+            }
+        })
+
+
+class LocalQueue(object):
+    """
+    An in-process stand-in for the durable queue, drained by a background
+    thread of the worker that pushed the events. Pending events are lost if
+    the worker exits.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def push(self, event, data):
+        with self.lock:
+            self.events.append({
+                "event": event,
+                "tid": data["tid"],
+                "data": data,
+                "owner": None,
+                "attempts": 0
+            })
+        _start_local_worker()
+
+    def _pending(self, event):
+        return event["owner"] is None and event["attempts"] < max_attempts
+
+    def claim(self, owner):
+        with self.lock:
+            first = next((e for e in self.events if self._pending(e)), None)
+            if first is None:
+                return None
+
+            events = []
+            for event in self.events:
+                if event["tid"] == first["tid"] and self._pending(event):
+                    event["owner"] = owner
+                    events.append({"event": event["event"], "data": event["data"]})
+            return first["tid"], events
+
+    def ack(self, owner):
+        with self.lock:
+            self.events = [e for e in self.events if e["owner"] != owner]
+
+    def release(self, owner):
+        with self.lock:
+            for event in self.events:
+                if event["owner"] == owner:
+                    event["owner"] = None
+                    event["attempts"] += 1
+
+    def expire_claims(self):
+        pass
+
+    def size(self):
+        with self.lock:
+            return sum(
+                1 for e in self.events if e["attempts"] < max_attempts)
+
+
+def get_queue():
+    """
+    Get the queue configured by ACHIEVEMENT_QUEUE.
+    """
+
+    global __queue
+    if __queue is None:
+        name = api.app.app.config.get("ACHIEVEMENT_QUEUE", "mongo")
+        if name == "mongo":
+            __queue = MongoQueue()
+        elif name == "local":
+            __queue = LocalQueue()
+        else:
+            raise InternalException(
+                "Unknown achievement queue {}".format(name))
+    return __queue
+
+
+def set_queue(queue):
+    """
+    Replace the achievement queue.
+    """
+
+    global __queue
+    __queue = queue
+
+
+def push(event, data):
+    """
+    Queue an event for achievement processing.
+
+    Args:
+        event: event type, e.g., submit
+        data: the event data, including tid and uid
+    """
+
+    get_queue().push(event, data)
+
+
+def _work(queue):
+    """
+    Process team batches until the queue is empty.
+
+    Returns:
+        The number of batches processed.
+    """
+
+    owner = uuid.uuid4().hex
+    batches = 0
+
+    while True:
+        batch = queue.claim(owner)
+        if batch is None:
+            return batches
+
+        tid, events = batch
+        try:
+            api.achievement.process_team_events(tid, events)
+        except Exception:
+            log.exception("Could not process achievements for team %s.", tid)
+            queue.release(owner)
+        else:
+            queue.ack(owner)
+            batches += 1
+
+
+def drain():
+    """
+    Process every pending event with a pool of workers.
+
+    Returns:
+        The number of team batches processed.
+    """
+
+    queue = get_queue()
+    queue.expire_claims()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(_work, [queue] * workers))
+
+
+def _start_local_worker():
+    """
+    Make sure a thread is draining the local queue.
+    """
+
+    with _local_worker_lock:
+        if _local_worker["thread"] is not None:
+            return
+        _local_worker["thread"] = threading.Thread(
+            target=_drain_local, daemon=True)
+        _local_worker["thread"].start()
+
+
+def _drain_local():
+    while True:
+        try:
+            drain()
+        except Exception:
+            log.exception("Could not drain the achievement queue.")
+
+        with _local_worker_lock:
+            if get_queue().size() == 0:
+                _local_worker["thread"] = None
+                return
@@ -59,7 +59,7 @@ def set_problem_availability(pid, disabled):
     problem = api.problem.get_problem(pid=pid)
     if len(problem["instances"]) > 0:
         result = api.problem.update_problem(pid, {"disabled": disabled})
-        api.cache.clear_all()
+        api.scoreboard.reset()
     else:
         raise WebException(
             "You cannot change the availability of \"{}\".".format(
@@ -124,6 +124,19 @@ def clear_collections(args):
         db[collection].delete_many({})
 
 
+def rebuild_solve_state(args):
+    changed = api.solve_state.rebuild(check=args.check)
+    verb = "Found" if args.check else "Rebuilt"
+    print("{} {} inconsistent team and {} inconsistent user states.".format(
+        verb, len(changed["teams"]), len(changed["users"])))
+    for tid in changed["teams"]:
+        logging.info("Team {} was inconsistent".format(tid))
+    for uid in changed["users"]:
+        logging.info("User {} was inconsistent".format(uid))
+    if args.check and (changed["teams"] or changed["users"]):
+        exit(1)
+
+
 def get_output_file(output):
     if output == sys.stdout:
         return output
@@ -315,6 +328,15 @@ def main():
         "collections", nargs="+", help="Collections to clear")
     parser_database_clear.set_defaults(func=clear_collections)
 
+    parser_database_rebuild = subparser_database.add_parser(
+        "rebuild-solves",
+        help="Rebuild the team and user solve state from submissions")
+    parser_database_rebuild.add_argument(
+        "--check",
+        action="store_true",
+        help="Only report inconsistent states, exit 1 if there are any")
+    parser_database_rebuild.set_defaults(func=rebuild_solve_state)
+
     args = parser.parse_args()
     if args.silent:
         logging.basicConfig(level=logging.CRITICAL, stream=sys.stdout)
@@ -45,6 +45,7 @@ def config_app(*args, **kwargs):
     """
 
     settings = api.config.get_settings()
+    api.config.watch_settings()
 
     if settings["email"]["enable_email"]:
         app.config["MAIL_SERVER"] = settings["email"]["smtp_url"]
@@ -68,6 +69,12 @@ def config_app(*args, **kwargs):
         api.routes.achievements.blueprint, url_prefix="/api/achievements")
 
     api.logger.setup_logs({"verbose": 2})
+
+    api.solve_state.ensure_built()
+
+    if settings["achievements"]["enable_achievements"]:
+        api.achievement.load_processors()
+
     return app
 
 
@@ -92,6 +99,9 @@ def after_request(response):
             session['token'] = csrf_token
             response.set_cookie('token', csrf_token, domain=domain)
 
+    if app.debug:
+        response.headers.add('X-User-Reads', str(api.user.get_user_reads()))
+
     # JB: This is a hack. We need a better solution
     if request.path[0:19] != "/api/autogen/serve/":
         response.mimetype = 'application/json'
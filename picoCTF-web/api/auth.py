@@ -5,7 +5,7 @@ import bcrypt
 from api.annotations import log_action
 from api.common import InternalException, safe_fail, validate, WebException
 from api.user import check
-from flask import session
+from flask import g, has_request_context, session
 from voluptuous import Length, Required, Schema
 
 log = api.logger.use(__name__)
@@ -87,6 +87,78 @@ def logout():
     session.clear()
 
 
+class RequestContext(object):
+    """
+    The user a request is made by. The user, team and groups are each loaded
+    once, when first used, and kept for the rest of the request.
+    """
+
+    def __init__(self, uid):
+        self.uid = uid
+        self._user = None
+        self._team = None
+        self._groups = None
+        self._group_names = None
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._user = api.user.load_user(uid=self.uid)
+        return self._user
+
+    @property
+    def team(self):
+        if self._team is None:
+            self._team = api.team.get_team(tid=self.user["tid"])
+        return self._team
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            self._groups = api.team.get_groups(tid=self.user["tid"])
+        return self._groups
+
+    @property
+    def group_names(self):
+        """
+        The names of the groups, without computing their scores.
+        """
+
+        if self._groups is not None:
+            return [group["name"] for group in self._groups]
+        if self._group_names is None:
+            self._group_names = api.team.get_group_names(self.user["tid"])
+        return self._group_names
+
+
+def get_context():
+    """
+    Get the context of the current request, built on first use.
+
+    Returns:
+        The RequestContext of the session's user, or None outside of a
+        request or if no user is logged in.
+    """
+
+    if not has_request_context() or "uid" not in session:
+        return None
+
+    context = g.get("request_context")
+    if context is None or context.uid != session["uid"]:
+        context = g.request_context = RequestContext(session["uid"])
+    return context
+
+
+def invalidate_context():
+    """
+    Forget the documents loaded by the current request, after they were
+    changed.
+    """
+
+    if has_request_context():
+        g.pop("request_context", None)
+
+
 def is_logged_in():
     """
     Check if the user is currently logged in.
@@ -95,13 +167,15 @@ def is_logged_in():
         True if the user is logged in, false otherwise.
     """
 
-    logged_in = "uid" in session
-    if logged_in:
-        user = safe_fail(api.user.get_user, uid=session["uid"])
-        if not user or user["disabled"]:
-            logout()
-            return False
-    return logged_in
+    context = get_context()
+    if context is None:
+        return False
+
+    user = safe_fail(lambda: context.user)
+    if not user or user["disabled"]:
+        logout()
+        return False
+    return True
 
 
 def get_uid():
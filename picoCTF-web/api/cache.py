@@ -1,18 +1,235 @@
 """
 Caching Library
+
+Memoized results are stored in two tiers: a bounded least recently used
+cache local to each worker, in front of a shared backend (see
+api.cache_backends). Every entry is indexed by tags naming its function and
+arguments, and invalidations are published through the backend so every
+worker evicts its local copies.
+
+Memoized functions may also declare the entities they depend on, such as the
+problem or team they read. Mutating an entity then invalidates only the
+results that depend on it, and results invalidated as stale keep being served
+while a single background recomputation per worker replaces them.
+
+Functions memoized in single flight mode take a lease in the backend before
+recomputing a missing result, so only one caller across every worker runs
+the function while the others wait for its result or keep serving the stale
+one.
 """
 
+import inspect
+import os
+import pickle
+import queue
+import threading
 import time
+import uuid
+from collections import OrderedDict
 from functools import wraps
 
 import api
-from bson import datetime, json_util
+import api.cache_backends
+from api.common import InternalException
+from bson import json_util
 
 log = api.logger.use(__name__)
 
 no_cache = False
-fast_cache = {}
-_mongo_index = None
+
+# Local tier limits, per worker.
+local_cache_entries = 4096
+local_cache_bytes = 64 * 1024 * 1024
+
+# Longest time a worker serves its local copy of a shared cache entry.
+local_timeout = 60
+
+# How often a worker checks the shared log for invalidations.
+invalidation_poll_interval = 1
+
+# How far back a poll looks, to catch publishes that landed out of order.
+invalidation_grace = 5
+
+# Longest time a single flight caller waits for the lease holder's result
+# before computing it itself. Callers waiting on another worker check for
+# the result after the poll interval, doubling it after each check up to
+# the maximum.
+single_flight_wait = 5
+single_flight_poll_interval = 0.05
+single_flight_max_poll_interval = 1
+
+# Threads recomputing stale results in the background, and the most keys a
+# worker queues for them. Stale results beyond that are served until a later
+# read finds room.
+revalidation_workers = 4
+revalidation_queue_size = 1000
+
+# Kinds of entities memoized functions can declare dependencies on.
+entities = ["problem", "bundle", "team", "group", "submission"]
+
+__backend = None
+
+
+class LRUCache(object):
+    """
+    A thread safe least recently used cache bounded by entry count and by
+    the total pickled size of its values.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the entry for a key, or None if it is missing or expired.
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry["expires"] is not None and entry["expires"] < time.time():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, value, size, timeout=None, tags=(), stale=False):
+        """
+        Store a value, evicting the least recently used entries to make room.
+
+        Args:
+            key: hashable cache key
+            value: the value to store
+            size: the accounted size of the value in bytes
+            timeout: seconds the entry is valid for
+            tags: the tags the entry can be invalidated by
+            stale: whether the value is already stale
+        """
+
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = {
+                "value": value,
+                "size": size,
+                "expires": time.time() + timeout if timeout is not None else None,
+                "tags": frozenset(tags),
+                "stale": stale
+            }
+            self.size += size
+
+            while len(self.entries) > self.max_entries or \
+                    self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry["size"]
+
+    def invalidate(self, tag_groups, stale=False):
+        """
+        Remove every entry carrying all of the tags of any of the groups, or
+        only mark them stale.
+        """
+
+        groups = [frozenset(group) for group in tag_groups]
+        with self.lock:
+            for key in [
+                    key for key, entry in self.entries.items()
+                    if any(group <= entry["tags"] for group in groups)
+            ]:
+                if stale:
+                    self.entries[key]["stale"] = True
+                else:
+                    self._remove(key)
+
+    def clear(self):
+        """
+        Remove every entry.
+        """
+
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Returns usage counters for the cache.
+        """
+
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+
+# Results of fast memoized functions, never stored in the shared tier.
+fast_cache = LRUCache(local_cache_entries, local_cache_bytes)
+
+# Local copies of entries from the shared tier.
+local_cache = LRUCache(local_cache_entries, local_cache_bytes)
+
+_invalidation_state = {"last_poll": time.time(), "applied": {}}
+_invalidation_lock = threading.Lock()
+
+# Keys being recomputed in the background by this worker.
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+_revalidation_pool = {"pid": None, "threads": [], "queue": None}
+
+# Leases for fast functions, which are only cached within this worker.
+local_leases = api.cache_backends.MemoryBackend()
+
+# Single flight computations running in this worker, by key.
+_flights = {}
+_flights_lock = threading.Lock()
+
+# Single flight outcomes per function.
+_flight_stats = {}
+_flight_stats_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Get the shared cache backend configured by CACHE_BACKEND.
+    """
+
+    global __backend
+    if __backend is None:
+        __backend = api.cache_backends.from_config(api.app.app.config)
+    return __backend
+
+
+def set_backend(backend):
+    """
+    Replace the shared cache backend.
+    """
+
+    global __backend
+    __backend = backend
+    fast_cache.clear()
+    local_cache.clear()
 
 
 def clear_all():
@@ -20,14 +237,29 @@ def clear_all():
     Clears the cache.
     """
 
-    db = api.common.get_conn()
-    db.cache.delete_many({})
+    get_backend().clear()
+    clear_local()
+
+
+def clear_local():
+    """
+    Clears the local tiers of every worker.
+    """
+
     fast_cache.clear()
+    local_cache.clear()
+    publish_invalidation(None)
+
 
+def _function_name(f):
+    return "{}.{}".format(f.__module__, f.__name__)
 
-def get_mongo_key(f, *args, **kwargs):
+
+def get_key(f, *args, **kwargs):
     """
-    Returns a mongo object key for the function.
+    Returns a unique key for a memoized function.
+
+    Arguments given as None are treated as if they were omitted.
 
     Args:
         f: the function
@@ -37,38 +269,109 @@ def get_mongo_key(f, *args, **kwargs):
         The key.
     """
 
-    min_kwargs = list(filter(lambda pair: pair[1] is not None, kwargs.items()))
+    min_kwargs = sorted(
+        [pair for pair in kwargs.items() if pair[1] is not None])
 
-    return {
-        "function": "{}.{}".format(f.__module__, f.__name__),
-        "args": args,
-        "ordered_kwargs": sorted(min_kwargs),
-        "kwargs": dict(min_kwargs)
-    }
+    return "{}:{}".format(
+        _function_name(f), json_util.dumps([list(args), min_kwargs]))
 
 
-def get_key(f, *args, **kwargs):
+def _tag(function, field, value):
+    return "{}:{}={}".format(function, field, json_util.dumps(value))
+
+
+def get_tags(f, *args, **kwargs):
     """
-    Returns a unique key for a memoized function.
+    Returns the tags a memoized result can be invalidated by: the function
+    itself, each positional argument and each keyword argument.
+    """
+
+    function = _function_name(f)
+
+    tags = {function}
+    tags.update(_tag(function, "args", arg) for arg in args)
+    tags.update(
+        _tag(function, "kwargs." + name, value)
+        for name, value in kwargs.items() if value is not None)
+
+    return tags
+
+
+def _entity_tag(entity, _id=None):
+    if _id is None:
+        return "entity:{}".format(entity)
+    elif _id == "*":
+        return "entity:{}=*".format(entity)
+    return "entity:{}={}".format(entity, json_util.dumps(_id))
+
+
+def get_dependency_tags(f, depends, *args, **kwargs):
+    """
+    Returns the entity tags of a memoized result.
 
     Args:
         f: the function
-        args: positional arguments
-        kwargs: keyword arguments
+        depends: a dict of entity: name of the argument identifying it.
+                 An argument of None declares a dependency on every entity
+                 of that kind, as does an identifying argument left unset.
     Returns:
-        The key.
+        The set of tags.
     """
 
-    if len(args) > 0:
-        kwargs["#args"] = ",".join(map(str, args))
+    tags = {_entity_tag(entity) for entity in depends or {}}
+    if len(tags) == 0:
+        return tags
+
+    arguments = inspect.signature(f).bind_partial(*args, **kwargs).arguments
+    for entity, argument in depends.items():
+        if argument is None or arguments.get(argument) is None:
+            tags.add(_entity_tag(entity, "*"))
+        else:
+            tags.add(_entity_tag(entity, arguments[argument]))
+
+    return tags
 
-    sorted_keys = sorted(kwargs)
-    arg_key = "&".join(
-        ["{}:{}".format(key, kwargs[key]) for key in sorted_keys])
 
-    key = "{}.{}${}".format(f.__module__, f.__name__, arg_key).replace(" ", "~")
+def get_entity_tag_groups(entity, _id=None):
+    """
+    Returns the tag groups matching results that depend on an entity.
+
+    Without an id, every result depending on any entity of the kind matches.
+    """
 
-    return key
+    if entity not in entities:
+        raise InternalException("Unknown cache entity {}".format(entity))
+
+    if _id is None:
+        return [[_entity_tag(entity)]]
+    return [[_entity_tag(entity, _id)], [_entity_tag(entity, "*")]]
+
+
+def get_tag_groups(f, *conditions):
+    """
+    Translates invalidate_memoization conditions into tag groups.
+
+    A condition such as {"kwargs.tid": tid} or {"args": tid} matches entries
+    called with that argument. Each condition becomes a group of tags that
+    must all be present; an entry matching any group is invalidated.
+    """
+
+    function = _function_name(f)
+
+    if len(conditions) == 0:
+        return [[function]]
+
+    groups = []
+    for condition in conditions:
+        group = []
+        for field, value in condition.items():
+            if field == "args" and isinstance(value, (list, tuple)):
+                group.extend(_tag(function, "args", arg) for arg in value)
+            else:
+                group.append(_tag(function, field, value))
+        groups.append(group)
+
+    return groups
 
 
 def get(key, fast=False):
@@ -82,22 +385,74 @@ def get(key, fast=False):
         The result from the cache.
     """
 
+    entry = get_entry(key, fast=fast)
+    return entry["value"] if entry is not None else None
+
+
+def get_entry(key, fast=False):
+    """
+    Get a key from the cache along with whether it has gone stale.
+
+    Args:
+        key: cache key
+        fast: whether or not to use the fast cache
+    Returns:
+        {"value": value, "stale": bool}, or None on a miss.
+    """
+
     if fast:
-        return fast_cache.get(key, None)
+        entry = fast_cache.get(key)
+        if entry is None:
+            return None
+        return {"value": entry["value"], "stale": entry["stale"]}
+
+    poll_invalidations()
 
-    db = api.common.get_conn()
+    entry = local_cache.get(key)
+    if entry is not None and not entry["stale"]:
+        return {"value": pickle.loads(entry["value"]), "stale": False}
 
-    # We aren't interested in matching the unordered kwargs.
-    partial_key = key.copy()
-    partial_key.pop("kwargs", None)
+    # A stale local copy may already have been recomputed by another worker.
+    cached = get_backend().get(key)
+    if cached is None:
+        return None
 
-    cached_result = db.cache.find_one(partial_key)
+    _set_local(key, cached["value"], cached["expires"], cached["tags"],
+               cached["stale"])
+    return {"value": cached["value"], "stale": cached["stale"]}
 
-    if cached_result:
-        return cached_result["value"]
 
+def _set_local(key, value, expires=None, tags=None, stale=False):
+    """
+    Store a copy of a shared entry in the local tier.
+    """
+
+    timeout = local_timeout
+    if expires is not None:
+        timeout = min(timeout, expires - time.time())
+
+    if timeout > 0:
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        local_cache.set(key, data, len(data), timeout,
+                        tags=tags if tags is not None else _tags_from_key(key),
+                        stale=stale)
 
-def set(key, value, timeout=None, fast=False):
+
+def _tags_from_key(key):
+    """
+    Rebuild the tags of a shared entry from its key.
+    """
+
+    function, arguments = key.split(":", 1)
+    args, kwargs = json_util.loads(arguments)
+
+    tags = {function}
+    tags.update(_tag(function, "args", arg) for arg in args)
+    tags.update(_tag(function, "kwargs." + name, value) for name, value in kwargs)
+    return tags
+
+
+def set(key, value, timeout=None, fast=False, tags=None):
     """
     Set a key in the cache.
 
@@ -105,48 +460,46 @@ def set(key, value, timeout=None, fast=False):
         key: The cache key.
         timeout: Time the key is valid.
         fast: whether or not to use the fast cache
+        tags: the tags the entry can be invalidated by
     """
 
+    if tags is None:
+        tags = _tags_from_key(key)
+
     if fast:
-        fast_cache[key] = {
-            "result": value,
-            "timeout": timeout,
-            "set_time": time.time()
-        }
+        size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        fast_cache.set(key, value, size, timeout, tags=tags)
         return
 
-    db = api.common.get_conn()
-
-    update = key.copy()
-    update.update({"value": value})
+    get_backend().set(key, value, timeout=timeout, tags=tags)
 
-    if timeout is not None:
-        expireAt = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
-        update.update({"expireAt": expireAt})
+    expires = time.time() + timeout if timeout is not None else None
+    _set_local(key, value, expires, tags)
 
-    db.cache.update_one(key, {'$set': update}, upsert=True)
 
-
-def timed_out(info):
-    """
-    Determines if a fast_cache entry has been timed out
-    """
-
-    return int(time.time()) - info['set_time'] > info['timeout']
-
-
-def memoize(timeout=None, fast=False):
+def memoize(timeout=None, fast=False, depends=None,
+            stale_while_revalidate=False, single_flight=False, lease_timeout=30):
     """
     Cache a function based on its arguments.
 
     Args:
         timeout: Time the result stays valid in the cache.
+        fast: Only cache the result in the local tier of each worker.
+        depends: A dict of entity: argument naming the entities the result
+                 depends on. See get_dependency_tags.
+        stale_while_revalidate: Serve stale results while they are
+                                recomputed in the background.
+        single_flight: Let only one caller at a time recompute a result.
+        lease_timeout: Longest time a single flight computation may hold
+                       its lease.
     Returns:
         The functions result.
     """
 
     assert (not fast or (fast and timeout is not None)
            ), "You cannot set fast cache without a timeout!"
+    assert all(entity in entities for entity in (depends or {})
+              ), "Unknown entity in memoize dependencies!"
 
     def decorator(f):
         """
@@ -163,36 +516,314 @@ def memoize(timeout=None, fast=False):
                 kwargs.pop("cache", None)
                 return f(*args, **kwargs)
 
-            key = get_key(f, *args, **kwargs) if fast else get_mongo_key(
-                f, *args, **kwargs)
-            cached_result = get(key, fast=fast)
+            key = get_key(f, *args, **kwargs)
+            entry = None if no_cache else get_entry(key, fast=fast)
 
-            if cached_result is None or no_cache or (fast and
-                                                     timed_out(cached_result)):
-                function_result = f(*args, **kwargs)
-                set(key, function_result, timeout=timeout, fast=fast)
+            if entry is None:
+                return _compute(wrapper, key, None, args, kwargs)
 
-                return function_result
+            if entry["stale"]:
+                if not stale_while_revalidate:
+                    return _compute(wrapper, key, entry, args, kwargs)
+                _revalidate(wrapper, key, args, kwargs)
 
-            return cached_result['result'] if fast else cached_result
+            return entry["value"]
+
+        wrapper.memoize_options = {
+            "timeout": timeout,
+            "fast": fast,
+            "depends": depends,
+            "stale_while_revalidate": stale_while_revalidate,
+            "single_flight": single_flight,
+            "lease_timeout": lease_timeout
+        }
 
         return wrapper
 
     return decorator
 
 
+def refresh(f, *args, **kwargs):
+    """
+    Recompute a memoized function and store the result.
+
+    Args:
+        f: the memoized function
+    Returns:
+        The fresh result.
+    """
+
+    return store(f, f.__wrapped__(*args, **kwargs), *args, **kwargs)
+
+
+def store(f, result, *args, **kwargs):
+    """
+    Store a result of a memoized function computed or updated elsewhere.
+
+    Args:
+        f: the memoized function
+        result: the value to cache for the given arguments
+    Returns:
+        The result.
+    """
+
+    options = f.memoize_options
+    tags = get_tags(f, *args, **kwargs)
+    tags.update(
+        get_dependency_tags(f, options["depends"], *args, **kwargs))
+
+    set(get_key(f, *args, **kwargs),
+        result,
+        timeout=options["timeout"],
+        fast=options["fast"],
+        tags=tags)
+
+    return result
+
+
+def _count_flight(f, outcome):
+    with _flight_stats_lock:
+        counts = _flight_stats.setdefault(
+            _function_name(f), {
+                "computed": 0,
+                "coalesced": 0,
+                "timed_out": 0
+            })
+        counts[outcome] += 1
+
+
+def _try_compute(f, key, args, kwargs):
+    """
+    Recompute a result unless another single flight caller already is.
+
+    Returns:
+        A (computed, result) tuple.
+    """
+
+    options = f.memoize_options
+    if not options["single_flight"]:
+        return True, refresh(f, *args, **kwargs)
+
+    leases = local_leases if options["fast"] else get_backend()
+    owner = uuid.uuid4().hex
+    if not leases.acquire(key, owner, options["lease_timeout"]):
+        return False, None
+
+    done = threading.Event()
+    with _flights_lock:
+        _flights[key] = done
+
+    try:
+        _count_flight(f, "computed")
+        return True, refresh(f, *args, **kwargs)
+    finally:
+        leases.release(key, owner)
+        with _flights_lock:
+            _flights.pop(key, None)
+        done.set()
+
+
+def _compute(f, key, stale_entry, args, kwargs):
+    """
+    Recompute a missing or stale result. In single flight mode, callers
+    that lose the race for the lease get the stale result if there is one,
+    or wait for the lease holder to store a fresh one.
+    """
+
+    computed, result = _try_compute(f, key, args, kwargs)
+    if computed:
+        return result
+
+    if stale_entry is not None:
+        _count_flight(f, "coalesced")
+        return stale_entry["value"]
+
+    deadline = time.time() + single_flight_wait
+    interval = single_flight_poll_interval
+    while time.time() < deadline:
+        with _flights_lock:
+            flight = _flights.get(key)
+        if flight is not None:
+            # The holder runs in this worker, so there is nothing to poll.
+            flight.wait(deadline - time.time())
+        else:
+            time.sleep(min(interval, max(deadline - time.time(), 0)))
+            interval = min(interval * 2, single_flight_max_poll_interval)
+
+        entry = get_entry(key, fast=f.memoize_options["fast"])
+        if entry is not None and not entry["stale"]:
+            _count_flight(f, "coalesced")
+            return entry["value"]
+
+    _count_flight(f, "timed_out")
+    return refresh(f, *args, **kwargs)
+
+
+def _revalidate(f, key, args, kwargs):
+    """
+    Queue a stale result to be recomputed by the background pool, unless
+    this worker is already recomputing it or its queue is full.
+    """
+
+    with _revalidating_lock:
+        work = _start_revalidation_workers()
+        if key in _revalidating or \
+                len(_revalidating) >= revalidation_queue_size:
+            return
+        _revalidating.add(key)
+
+    def run():
+        try:
+            _try_compute(f, key, args, kwargs)
+        except Exception:
+            log.exception("Could not revalidate %s.", key)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+    work.put(run)
+
+
+def _start_revalidation_workers():
+    """
+    Make sure this process runs the revalidation threads. Threads do not
+    survive forking, so each worker starts its own and forgets the keys
+    queued by its parent. Expects _revalidating_lock to be held.
+
+    Returns:
+        The queue the threads take work from.
+    """
+
+    pool = _revalidation_pool
+    if pool["pid"] != os.getpid():
+        pool["pid"] = os.getpid()
+        pool["threads"] = []
+        pool["queue"] = queue.Queue()
+        _revalidating.clear()
+
+    pool["threads"] = [t for t in pool["threads"] if t.is_alive()]
+    while len(pool["threads"]) < revalidation_workers:
+        thread = threading.Thread(
+            target=_revalidation_worker, args=(pool["queue"],), daemon=True)
+        thread.start()
+        pool["threads"].append(thread)
+
+    return pool["queue"]
+
+
+def _revalidation_worker(work):
+    while True:
+        work.get()()
+
+
+def _evict_local(tag_groups, stale=False):
+    """
+    Evict local entries matching any of the tag groups, or mark them stale.
+    Tag groups of None evict everything.
+    """
+
+    if tag_groups is None:
+        fast_cache.clear()
+        local_cache.clear()
+        return
+
+    fast_cache.invalidate(tag_groups, stale=stale)
+    local_cache.invalidate(tag_groups, stale=stale)
+
+
+def publish_invalidation(tag_groups, stale=False):
+    """
+    Tell every worker to evict matching entries from its local tiers.
+
+    Args:
+        tag_groups: the tag groups to evict, or None for everything
+        stale: only mark the entries stale
+    """
+
+    _id = get_backend().publish({"tag_groups": tag_groups, "stale": stale})
+
+    with _invalidation_lock:
+        _invalidation_state["applied"][_id] = time.time()
+
+
+def poll_invalidations(force=False):
+    """
+    Apply invalidations published by other workers since the last poll.
+    Polls at most once every invalidation_poll_interval seconds.
+    """
+
+    now = time.time()
+
+    with _invalidation_lock:
+        last_poll = _invalidation_state["last_poll"]
+        if not force and now - last_poll < invalidation_poll_interval:
+            return
+        _invalidation_state["last_poll"] = now
+
+        applied = _invalidation_state["applied"]
+        for _id in [_id for _id, at in applied.items()
+                    if now - at > 2 * invalidation_grace]:
+            applied.pop(_id)
+
+    for _id, message in get_backend().poll(last_poll - invalidation_grace):
+        with _invalidation_lock:
+            if _id in _invalidation_state["applied"]:
+                continue
+            _invalidation_state["applied"][_id] = now
+
+        _evict_local(message["tag_groups"], message.get("stale", False))
+
+
 def invalidate_memoization(f, *keys):
     """
     Invalidate a memoized function.
 
     Args:
         f: the function
-        You must pass all arguments given to the function to accurately invalidate it.
+        keys: conditions such as {"kwargs.tid": tid} or {"args": tid}.
+              Without any, every result of the function is invalidated.
+    """
+
+    tag_groups = get_tag_groups(f, *keys)
+
+    get_backend().invalidate(tag_groups)
+    _evict_local(tag_groups)
+    publish_invalidation(tag_groups)
+
+
+def invalidate_entity(entity, _id=None, stale=False):
     """
+    Invalidate the memoized results that depend on an entity.
+
+    Args:
+        entity: the kind of entity, one of entities
+        _id: the id of the entity that changed. Without one, every result
+             depending on any entity of the kind is invalidated.
+        stale: keep serving the results to functions memoized with
+               stale_while_revalidate until they are recomputed
+    """
+
+    tag_groups = get_entity_tag_groups(entity, _id)
 
-    db = api.common.get_conn()
+    get_backend().invalidate(tag_groups, stale=stale)
+    _evict_local(tag_groups, stale)
+    publish_invalidation(tag_groups, stale)
 
-    search = {"function": "{}.{}".format(f.__module__, f.__name__)}
-    search.update({"$or": list(keys)})
 
-    db.cache.delete_many(search)
+def get_stats():
+    """
+    Returns usage counters for the local tiers of this worker and the
+    single flight outcomes of its memoized functions.
+    """
+
+    with _flight_stats_lock:
+        flights = {
+            function: dict(counts)
+            for function, counts in _flight_stats.items()
+        }
+
+    return {
+        "fast": fast_cache.stats(),
+        "local": local_cache.stats(),
+        "single_flight": flights
+    }
@@ -0,0 +1,593 @@
+"""
+Storage backends for the shared tier of api.cache.
+
+A backend stores serialized values under string keys, indexes each key by a
+set of tags so related entries can be invalidated together, and carries the
+invalidation log that keeps the local tiers of every worker in sync. It
+also hands out short leases so only one worker recomputes a given entry.
+"""
+
+import pickle
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import api
+from api.common import InternalException
+from pymongo.errors import DuplicateKeyError
+
+# Seconds invalidation messages are kept for workers to poll.
+invalidation_retention = 300
+
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# ARGV: prefix, key, value, timeout in milliseconds or "", tags...
+SET_SCRIPT = """
+redis.replicate_commands()
+local prefix, key, ttl = ARGV[1], ARGV[2], tonumber(ARGV[4])
+local key_tags = prefix .. ":tags:" .. key
+
+for _, tag in ipairs(redis.call("SMEMBERS", key_tags)) do
+    redis.call("SREM", prefix .. ":tag:" .. tag, key)
+end
+redis.call("DEL", key_tags, prefix .. ":stale:" .. key)
+
+if ttl then
+    redis.call("SET", prefix .. ":cache:" .. key, ARGV[3], "PX", ttl)
+else
+    redis.call("SET", prefix .. ":cache:" .. key, ARGV[3])
+end
+
+for i = 5, #ARGV do
+    local tag = prefix .. ":tag:" .. ARGV[i]
+    local existed = redis.call("EXISTS", tag) == 1
+    redis.call("SADD", tag, key)
+    redis.call("SADD", key_tags, ARGV[i])
+    -- a tag lives as long as its longest lived key
+    if not ttl then
+        redis.call("PERSIST", tag)
+    else
+        local current = redis.call("PTTL", tag)
+        if not existed or (current >= 0 and current < ttl) then
+            redis.call("PEXPIRE", tag, ttl)
+        end
+    end
+end
+if ttl and #ARGV >= 5 then
+    redis.call("PEXPIRE", key_tags, ttl)
+end
+return 1
+"""
+
+# ARGV: prefix, "1" to mark stale or "0" to delete, then each tag group as
+# its size followed by its tags.
+INVALIDATE_SCRIPT = """
+redis.replicate_commands()
+local prefix, stale = ARGV[1], ARGV[2] == "1"
+local count, i = 0, 3
+
+while i <= #ARGV do
+    local size, tags = tonumber(ARGV[i]), {}
+    for j = 1, size do
+        tags[j] = prefix .. ":tag:" .. ARGV[i + j]
+    end
+    i = i + size + 1
+
+    for _, key in ipairs(redis.call("SINTER", unpack(tags))) do
+        local ttl = redis.call("PTTL", prefix .. ":cache:" .. key)
+        if ttl == -2 or not stale then
+            local key_tags = prefix .. ":tags:" .. key
+            for _, tag in ipairs(redis.call("SMEMBERS", key_tags)) do
+                redis.call("SREM", prefix .. ":tag:" .. tag, key)
+            end
+            for _, tag in ipairs(tags) do
+                redis.call("SREM", tag, key)
+            end
+            redis.call("DEL", prefix .. ":cache:" .. key, key_tags,
+                       prefix .. ":stale:" .. key)
+        elseif ttl == -1 then
+            redis.call("SET", prefix .. ":stale:" .. key, 1)
+        else
+            redis.call("SET", prefix .. ":stale:" .. key, 1, "PX", ttl)
+        end
+        if ttl ~= -2 then
+            count = count + 1
+        end
+    end
+end
+return count
+"""
+
+
+class CacheBackend(object):
+    """
+    Interface implemented by every cache backend.
+    """
+
+    def get(self, key):
+        """
+        Returns {"value": value, "expires": epoch seconds or None,
+        "tags": set of tags, "stale": bool} for a key, or None if it is
+        missing or expired.
+        """
+
+        raise NotImplementedError
+
+    def set(self, key, value, timeout=None, tags=()):
+        """
+        Store a value for timeout seconds, indexed by the given tags.
+        """
+
+        raise NotImplementedError
+
+    def invalidate(self, tag_groups, stale=False):
+        """
+        Delete every key carrying all of the tags of any of the groups.
+
+        Args:
+            tag_groups: a list of lists of tags
+            stale: mark the keys stale instead of deleting them. Setting a
+                   key again makes it fresh.
+        """
+
+        raise NotImplementedError
+
+    def clear(self):
+        """
+        Delete every key.
+        """
+
+        raise NotImplementedError
+
+    def publish(self, message):
+        """
+        Append a message to the invalidation log.
+
+        Returns:
+            The message id.
+        """
+
+        raise NotImplementedError
+
+    def poll(self, since):
+        """
+        Returns a list of (id, message) published at or after an epoch time.
+        """
+
+        raise NotImplementedError
+
+    def acquire(self, name, owner, timeout):
+        """
+        Take a lease unless someone else holds it.
+
+        Args:
+            name: the lease name
+            owner: a unique token identifying the holder
+            timeout: seconds before the lease lapses if it is not released
+        Returns:
+            True if the lease was taken.
+        """
+
+        raise NotImplementedError
+
+    def release(self, name, owner):
+        """
+        Give up a lease if it is still held by owner.
+        """
+
+        raise NotImplementedError
+
+
+class MongoBackend(CacheBackend):
+    """
+    Stores entries in the cache collection of the competition database.
+    """
+
+    def get(self, key):
+        db = api.common.get_conn()
+        entry = db.cache.find_one({"key": key}, {
+            "_id": 0,
+            "value": 1,
+            "tags": 1,
+            "stale": 1,
+            "expireAt": 1
+        })
+        if entry is None:
+            return None
+
+        expires = None
+        if entry.get("expireAt") is not None:
+            # The TTL monitor only runs once a minute.
+            if entry["expireAt"] < datetime.utcnow():
+                return None
+            expires = time.time() + (
+                entry["expireAt"] - datetime.utcnow()).total_seconds()
+
+        return {
+            "value": pickle.loads(entry["value"]),
+            "expires": expires,
+            "tags": set(entry["tags"]),
+            "stale": entry.get("stale", False)
+        }
+
+    def set(self, key, value, timeout=None, tags=()):
+        db = api.common.get_conn()
+
+        update = {
+            "key": key,
+            "value": pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+            "tags": list(tags)
+        }
+        if timeout is not None:
+            update["expireAt"] = datetime.utcnow() + timedelta(seconds=timeout)
+
+        db.cache.replace_one({"key": key}, update, upsert=True)
+
+    def invalidate(self, tag_groups, stale=False):
+        db = api.common.get_conn()
+
+        match = {
+            "$or": [{"tags": {"$all": list(group)}} for group in tag_groups]
+        }
+        if stale:
+            db.cache.update_many(match, {"$set": {"stale": True}})
+        else:
+            db.cache.delete_many(match)
+
+    def clear(self):
+        db = api.common.get_conn()
+        db.cache.delete_many({})
+
+    def publish(self, message):
+        db = api.common.get_conn()
+        result = db.cache_invalidations.insert_one({
+            "message": message,
+            "time": datetime.utcnow()
+        })
+        return result.inserted_id
+
+    def poll(self, since):
+        db = api.common.get_conn()
+        return [(entry["_id"], entry["message"])
+                for entry in db.cache_invalidations.find({
+                    "time": {"$gte": datetime.utcfromtimestamp(since)}
+                })]
+
+    def acquire(self, name, owner, timeout):
+        db = api.common.get_conn()
+        now = datetime.utcnow()
+
+        # The TTL monitor only runs once a minute.
+        db.cache_leases.delete_many({"name": name, "expireAt": {"$lt": now}})
+        try:
+            db.cache_leases.insert_one({
+                "name": name,
+                "owner": owner,
+                "expireAt": now + timedelta(seconds=timeout)
+            })
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def release(self, name, owner):
+        db = api.common.get_conn()
+        db.cache_leases.delete_one({"name": name, "owner": owner})
+
+
+class MemoryBackend(CacheBackend):
+    """
+    An in-process stand-in for a shared backend. Useful for testing and for
+    running a single worker without a shared cache.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.tags = {}
+        self.log = []
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] is not None and entry["expires"] < time.time():
+                self.entries.pop(key)
+                return None
+            return {
+                "value": pickle.loads(entry["value"]),
+                "expires": entry["expires"],
+                "tags": set(entry["tags"]),
+                "stale": entry["stale"]
+            }
+
+    def set(self, key, value, timeout=None, tags=()):
+        with self.lock:
+            self.entries[key] = {
+                "value": pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                "expires": time.time() + timeout if timeout is not None else None,
+                "tags": frozenset(tags),
+                "stale": False
+            }
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+
+    def invalidate(self, tag_groups, stale=False):
+        with self.lock:
+            for group in tag_groups:
+                keys = set.intersection(
+                    *[self.tags.get(tag, set()) for tag in group])
+                for key in keys:
+                    if not stale:
+                        self.entries.pop(key, None)
+                    elif key in self.entries:
+                        self.entries[key]["stale"] = True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def publish(self, message):
+        _id = uuid.uuid4().hex
+        with self.lock:
+            now = time.time()
+            self.log = [entry for entry in self.log
+                        if now - entry[0] < invalidation_retention]
+            self.log.append((now, _id, message))
+        return _id
+
+    def poll(self, since):
+        with self.lock:
+            return [(_id, message) for at, _id, message in self.log
+                    if at >= since]
+
+    def acquire(self, name, owner, timeout):
+        with self.lock:
+            lease = self.leases.get(name)
+            if lease is not None and lease[1] > time.time():
+                return False
+            self.leases[name] = (owner, time.time() + timeout)
+            return True
+
+    def release(self, name, owner):
+        with self.lock:
+            if self.leases.get(name, (None,))[0] == owner:
+                self.leases.pop(name)
+
+
+class RedisError(InternalException):
+    """
+    An error reply from a redis server.
+    """
+
+    pass
+
+
+class RedisConnection(object):
+    """
+    A minimal client for the redis serialization protocol.
+    """
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, timeout=5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port),
+                                             self.timeout)
+        self.reader = self.sock.makefile("rb")
+        if self.db:
+            self._send([("SELECT", self.db)])
+            self._read_reply()
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = self.reader = None
+
+    @staticmethod
+    def encode(command):
+        """
+        Encode a command as a RESP array of bulk strings.
+        """
+
+        parts = [b"*" + str(len(command)).encode() + b"\r\n"]
+        for arg in command:
+            if isinstance(arg, bytes):
+                data = arg
+            else:
+                data = str(arg).encode("utf-8")
+            parts.append(b"$" + str(len(data)).encode() + b"\r\n" + data +
+                         b"\r\n")
+        return b"".join(parts)
+
+    def _send(self, commands):
+        self.sock.sendall(b"".join(self.encode(c) for c in commands))
+
+    def _read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Redis closed the connection.")
+
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode("utf-8")
+        elif prefix == b"-":
+            raise RedisError(rest.decode("utf-8"))
+        elif prefix == b":":
+            return int(rest)
+        elif prefix == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        elif prefix == b"*":
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+
+        raise RedisError("Unknown reply from redis: {}".format(line))
+
+    def pipeline(self, commands):
+        """
+        Send several commands at once and return their replies in order.
+        Reconnects once if the connection was lost.
+        """
+
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    self._send(commands)
+                    return [self._read_reply() for _ in commands]
+                except (OSError, ConnectionError):
+                    self.close()
+                    if attempt == 1:
+                        raise
+
+    def execute(self, *command):
+        """
+        Send a single command and return its reply.
+        """
+
+        return self.pipeline([command])[0]
+
+
+class RedisBackend(CacheBackend):
+    """
+    Stores entries in a redis compatible key value store.
+
+    Every cache key is a redis string holding the value and its tags. Next
+    to it are a set of its tag names and, once it is stale, a marker, both
+    expiring with it. Each tag is a redis set of the keys carrying it that
+    expires with its longest lived key. Writes and invalidations run as
+    scripts, so they are atomic and keep the tag sets pruned. The
+    invalidation log is a sorted set scored by time.
+    """
+
+    def __init__(self, connection, prefix="picoctf"):
+        self.connection = connection
+        self.prefix = prefix
+
+    def _key(self, key):
+        return "{}:cache:{}".format(self.prefix, key)
+
+    def _tag(self, tag):
+        return "{}:tag:{}".format(self.prefix, tag)
+
+    def _log(self):
+        return "{}:invalidations".format(self.prefix)
+
+    def _stale(self, key):
+        return "{}:stale:{}".format(self.prefix, key)
+
+    def _lease(self, name):
+        return "{}:lease:{}".format(self.prefix, name)
+
+    def get(self, key):
+        data, ttl, stale = self.connection.pipeline([
+            ("GET", self._key(key)), ("PTTL", self._key(key)),
+            ("EXISTS", self._stale(key))
+        ])
+        if data is None:
+            return None
+
+        value, tags = pickle.loads(data)
+        expires = time.time() + ttl / 1000 if ttl >= 0 else None
+        return {
+            "value": value,
+            "expires": expires,
+            "tags": set(tags),
+            "stale": stale == 1
+        }
+
+    def set(self, key, value, timeout=None, tags=()):
+        ttl = "" if timeout is None else max(int(timeout * 1000), 1)
+        self.connection.execute(
+            "EVAL", SET_SCRIPT, 0, self.prefix, key,
+            pickle.dumps((value, list(tags)), pickle.HIGHEST_PROTOCOL), ttl,
+            *tags)
+
+    def invalidate(self, tag_groups, stale=False):
+        args = [self.prefix, "1" if stale else "0"]
+        for group in tag_groups:
+            if len(group) > 0:
+                args.append(len(group))
+                args.extend(group)
+        self.connection.execute("EVAL", INVALIDATE_SCRIPT, 0, *args)
+
+    def clear(self):
+        cursor = "0"
+        while True:
+            cursor, keys = self.connection.execute(
+                "SCAN", cursor, "MATCH", "{}:*".format(self.prefix), "COUNT",
+                1000)
+            cursor = cursor.decode("utf-8")
+            if len(keys) > 0:
+                self.connection.execute("DEL", *keys)
+            if cursor == "0":
+                break
+
+    def publish(self, message):
+        _id = uuid.uuid4().hex
+        now = time.time()
+        self.connection.pipeline([
+            ("ZADD", self._log(), now,
+             pickle.dumps((_id, message), pickle.HIGHEST_PROTOCOL)),
+            ("ZREMRANGEBYSCORE", self._log(), "-inf",
+             now - invalidation_retention)
+        ])
+        return _id
+
+    def poll(self, since):
+        entries = self.connection.execute("ZRANGEBYSCORE", self._log(), since,
+                                          "+inf")
+        return [pickle.loads(entry) for entry in entries]
+
+    def acquire(self, name, owner, timeout):
+        return self.connection.execute("SET", self._lease(name), owner, "NX",
+                                       "PX", max(int(timeout * 1000), 1)) \
+            is not None
+
+    def release(self, name, owner):
+        # Compare and delete atomically so a lapsed lease taken over by
+        # another worker is left alone.
+        self.connection.execute("EVAL", RELEASE_SCRIPT, 1, self._lease(name),
+                                owner)
+
+
+def from_config(config):
+    """
+    Build the backend named by the CACHE_BACKEND app setting.
+    """
+
+    name = config.get("CACHE_BACKEND", "mongo")
+    if name == "mongo":
+        return MongoBackend()
+    elif name == "redis":
+        return RedisBackend(
+            RedisConnection(config["REDIS_ADDR"], config["REDIS_PORT"],
+                            config["REDIS_DB"]),
+            prefix=config["MONGO_DB_NAME"])
+    elif name == "memory":
+        return MemoryBackend()
+
+    raise InternalException("Unknown cache backend {}".format(name))
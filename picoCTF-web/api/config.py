@@ -6,10 +6,24 @@ Note this is just a python script. It does config things.
 
 import datetime
 import json
+import threading
+import time
+from copy import deepcopy
 
 import api
 import api.app
 from api.common import WebException
+from pymongo.errors import PyMongoError
+
+log = api.logger.use(__name__)
+
+# Seconds a worker serves its settings snapshot before checking whether the
+# settings document has a newer version.
+settings_poll_interval = 5
+
+_snapshot = {"settings": None, "version": None, "checked": 0}
+_snapshot_lock = threading.Lock()
+_watcher = {"thread": None}
 
 
 # Helper class for timezones
@@ -168,22 +182,94 @@ default_settings = {
 """ Helper functions to get settings. Do not change these """
 
 
-def get_settings():
+def _load_settings():
+    """
+    Replace the snapshot with the settings document.
+    """
+
     db = api.common.get_conn()
     settings = db.settings.find_one({}, {"_id": 0})
 
     if settings is None:
-        db.settings.insert_one(default_settings)
+        settings = deepcopy(default_settings)
+        settings["version"] = 1
+        db.settings.insert_one(dict(settings))
         # Initialize indexes, runonce
         api.setup.index_mongo()
-        return default_settings
+
+    version = settings.pop("version", 0)
+    with _snapshot_lock:
+        _snapshot.update({
+            "settings": settings,
+            "version": version,
+            "checked": time.time()
+        })
+
+    return settings
+
+
+def get_settings():
+    """
+    Returns the settings from this worker's snapshot. The snapshot is
+    reloaded once the settings document reaches a new version, checked at
+    most every settings_poll_interval seconds. Do not modify the result.
+    """
+
+    with _snapshot_lock:
+        settings = _snapshot["settings"]
+        stale = time.time() - _snapshot["checked"] > settings_poll_interval
+        if stale:
+            _snapshot["checked"] = time.time()
+
+    if settings is None:
+        return _load_settings()
+
+    if stale:
+        db = api.common.get_conn()
+        current = db.settings.find_one({}, {"_id": 0, "version": 1})
+        if current is None or current.get("version", 0) != _snapshot["version"]:
+            return _load_settings()
 
     return settings
 
 
+def get_settings_version():
+    """
+    Returns the version of the settings in this worker's snapshot.
+    """
+
+    get_settings()
+    return _snapshot["version"]
+
+
+def watch_settings():
+    """
+    Follow a change stream on the settings so changes reach this worker
+    without waiting for the next poll. Change streams need a replica set;
+    without one the worker keeps polling.
+    """
+
+    def run():
+        db = api.common.get_conn()
+        try:
+            with db.settings.watch() as stream:
+                for _ in stream:
+                    with _snapshot_lock:
+                        _snapshot["checked"] = 0
+        except PyMongoError as error:
+            log.info("Not watching settings, polling instead: %s", error)
+
+    with _snapshot_lock:
+        if _watcher["thread"] is not None:
+            return
+        _watcher["thread"] = threading.Thread(target=run, daemon=True)
+        _watcher["thread"].start()
+
+
 def change_settings(changes):
     db = api.common.get_conn()
     settings = db.settings.find_one({})
+    settings.pop("version", None)
 
     def check_keys(real, changed):
         keys = list(changed.keys())
@@ -201,4 +287,12 @@ def change_settings(changes):
 
     check_keys(settings, changes)
 
-    db.settings.update_one({"_id": settings["_id"]}, {"$set": changes})
+    db.settings.update_one({
+        "_id": settings["_id"]
+    }, {
+        "$set": changes,
+        "$inc": {
+            "version": 1
+        }
+    })
+    _load_settings()
@@ -9,3 +9,13 @@ SECRET_KEY = "INSECURE_DEFAULT_CHANGE_ME"
 SESSION_COOKIE_DOMAIN = None
 SESSION_COOKIE_PATH = "/"
 SESSION_COOKIE_NAME = "flask"
+
+# Shared cache backend: "mongo", "redis" or "memory" (single worker only)
+CACHE_BACKEND = "mongo"
+REDIS_ADDR = "127.0.0.1"
+REDIS_PORT = 6379
+REDIS_DB = 0
+
+# Achievement event queue: "mongo", drained by the achievements daemon, or
+# "local", drained in the background of the worker that queued the events
+ACHIEVEMENT_QUEUE = "mongo"
@@ -97,9 +97,15 @@ def get_teacher_information(gid):
 
     group = get_group(gid=gid)
 
+    teams = api.team.get_teams_by_tids(group["teachers"])
+    members = api.team.get_members_by_tids(teams, show_disabled=False)
+
     member_information = []
     for tid in group["teachers"]:
-        team_information = api.team.get_team_information(tid=tid)
+        if tid not in teams:
+            raise InternalException("Team does not exist.")
+        team_information = api.team.get_team_information(
+            tid=tid, team=teams[tid], members=members[tid])
         team_information["teacher"] = True
         member_information.append(team_information)
 
@@ -118,12 +124,19 @@ def get_member_information(gid):
 
     group = get_group(gid=gid)
 
+    teams = api.team.get_teams_by_tids(group["members"])
+    members = api.team.get_members_by_tids(
+        [tid for tid, team in teams.items() if team["size"] > 0],
+        show_disabled=False)
+
     member_information = []
     for tid in group["members"]:
-        team = api.team.get_team(tid=tid)
-        if team["size"] > 0:
+        if tid not in teams:
+            raise InternalException("Team does not exist.")
+        if tid in members:
             member_information.append(
-                api.team.get_team_information(tid=team["tid"]))
+                api.team.get_team_information(
+                    tid=tid, team=teams[tid], members=members[tid]))
 
     return member_information
 
@@ -155,6 +168,7 @@ def create_group(tid, group_name):
         },
         "gid": gid
     })
+    api.auth.invalidate_context()
 
     return gid
 
@@ -194,6 +208,11 @@ def change_group_settings(gid, settings):
 
     db.groups.update_one({"gid": group["gid"]}, {"$set": {"settings": settings}})
 
+    # Hidden classrooms change which teams appear on the scoreboard
+    if group["settings"]["hidden"] != settings["hidden"]:
+        api.cache.invalidate_entity("group", group["gid"], stale=True)
+        api.scoreboard.reload_groups()
+
 
 @log_action
 def join_group(gid, tid, teacher=False):
@@ -216,6 +235,9 @@ def join_group(gid, tid, teacher=False):
             api.admin.give_teacher_role(uid=uid)
 
     db.groups.update_one({'gid': gid}, {'$push': {role_group: tid}})
+    api.cache.invalidate_entity("group", gid, stale=True)
+    api.auth.invalidate_context()
+    api.scoreboard.reload_groups()
 
 
 def sync_teacher_status(tid, uid):
@@ -237,6 +259,7 @@ def sync_teacher_status(tid, uid):
     }, {"$set": {
         "teacher": active_teacher_roles > 0
     }})
+    api.auth.invalidate_context()
 
 
 @log_action
@@ -264,6 +287,10 @@ def leave_group(gid, tid):
     if roles["member"]:
         db.groups.update_one({'gid': gid}, {'$pull': {"members": tid}})
 
+    api.cache.invalidate_entity("group", gid, stale=True)
+    api.auth.invalidate_context()
+    api.scoreboard.reload_groups()
+
 
 def switch_role(gid, tid, role):
     """
@@ -312,6 +339,10 @@ def switch_role(gid, tid, role):
     else:
         raise InternalException("Only supported roles are member and teacher.")
 
+    api.cache.invalidate_entity("group", gid, stale=True)
+    api.auth.invalidate_context()
+    api.scoreboard.reload_groups()
+
     # Disable promotion or demotion of teacher account
     #for uid in api.team.get_team_uids(tid=team["tid"]):
     #    sync_teacher_status(tid, uid)
@@ -329,6 +360,8 @@ def delete_group(gid):
     db = api.common.get_conn()
 
     db.groups.delete_many({'gid': gid})
+    api.auth.invalidate_context()
+    api.scoreboard.reload_groups()
 
 
 def get_all_groups():
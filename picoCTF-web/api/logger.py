@@ -2,8 +2,12 @@
 Manage loggers for the api.
 """
 
+import atexit
 import logging
 import logging.handlers
+import os
+import queue
+import threading
 import time
 from datetime import datetime
 from sys import stdout
@@ -12,10 +16,290 @@ import api
 from bson import json_util
 from flask import logging as flask_logging
 from flask import has_request_context, request
+from pymongo.errors import BulkWriteError, PyMongoError
 
 critical_error_timeout = 600
 log = logging.getLogger(__name__)
 
+# Statistics records buffered in memory before new ones are spilled.
+stats_queue_size = 10000
+
+# Statistics records written with a single insert.
+stats_batch_size = 500
+
+# Seconds the statistics writer waits to fill a batch.
+stats_flush_interval = 1
+
+# Seconds to wait before replaying spilled records after a failed write.
+stats_retry_interval = 60
+
+# File receiving statistics records that could not be buffered or written.
+# Records are dropped if this is None.
+stats_spill_path = "/tmp/picoctf_statistics.jsonl"
+
+# Mongo's error code for a write rejected by a unique index.
+DUPLICATE_KEY = 11000
+
+
+class StatsWriter(object):
+    """
+    Writes statistics records to the database from a background thread.
+
+    Records are pushed by requests and written in batches, once the user and
+    team fields are filled in. Records that do not fit in the buffer, or that
+    could not be written, are appended to the spill file and replayed when
+    the writer is idle.
+    """
+
+    def __init__(self,
+                 queue_size=None,
+                 batch_size=None,
+                 flush_interval=None,
+                 spill_path=None):
+        self.records = queue.Queue(queue_size or stats_queue_size)
+        self.batch_size = batch_size or stats_batch_size
+        self.flush_interval = flush_interval or stats_flush_interval
+        self.spill_path = spill_path or stats_spill_path
+        self.dropped = 0
+        self.retry_after = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def push(self, record):
+        """
+        Queue a record without blocking.
+        """
+
+        self._start()
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.spill([record])
+
+    def _start(self):
+        # The thread does not survive forking, so each process starts its own.
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive() and \
+                    self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _collect(self, timeout):
+        """
+        Take up to a batch of records, waiting up to timeout for the first.
+        """
+
+        batch = []
+        try:
+            batch.append(self.records.get(timeout=timeout))
+            while len(batch) < self.batch_size:
+                batch.append(self.records.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._collect(self.flush_interval)
+                if batch:
+                    self.write(batch)
+                elif time.time() >= self.retry_after:
+                    self.replay()
+            except Exception:
+                log.exception("Could not write statistics records.")
+
+    def write(self, records):
+        """
+        Store records, spilling them if the database is unavailable.
+
+        Returns:
+            True if the records were stored.
+        """
+
+        try:
+            self.insert(records)
+            return True
+        except PyMongoError:
+            log.exception("Could not write %d statistics records.",
+                          len(records))
+            self.retry_after = time.time() + stats_retry_interval
+            self.spill(records)
+            return False
+
+    def insert(self, records):
+        enrich_statistics(records)
+        try:
+            api.common.get_conn().statistics.insert_many(
+                records, ordered=False)
+        except BulkWriteError as error:
+            # Records spilled after a partial write keep the _id insert_many
+            # gave them, so the ones already stored are rejected as
+            # duplicates instead of being stored twice.
+            details = error.details
+            if details.get("writeConcernErrors") or any(
+                    write_error["code"] != DUPLICATE_KEY
+                    for write_error in details.get("writeErrors", [])):
+                raise
+
+    def spill(self, records):
+        """
+        Append records to the spill file, or drop them if there is none.
+        """
+
+        if self.spill_path is not None:
+            try:
+                with self.lock, open(self.spill_path, "a") as f:
+                    for record in records:
+                        f.write(json_util.dumps(record) + "\n")
+                return
+            except OSError:
+                log.exception("Could not spill statistics records.")
+
+        if self.dropped == 0:
+            log.warning("Dropping statistics records.")
+        self.dropped += len(records)
+
+    def replay(self):
+        """
+        Write the records in the spill file.
+
+        Returns:
+            The number of records replayed.
+        """
+
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return 0
+
+        # Other processes may append to the file, so it is moved aside first.
+        replaying = "{}.{}".format(self.spill_path, os.getpid())
+        try:
+            with self.lock:
+                os.rename(self.spill_path, replaying)
+        except OSError:
+            return 0
+
+        count = 0
+        with open(replaying) as f:
+            batch = []
+            for line in f:
+                batch.append(json_util.loads(line))
+                if len(batch) < self.batch_size:
+                    continue
+                if not self.write(batch):
+                    # the rest waits for the next replay
+                    self.spill([json_util.loads(line) for line in f])
+                    batch = []
+                    break
+                count, batch = count + len(batch), []
+            if batch and self.write(batch):
+                count += len(batch)
+        os.unlink(replaying)
+
+        return count
+
+    def flush(self):
+        """
+        Write every buffered record from the calling thread.
+        """
+
+        while True:
+            batch = self._collect(0)
+            if not batch:
+                return
+            self.write(batch)
+
+
+stats_writer = StatsWriter()
+atexit.register(stats_writer.flush)
+
+
+def enrich_statistics(records):
+    """
+    Fill in the user fields of statistics records that only have a uid, with
+    one query per collection for the whole batch.
+    """
+
+    pending = [
+        record["user"] for record in records
+        if "user" in record and "username" not in record["user"]
+    ]
+    if not pending:
+        return
+
+    db = api.common.get_conn()
+
+    users = {
+        user["uid"]: user
+        for user in db.users.find({
+            "uid": {
+                "$in": list({user["uid"] for user in pending})
+            }
+        }, {
+            "_id": 0,
+            "uid": 1,
+            "tid": 1,
+            "username": 1,
+            "email": 1
+        })
+    }
+
+    tids = list({user["tid"] for user in users.values()})
+    teams = {
+        team["tid"]: team["team_name"]
+        for team in db.teams.find({
+            "tid": {
+                "$in": tids
+            }
+        }, {
+            "_id": 0,
+            "tid": 1,
+            "team_name": 1
+        })
+    }
+
+    groups = {tid: [] for tid in tids}
+    for group in db.groups.find({
+            "$or": [{
+                "owner": {
+                    "$in": tids
+                }
+            }, {
+                "teachers": {
+                    "$in": tids
+                }
+            }, {
+                "members": {
+                    "$in": tids
+                }
+            }]
+    }, {
+            "_id": 0,
+            "name": 1,
+            "owner": 1,
+            "teachers": 1,
+            "members": 1
+    }):
+        related = [group["owner"]] + group.get("teachers", []) + \
+            group.get("members", [])
+        for tid in set(related):
+            if tid in groups:
+                groups[tid].append(group["name"])
+
+    for entry in pending:
+        user = users.get(entry["uid"])
+        if user is None:
+            continue
+        entry.update({
+            "username": user["username"],
+            "email": user["email"],
+            "team_name": teams.get(user["tid"]),
+            "groups": groups.get(user["tid"], [])
+        })
+
 
 class StatsHandler(logging.StreamHandler):
     """
@@ -89,10 +373,14 @@ class StatsHandler(logging.StreamHandler):
 
     def emit(self, record):
         """
-        Store record into the db.
+        Queue the record for the statistics writer. Only the uid of the user
+        is looked up here, the writer fills in the rest.
         """
 
-        information = get_request_information()
+        information = get_request_description()
+        context = api.auth.get_context()
+        if context is not None:
+            information["user"] = {"uid": context.uid}
 
         result = record.msg
 
@@ -120,7 +408,7 @@ class StatsHandler(logging.StreamHandler):
 
                 information["action"].update(action_result)
 
-            api.common.get_conn().statistics.insert_one(information)
+            stats_writer.push(information)
 
 
 class ExceptionHandler(logging.StreamHandler):
@@ -204,9 +492,10 @@ def use(name):
     return logging.getLogger(name)
 
 
-def get_request_information():
+def get_request_description():
     """
-    Returns a dictionary of contextual information about the user at the time of logging.
+    Returns a dictionary describing the current request, without touching
+    the database.
 
     Returns:
         The dictionary.
@@ -225,18 +514,27 @@ def get_request_information():
             "user_agent": request.user_agent.string
         }
 
-        if api.auth.is_logged_in():
+    return information
 
-            user = api.user.get_user()
-            team = api.user.get_team()
-            groups = api.team.get_groups()
 
-            information["user"] = {
-                "username": user["username"],
-                "email": user["email"],
-                "team_name": team["team_name"],
-                "groups": [group["name"] for group in groups]
-            }
+def get_request_information():
+    """
+    Returns a dictionary of contextual information about the user at the time of logging.
+
+    Returns:
+        The dictionary.
+    """
+
+    information = get_request_description()
+
+    if api.auth.is_logged_in():
+        context = api.auth.get_context()
+        information["user"] = {
+            "username": context.user["username"],
+            "email": context.user["email"],
+            "team_name": context.team["team_name"],
+            "groups": context.group_names
+        }
 
     return information
 
@@ -214,7 +214,7 @@ def insert_problem(problem, sid=None):
                 problem["name"]))
 
     db.problems.insert_one(problem)
-    api.cache.fast_cache.clear()
+    api.cache.invalidate_entity("problem", problem["pid"], stale=True)
 
     return problem["pid"]
 
@@ -233,7 +233,8 @@ def remove_problem(pid):
     problem = get_problem(pid=pid)
 
     db.problems.delete_many({"pid": pid})
-    api.cache.fast_cache.clear()
+    api.cache.invalidate_entity("problem", pid, stale=True)
+    api.symlinks.record_change()
 
     return problem
 
@@ -264,7 +265,13 @@ def update_problem(pid, updated_problem):
     """
 
     db.problems.update_one({"pid": pid}, {'$set': problem})
-    api.cache.fast_cache.clear()
+
+    # Scores of teams that solved the problem change retroactively.
+    if any(field in updated_problem
+           for field in ["score", "category", "disabled"]):
+        api.solve_state.rebuild()
+    api.cache.invalidate_entity("problem", pid, stale=True)
+    api.symlinks.record_change()
 
     return problem
 
@@ -329,6 +336,7 @@ def assign_instance_to_team(pid, tid=None, reassign=False):
 
     db = api.common.get_conn()
     db.teams.update_one({"tid": tid}, {"$set": team})
+    api.auth.invalidate_context()
 
     return instance_number
 
@@ -402,8 +410,20 @@ def grade_problem(pid, key, tid=None):
     if tid is None:
         tid = api.user.get_user()["tid"]
 
-    problem = get_problem(pid=pid)
-    instance = get_instance_data(pid, tid)
+    return grade_instance(get_problem(pid=pid), get_instance_data(pid, tid), key)
+
+
+def grade_instance(problem, instance, key):
+    """
+    Grades a key against a problem instance.
+
+    Args:
+        problem: the problem object
+        instance: the instance assigned to the team
+        key: user's submission
+    Returns:
+        A dict, as returned by grade_problem.
+    """
 
     correct = instance['flag'] in key
     if not correct and DEBUG_KEY is not None:
@@ -416,6 +436,65 @@ def grade_problem(pid, key, tid=None):
     }
 
 
+class TeamState(object):
+    """
+    The parts of a team's progress needed to accept a submission.
+    """
+
+    def __init__(self, tid, eligible, solved, unlocked, instances):
+        """
+        Args:
+            tid: the team id
+            eligible: the team's eligibility
+            solved: the solved pids
+            unlocked: the unlocked pids
+            instances: the team's pid: iid instance map
+        """
+
+        self.tid = tid
+        self.eligible = eligible
+        self.solved = set(solved)
+        self.unlocked = set(unlocked)
+        self.instances = dict(instances)
+
+    def get_instance(self, problem):
+        """
+        Returns the instance of a problem assigned to the team, or None if
+        the team has none or it no longer exists.
+        """
+
+        iid = self.instances.get(problem["pid"])
+        for instance in problem["instances"]:
+            if instance["iid"] == iid:
+                return instance
+        return None
+
+
+@api.cache.memoize(
+    depends={
+        "problem": None,
+        "bundle": None,
+        "submission": "tid",
+        "team": "tid"
+    })
+def get_team_state(tid):
+    """
+    Gets the compact state submit_key checks a submission against.
+
+    Args:
+        tid: the team id
+    Returns:
+        A TeamState.
+    """
+
+    team = api.team.get_team(tid=tid)
+    solved = get_solved_pids(tid=tid)
+
+    return TeamState(tid, team["eligible"], solved,
+                     get_unlock_index().get_unlocked(solved),
+                     team["instances"])
+
+
 @log_action
 def submit_key(tid, pid, key, method, uid=None, ip=None):
     """
@@ -438,11 +517,13 @@ def submit_key(tid, pid, key, method, uid=None, ip=None):
     db = api.common.get_conn()
     validate(submission_schema, {"tid": tid, "pid": pid, "key": key})
 
-    if pid not in get_unlocked_pids(tid, category=None):
+    state = get_team_state(tid)
+
+    if pid not in state.unlocked:
         raise InternalException(
             "You can't submit flags to problems you haven't unlocked.")
 
-    if pid in get_solved_pids(tid=tid):
+    if pid in state.solved:
         exp = WebException(
             "Flag correct: however, your team has already gained those points.")
         exp.data = {'code': 'solved'}
@@ -454,11 +535,16 @@ def submit_key(tid, pid, key, method, uid=None, ip=None):
 
     uid = user["uid"]
 
-    result = grade_problem(pid, key, tid)
-
     problem = get_problem(pid=pid)
 
-    eligibility = api.team.get_team(tid=tid)['eligible']
+    instance = state.get_instance(problem)
+    if instance is None:
+        instance = get_instance_data(pid, tid)
+        state.instances[pid] = instance["iid"]
+
+    result = grade_instance(problem, instance, key)
+
+    eligibility = state.eligible
 
     submission = {
         'uid': uid,
@@ -473,8 +559,22 @@ def submit_key(tid, pid, key, method, uid=None, ip=None):
         'correct': result['correct'],
     }
 
-    if (key, pid) in [(submission["key"], submission["pid"])
-                      for submission in get_submissions(tid=tid)]:
+    # The cached state may predate a teammate's solve on another worker.
+    if result["correct"] and db.submissions.find_one({
+            "tid": tid,
+            "pid": pid,
+            "correct": True
+    }, {"_id": 1}) is not None:
+        exp = WebException(
+            "Flag correct: however, your team has already gained those points.")
+        exp.data = {'code': 'solved'}
+        raise exp
+
+    if db.submissions.find_one({
+            "tid": tid,
+            "pid": pid,
+            "key": key
+    }, {"_id": 1}) is not None:
         exp = WebException(
             "Flag incorrect. Your team has also tried it before.")
         exp.data = {'code': 'repeat'}
@@ -483,6 +583,18 @@ def submit_key(tid, pid, key, method, uid=None, ip=None):
     db.submissions.insert_one(submission)
 
     if submission["correct"]:
+        api.solve_state.record_solve(uid, tid, problem, submission["timestamp"])
+        api.scoreboard.record_solve(uid, tid, pid, submission["timestamp"])
+
+        # Hand out instances of the problems this solve unlocked now rather
+        # than on the team's next problem listing. The listing still assigns
+        # any instance that could not be assigned here.
+        for unlocked_pid in get_unlock_index().get_newly_unlocked(
+                state.solved | {pid}, pid):
+            if unlocked_pid not in state.instances:
+                safe_fail(assign_instance_to_team, unlocked_pid, tid)
+
+        api.cache.invalidate_memoization(get_team_state, {"args": tid})
         api.cache.invalidate_memoization(
             api.stats.get_score, {"kwargs.tid": tid}, {"kwargs.uid": uid})
         api.cache.invalidate_memoization(get_unlocked_pids, {"args": tid})
@@ -493,7 +605,9 @@ def submit_key(tid, pid, key, method, uid=None, ip=None):
                                          {"kwargs.tid": tid},
                                          {"kwargs.uid": uid})
 
-        api.achievement.process_achievements("submit", {
+        api.symlinks.record_change(tid)
+
+        api.achievement.queue_achievements("submit", {
             "uid": uid,
             "tid": tid,
             "pid": pid
@@ -583,7 +697,10 @@ def clear_all_submissions():
     if DEBUG_KEY is not None:
         db = api.common.get_conn()
         db.submissions.delete_many({})
+        api.solve_state.rebuild()
         api.cache.clear_all()
+        api.scoreboard.reset()
+        api.symlinks.record_change()
     else:
         raise InternalException("DEBUG Mode must be enabled")
 
@@ -677,12 +794,16 @@ def reevaluate_all_submissions():
     In the case of the problem being updated, this will reevaluate all submissions.
     """
 
-    api.cache.clear_all()
     for problem in get_all_problems(show_disabled=True):
         reevaluate_submissions_for_problem(problem["pid"])
 
+    api.solve_state.rebuild()
+    api.cache.invalidate_entity("submission", stale=True)
+    api.scoreboard.reset()
+    api.symlinks.record_change()
 
-@api.cache.memoize(timeout=60, fast=True)
+
+@api.cache.memoize(timeout=60, fast=True, depends={"problem": "pid"})
 def get_problem(pid=None, name=None, tid=None, show_disabled=True):
     """
     Gets a single problem.
@@ -755,43 +876,35 @@ def get_all_problems(category=None, show_disabled=False, basic_only=False):
                                                   ('name', pymongo.ASCENDING)]))
 
 
-@api.cache.memoize()
+@api.cache.memoize(
+    depends={"problem": None, "submission": "tid", "team": "tid"},
+    stale_while_revalidate=True)
 def get_solved_problems(tid=None, uid=None, category=None, show_disabled=False):
     """
     Gets the solved problems for a given team or user.
 
     Args:
         tid: The team id
+        uid: The user id, used when no team id is given
         category: Optional parameter to restrict which problems are returned
     Returns:
-        List of solved problem dictionaries
+        List of solved problem dictionaries in the order they were solved
     """
 
     if uid is not None and tid is None:
-        team = api.user.get_team(uid=uid)
+        state = api.solve_state.get_user_state(uid)
     else:
-        team = api.team.get_team(tid=tid)
-
-    members = api.team.get_team_uids(tid=team["tid"])
-
-    submissions = get_submissions(
-        tid=tid, uid=uid, category=category, correctness=True)
-
-    for uid in members:
-        submissions += get_submissions(
-            uid=uid, category=category, correctness=True)
+        state = api.solve_state.get_team_state(
+            api.team.get_team(tid=tid)["tid"] if tid is None else tid)
 
-    pids = []
     result = []
-
-    # Team submissions will take precedence because they appear first in the submissions list.
-    for submission in submissions:
-        if submission["pid"] not in pids:
-            pids.append(submission["pid"])
-            problem = unlocked_filter(get_problem(pid=submission["pid"]), True)
-            problem["solve_time"] = submission["timestamp"]
-            if not problem["disabled"] or show_disabled:
-                result.append(problem)
+    for pid in sorted(state["pids"], key=lambda pid: state["solve_times"][pid]):
+        problem = unlocked_filter(get_problem(pid=pid), True)
+        problem["solve_time"] = state["solve_times"][pid]
+        if category is not None and problem["category"] != category:
+            continue
+        if not problem["disabled"] or show_disabled:
+            result.append(problem)
 
     return result
 
@@ -810,36 +923,140 @@ def get_solved_pids(*args, **kwargs):
     return [problem["pid"] for problem in get_solved_problems(*args, **kwargs)]
 
 
-def is_problem_unlocked(problem, solved):
+class UnlockIndex(object):
     """
-    Checks if the specified problem is unlocked.
+    The bundle dependencies of every enabled problem, compiled by pid.
+
     A problem is unlocked if either:
         1. It has no dependencies in any of the bundles
         2. Its threshold is reached in all bundles that specify a dependency for it
+    """
+
+    def __init__(self, problems, bundles):
+        """
+        Args:
+            problems: the enabled problems, in display order
+            bundles: every bundle
+        """
+
+        self.pids = [problem["pid"] for problem in problems]
+        self.order = {pid: i for i, pid in enumerate(self.pids)}
+        self.categories = {
+            problem["pid"]: problem["category"]
+            for problem in problems
+        }
+
+        pids_by_name = {
+            problem["sanitized_name"]: problem["pid"]
+            for problem in problems
+        }
+
+        # pid: [(weightmap by pid, threshold)]
+        self.requirements = {}
+        # pid: pids whose requirements it contributes weight to
+        self.dependents = {}
+
+        for bundle in bundles:
+            if "dependencies" not in bundle or not bundle["dependencies_enabled"]:
+                continue
+
+            for name, dependency in bundle["dependencies"].items():
+                if name not in bundle["problems"] or name not in pids_by_name:
+                    continue
+
+                pid = pids_by_name[name]
+                weightmap = {
+                    pids_by_name[dependency_name]: weight
+                    for dependency_name, weight in dependency["weightmap"].items()
+                    if dependency_name in pids_by_name
+                }
+                self.requirements.setdefault(pid, []).append(
+                    (weightmap, dependency["threshold"]))
+
+                for dependency_pid in weightmap:
+                    self.dependents.setdefault(dependency_pid, set()).add(pid)
+
+    def is_unlocked(self, pid, solved):
+        """
+        Checks if a problem is unlocked.
+
+        Args:
+            pid: the problem id
+            solved: a set of solved pids
+        """
+
+        return all(
+            sum(weight for dependency_pid, weight in weightmap.items()
+                if dependency_pid in solved) >= threshold
+            for weightmap, threshold in self.requirements.get(pid, []))
+
+    def get_unlocked(self, solved, category=None):
+        """
+        Returns the unlocked pids in display order.
+
+        Args:
+            solved: the solved pids
+            category: Optional parameter to restrict which problems are returned
+        """
+
+        solved = set(solved)
+        return [
+            pid for pid in self.pids
+            if (category is None or self.categories[pid] == category) and
+            self.is_unlocked(pid, solved)
+        ]
+
+    def get_newly_unlocked(self, solved, pid):
+        """
+        Returns the pids unlocked by solving a problem.
+
+        Args:
+            solved: the solved pids, including pid
+            pid: the problem that was just solved
+        """
+
+        solved = set(solved)
+        before = solved - {pid}
+        return sorted(
+            [
+                dependent for dependent in self.dependents.get(pid, ())
+                if self.is_unlocked(dependent, solved) and
+                not self.is_unlocked(dependent, before)
+            ],
+            key=self.order.get)
+
+
+@api.cache.memoize(
+    timeout=60, fast=True, depends={"problem": None, "bundle": None})
+def get_unlock_index():
+    """
+    Returns the compiled unlock index. Do not modify it.
+    """
+
+    return UnlockIndex(get_all_problems(), get_all_bundles())
+
+
+def is_problem_unlocked(problem, solved):
+    """
+    Checks if the specified problem is unlocked.
 
     Args:
         problem: the problem object to check
         solved: the list of solved problem objects
     """
 
-    unlocked = True
+    return get_unlock_index().is_unlocked(
+        problem["pid"], {p["pid"] for p in solved})
 
-    for bundle in get_all_bundles():
-        if problem["sanitized_name"] in bundle["problems"]:
-            if "dependencies" in bundle and bundle["dependencies_enabled"]:
-                if problem["sanitized_name"] in bundle["dependencies"]:
-                    dependency = bundle["dependencies"][problem[
-                        "sanitized_name"]]
-                    weightsum = sum(
-                        dependency['weightmap'].get(p['sanitized_name'], 0)
-                        for p in solved)
-                    if weightsum < dependency['threshold']:
-                        unlocked = False
 
-    return unlocked
-
-
-@api.cache.memoize()
+@api.cache.memoize(
+    depends={
+        "problem": None,
+        "bundle": None,
+        "submission": "tid",
+        "team": "tid"
+    },
+    stale_while_revalidate=True)
 def get_unlocked_pids(tid, category=None):
     """
     Gets the unlocked pids for a given team.
@@ -851,13 +1068,10 @@ def get_unlocked_pids(tid, category=None):
         List of unlocked problem ids
     """
     # Note: Do NOT limit solved problems to category for proper weight count
-    solved = get_solved_problems(tid=tid, category=None)
+    solved = get_solved_pids(tid=tid, category=None)
     team = api.team.get_team(tid=tid)
 
-    unlocked = []
-    for problem in get_all_problems(category=category):
-        if is_problem_unlocked(problem, solved):
-            unlocked.append(problem["pid"])
+    unlocked = get_unlock_index().get_unlocked(solved, category=category)
 
     for pid in unlocked:
         if pid not in team["instances"]:
@@ -1039,7 +1253,11 @@ def load_published(data):
         for bundle in data["bundles"]:
             insert_bundle(bundle)
 
-    api.cache.clear_all()
+    # Each inserted problem has invalidated its own dependents.
+    api.cache.invalidate_entity("bundle", stale=True)
+    api.solve_state.rebuild()
+    api.scoreboard.reset()
+    api.symlinks.record_change()
 
 
 def get_bundle(bid):
@@ -1098,7 +1316,8 @@ def set_bundle_dependencies_enabled(bid, enabled):
     """
 
     update_bundle(bid, {"dependencies_enabled": enabled})
-    api.cache.clear_all()
+    api.cache.invalidate_entity("bundle", bid, stale=True)
+    api.symlinks.record_change()
 
 
 def sanitize_problem_data(data):
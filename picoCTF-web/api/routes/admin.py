@@ -147,8 +147,15 @@ def load_problems_from_shell_server():
 def check_status_of_shell_server():
     sid = request.args.get("sid", None)
 
+    # Without a sid, every server is checked at once
     if sid is None:
-        return WebError("Must provide sid to load from.")
+        statuses = api.shell_servers.get_problem_status_from_servers()
+        if all(status["all_online"] for status in statuses.values()):
+            return WebSuccess(
+                "All problems are online on every server", data=statuses)
+        return WebError(
+            "One or more problems are offline. Please connect and fix the errors.",
+            data=statuses)
 
     all_online, data = api.shell_servers.get_problem_status_from_server(sid)
 
@@ -199,6 +206,13 @@ def bundle_dependencies():
         "Dependencies are now {}.".format("enabled" if state else "disabled"))
 
 
+@blueprint.route("/achievements/processors", methods=["GET"])
+@api_wrapper
+@require_admin
+def get_processor_stats_hook():
+    return WebSuccess(data=api.achievement.get_processor_stats())
+
+
 @blueprint.route("/settings", methods=["GET"])
 @api_wrapper
 @require_admin
@@ -5,8 +5,8 @@ from api.annotations import (api_wrapper, block_after_competition,
                              block_before_competition, check_csrf, log_action,
                              require_admin, require_login, require_teacher)
 from api.common import WebError, WebSuccess
-from flask import (Blueprint, Flask, render_template, request,
-                   send_from_directory, session)
+from flask import (after_this_request, Blueprint, Flask, render_template,
+                   request, send_from_directory, session)
 
 blueprint = Blueprint("stats_api", __name__)
 scoreboard_page_len = 50
@@ -36,7 +36,10 @@ def get_team_score_progression():
     tid = api.user.get_team()["tid"]
 
     return WebSuccess(
-        data=api.stats.get_score_progression(tid=tid, category=category))
+        data=api.stats.get_score_progression(
+            tid=tid,
+            category=category,
+            points=api.stats.progression_points))
 
 
 @blueprint.route('/scoreboard', defaults={'board': None, 'page': 1}, methods=['GET'])
@@ -44,11 +47,18 @@ def get_team_score_progression():
 @api_wrapper
 @block_before_competition(WebError("The competition has not begun yet!"))
 def get_scoreboard_hook(board, page):
-    def get_user_pos(scoreboard, tid):
-        for pos, team in enumerate(scoreboard):
-            if team["tid"] == tid:
-                return pos
-        return 1
+    def get_user_page(key, tid=None):
+        position = 0
+        if tid is not None:
+            position = api.scoreboard.engine.get_position(key, tid) or 0
+        start = math.floor(position / scoreboard_page_len) * scoreboard_page_len
+        result = api.scoreboard.engine.get_page(
+            key, start=start, limit=scoreboard_page_len)
+        return {
+            'pages': math.ceil(result['size'] / scoreboard_page_len),
+            'scoreboard': result['scoreboard'],
+            'start_page': start // scoreboard_page_len + 1
+        }
 
     user = None
     if api.auth.is_logged_in():
@@ -57,80 +67,103 @@ def get_scoreboard_hook(board, page):
     # Old board, limit 1-50
     if board is None:
         result = {'tid': 0, 'groups': []}
-        global_board = api.stats.get_all_team_scores(eligible=True, country=None, show_ineligible=True)
-        result['global'] = {
-            'name': 'global',
-            'pages': math.ceil(len(global_board) / scoreboard_page_len),
-            'start_page': 1
-        }
+        global_key = api.scoreboard.named_board_key("global")
         if user is None:
-            result['global']['scoreboard'] = global_board[:scoreboard_page_len]
+            result['global'] = get_user_page(global_key)
+            result['global']['name'] = 'global'
         else:
             result['tid'] = user['tid']
-            global_pos = get_user_pos(global_board, user["tid"])
-            start_slice = math.floor(global_pos / 50) * 50
-            result['global']['scoreboard'] = global_board[start_slice:start_slice + 50]
-            result['global']['start_page'] = math.ceil((global_pos + 1) / 50)
+            result['global'] = get_user_page(global_key, user['tid'])
+            result['global']['name'] = 'global'
 
             result['country'] = user["country"]
-            student_board = api.stats.get_all_team_scores(eligible=True, country=None, show_ineligible=False)
-            student_pos = get_user_pos(student_board, user["tid"])
-            start_slice = math.floor(student_pos / 50) * 50
-            result['student'] = {
-                'name': 'student',
-                'pages': math.ceil(len(student_board) / scoreboard_page_len),
-                'scoreboard': student_board[start_slice:start_slice + 50],
-                'start_page': math.ceil((student_pos + 1) / 50),
-            }
+            result['student'] = get_user_page(
+                api.scoreboard.named_board_key("student"), user['tid'])
+            result['student']['name'] = 'student'
 
             for group in api.team.get_groups(uid=user["uid"]):
-                # this is called on every scoreboard pageload and should be cached
-                # to support large groups
-                group_board = api.stats.get_group_scores(gid=group['gid'])
-                group_pos = get_user_pos(group_board, user["tid"])
-                start_slice = math.floor(group_pos / 50) * 50
-                result['groups'].append({
-                    'gid':
-                    group['gid'],
-                    'name':
-                    group['name'],
-                    'scoreboard':
-                    group_board[start_slice:start_slice + 50],
-                    'pages': math.ceil(len(group_board) / scoreboard_page_len),
-                    'start_page': math.ceil((group_pos + 1) / 50),
-                })
+                group_board = get_user_page(
+                    api.scoreboard.group_key(group['gid']), user['tid'])
+                group_board['gid'] = group['gid']
+                group_board['name'] = group['name']
+                result['groups'].append(group_board)
 
         return WebSuccess(data=result)
     else:
         if board in ["groups", "global", "student"]:
             # 1-index page
             start = scoreboard_page_len * (page - 1)
-            end = start + scoreboard_page_len
             result = []
-            if api.auth.is_logged_in():
-                user = api.user.get_user()
             if board == "groups":
                 for group in api.team.get_groups(uid=user.get("uid")):
-                    group_board = api.stats.get_group_scores(gid=group['gid'])
+                    group_board = api.scoreboard.engine.get_page(
+                        api.scoreboard.group_key(group['gid']),
+                        start=start,
+                        limit=scoreboard_page_len)
                     result.append({
                         'gid':
                             group['gid'],
                         'name':
                             group['name'],
                         'scoreboard':
-                            group_board[start:end]
+                            group_board['scoreboard']
                     })
-            elif board == "global":
-                result = api.stats.get_all_team_scores(eligible=True, country=None, show_ineligible=True)[start:end]
-            elif board == "student":
-                result = api.stats.get_all_team_scores(eligible=True, country=None, show_ineligible=False)[start:end]
             else:
-                result = []
+                result = api.scoreboard.engine.get_page(
+                    api.scoreboard.named_board_key(board),
+                    start=start,
+                    limit=scoreboard_page_len)['scoreboard']
             return WebSuccess(data=result)
         else:
             return WebError("A valid board must be specified")
 
 
+@blueprint.route('/scoreboard/<board>', methods=['GET'])
+@api_wrapper
+@block_before_competition(WebError("The competition has not begun yet!"))
+def get_scoreboard_page_hook(board):
+    """
+    Returns a page of a board along with the caller's rank.
+
+    Query args:
+        gid: the group of a group board
+        cursor: the next cursor of the previous page
+        limit: the number of teams to return
+    """
+
+    gid = request.args.get("gid", None)
+    cursor = request.args.get("cursor", None)
+    limit = request.args.get("limit", scoreboard_page_len, type=int)
+
+    tid = None
+    if api.auth.is_logged_in():
+        tid = api.user.get_user()["tid"]
+
+    if board == "group":
+        if tid is None or gid not in [
+                group["gid"] for group in api.team.get_groups(tid=tid)
+        ]:
+            return WebError("You are not a member of that classroom.")
+
+    key = api.scoreboard.named_board_key(board, gid=gid)
+
+    result = api.scoreboard.get_page(
+        key, tid=tid, cursor=cursor, limit=max(limit, 1))
+    etag = api.scoreboard.get_etag(result)
+
+    @after_this_request
+    def add_etag(response):
+        response.set_etag(etag)
+        return response.make_conditional(request)
+
+    if etag in request.if_none_match:
+        return WebSuccess(data=None)
+
+    position = result.pop("position")
+    result["rank"] = position + 1 if position is not None else None
+    return WebSuccess(data=result)
+
+
 @blueprint.route('/top_teams/score_progression', methods=['GET'])
 @api_wrapper
 def get_top_teams_score_progressions_hook():
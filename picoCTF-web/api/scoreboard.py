@@ -0,0 +1,606 @@
+"""
+Incremental in-memory scoreboard engine.
+
+The engine is seeded once from the submissions collection and then kept up to
+date as correct submissions arrive, either directly from submit_key or by
+tailing new correct submissions written by other workers. Teams are kept in
+rank order so boards and ranks can be read without rescanning submissions.
+
+Boards are read a page at a time. Pages continue from an opaque cursor naming
+the last team seen, and each page carries an ETag derived from its contents
+so clients can revalidate against any worker.
+"""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+import api
+import pymongo
+from api.common import WebException
+
+log = api.logger.use(__name__)
+
+# Seconds a worker trusts its boards before pulling new solves from mongo.
+refresh_interval = 5
+
+# Seconds of solves each refresh reads again, so submissions that other
+# workers insert after later ones are not missed.
+refresh_overlap = 30
+
+# Seconds between full rebuilds. Picks up team, group and problem changes
+# made by other workers.
+reseed_interval = 600
+
+# Largest page a client may request.
+max_page_size = 100
+
+_epoch = datetime(1970, 1, 1)
+
+
+class Board(object):
+    """
+    A rank ordered set of teams.
+
+    Teams are ordered by score descending and then by last solve time
+    ascending, matching the historical scoreboard ordering. Teams without
+    points are only kept when keep_unscored is set, after every scored team.
+    """
+
+    def __init__(self, keep_unscored=False):
+        self.keys = []
+        self.entries = {}
+        self.keep_unscored = keep_unscored
+
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, tid, score, lastsubmit):
+        """
+        Insert or move a team.
+        """
+
+        self.remove(tid)
+        if score > 0 or self.keep_unscored:
+            if lastsubmit is None:
+                key = (-score, 1, 0, tid)
+            else:
+                key = (-score, 0, lastsubmit, tid)
+            insort(self.keys, key)
+            self.entries[tid] = key
+
+    def remove(self, tid):
+        """
+        Remove a team from the board if it is present.
+        """
+
+        key = self.entries.pop(tid, None)
+        if key is not None:
+            del self.keys[bisect_left(self.keys, key)]
+
+    def rank(self, tid):
+        """
+        Returns the 0-indexed position of a team or None if it is unranked.
+        """
+
+        key = self.entries.get(tid)
+        if key is None:
+            return None
+        return bisect_left(self.keys, key)
+
+    def tids(self, start=0, end=None):
+        """
+        Returns the tids between the given positions in rank order.
+        """
+
+        return [key[-1] for key in self.keys[start:end]]
+
+    def after(self, key):
+        """
+        Returns the position following a key, which need not be on the board.
+        """
+
+        return bisect_right(self.keys, key)
+
+
+def encode_cursor(key):
+    """
+    Encodes a board key as an opaque, url safe cursor.
+    """
+
+    score, unscored, lastsubmit, tid = key
+    if not unscored:
+        lastsubmit = (lastsubmit - _epoch) // timedelta(microseconds=1)
+    data = json.dumps([score, unscored, lastsubmit, tid])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor made by encode_cursor.
+    """
+
+    try:
+        data = base64.urlsafe_b64decode(cursor.encode()).decode()
+        score, unscored, lastsubmit, tid = json.loads(data)
+        if not isinstance(score, int) or unscored not in (0, 1) or \
+                not isinstance(lastsubmit, int) or not isinstance(tid, str):
+            raise ValueError("Malformed cursor")
+        if not unscored:
+            lastsubmit = _epoch + timedelta(microseconds=lastsubmit)
+        return (score, unscored, lastsubmit, tid)
+    except (TypeError, ValueError):
+        raise WebException("Invalid scoreboard cursor.")
+
+
+def board_keys(team):
+    """
+    Returns the keys of every board a team should be ranked on.
+
+    Keys are (eligible, country) pairs, None meaning no restriction.
+    """
+
+    return [(None, None), (team["eligible"], None),
+            (team["eligible"], team["country"])]
+
+
+def group_key(gid):
+    """
+    Returns the key of a group's board.
+    """
+
+    return ("group", gid)
+
+
+class ScoreboardEngine(object):
+    """
+    Keeps each team's score and last solve time in sorted boards.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.seed_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all state. The engine will reseed on the next read.
+        """
+
+        with self.lock:
+            self.teams = {}
+            self.solves = {}
+            self.boards = {}
+            self.team_gids = {}
+            self.problem_scores = {}
+            self.uid_tids = {}
+            self.watermark = None
+            self.seeded_at = None
+            self.refreshed_at = 0
+            self.reset_at = time.time()
+
+    def _load_team(self, team, hidden_tids):
+        self.teams[team["tid"]] = {
+            "name": team["team_name"],
+            "affiliation": team.get("affiliation"),
+            "eligible": team["eligible"],
+            "country": team.get("country"),
+            "visible": team["tid"] not in hidden_tids
+        }
+
+    def _hidden_tids(self, groups=None):
+        """
+        Returns the tids that are exclusively members of hidden groups.
+        """
+
+        if groups is None:
+            groups = api.group.get_all_groups()
+
+        visible, hidden = set(), set()
+        for group in groups:
+            tids = set(group["members"]) | set(group["teachers"])
+            tids.add(group["owner"])
+            if group["settings"]["hidden"]:
+                hidden |= tids
+            else:
+                visible |= tids
+        return hidden - visible
+
+    def _load_groups(self, groups):
+        """
+        Rebuild group membership and team visibility.
+        """
+
+        hidden_tids = self._hidden_tids(groups)
+        for tid, team in self.teams.items():
+            team["visible"] = tid not in hidden_tids
+
+        for key in [key for key in self.boards if key[0] == "group"]:
+            del self.boards[key]
+
+        self.team_gids = {}
+        for group in groups:
+            self.boards[group_key(group["gid"])] = Board(keep_unscored=True)
+            for tid in group["members"]:
+                self.team_gids.setdefault(tid, []).append(group["gid"])
+
+    def _place(self, tid):
+        """
+        Reposition a team on every board it belongs to.
+        """
+
+        team = self.teams.get(tid)
+        if team is None:
+            return
+
+        solves = self.solves.get(tid, {"score": 0, "lastsubmit": None})
+        for key in board_keys(team):
+            board = self.boards.setdefault(key, Board())
+            if team["visible"]:
+                board.update(tid, solves["score"], solves["lastsubmit"])
+            else:
+                board.remove(tid)
+
+        # Group boards list every member, hidden or not.
+        for gid in self.team_gids.get(tid, ()):
+            self.boards[group_key(gid)].update(tid, solves["score"],
+                                               solves["lastsubmit"])
+
+    def _apply(self, uid, tid, pid, timestamp):
+        """
+        Count a correct submission. Solves are idempotent so the same
+        submission may be applied more than once.
+
+        Returns:
+            The tid whose score changed, or None.
+        """
+
+        # A user's solves follow them to their current team.
+        tid = self.uid_tids.get(uid, tid)
+        score = self.problem_scores.get(pid)
+        if score is None:
+            return None
+
+        solves = self.solves.setdefault(tid, {
+            "score": 0,
+            "lastsubmit": None,
+            "pids": set()
+        })
+        if pid in solves["pids"]:
+            return None
+
+        solves["pids"].add(pid)
+        solves["score"] += score
+        if solves["lastsubmit"] is None or timestamp > solves["lastsubmit"]:
+            solves["lastsubmit"] = timestamp
+
+        return tid
+
+    def seed(self):
+        """
+        Rebuild the engine from the database.
+
+        The new state is built without holding the lock, so solves can still
+        be recorded, and swapped in once complete. Solves recorded meanwhile
+        are read back by the refresh that follows.
+        """
+
+        started = time.time()
+        fresh = ScoreboardEngine()
+        fresh._build()
+
+        with self.lock:
+            for name in [
+                    "teams", "solves", "boards", "team_gids",
+                    "problem_scores", "uid_tids", "watermark"
+            ]:
+                setattr(self, name, getattr(fresh, name))
+
+            # A reset while building may have been for a change the new
+            # state missed, so the next read seeds again.
+            if self.reset_at <= started:
+                self.seeded_at = started
+            self.refresh()
+
+        log.debug("Seeded scoreboard with %d teams.", len(self.teams))
+
+    def _build(self):
+        """
+        Load every team, group and solve into an unused engine.
+        """
+
+        db = api.common.get_conn()
+
+        self.problem_scores = {
+            problem["pid"]: problem["score"]
+            for problem in db.problems.find({
+                "disabled": False
+            }, {
+                "_id": 0,
+                "pid": 1,
+                "score": 1
+            })
+        }
+        self.uid_tids = {
+            user["uid"]: user["tid"]
+            for user in db.users.find({}, {"_id": 0, "uid": 1, "tid": 1})
+        }
+
+        groups = api.group.get_all_groups()
+        for team in api.team.get_all_teams(show_ineligible=True):
+            self._load_team(team, ())
+        self._load_groups(groups)
+
+        summaries = api.scoring.get_all_team_summaries(cache=False)
+        for tid, summary in summaries.items():
+            self.solves[tid] = {
+                "score": summary["score"],
+                "lastsubmit": summary["lastsubmit"],
+                "pids": set(summary["pids"])
+            }
+            if self.watermark is None or \
+                    summary["lastsubmit"] > self.watermark:
+                self.watermark = summary["lastsubmit"]
+
+        for tid in self.teams:
+            self._place(tid)
+
+    def refresh(self):
+        """
+        Pull correct submissions recorded since the last pulled solve.
+
+        Only solves read from the database move the watermark. Solves this
+        worker records itself do not, since other workers may still insert
+        earlier ones.
+        """
+
+        db = api.common.get_conn()
+
+        with self.lock:
+            match = {"correct": True}
+            if self.watermark is not None:
+                match["timestamp"] = {
+                    "$gte": self.watermark - timedelta(seconds=refresh_overlap)
+                }
+
+            for submission in db.submissions.find(match, {
+                    "_id": 0,
+                    "uid": 1,
+                    "tid": 1,
+                    "pid": 1,
+                    "timestamp": 1
+            }).sort("timestamp", pymongo.ASCENDING):
+                self.record_solve(submission["uid"], submission["tid"],
+                                  submission["pid"], submission["timestamp"])
+                if self.watermark is None or \
+                        submission["timestamp"] > self.watermark:
+                    self.watermark = submission["timestamp"]
+
+            self.refreshed_at = time.time()
+
+    def reload_groups(self):
+        """
+        Pick up group membership and visibility changes without reseeding.
+        """
+
+        with self.lock:
+            if self.seeded_at is None:
+                return
+
+            self._load_groups(api.group.get_all_groups())
+            for tid in self.teams:
+                self._place(tid)
+
+    def ensure_fresh(self):
+        """
+        Seed or refresh the engine if its state is too old.
+        """
+
+        if self._seed_due():
+            # One thread reseeds. The others keep reading the current boards,
+            # or wait for the first seed if there are none yet.
+            if self.seed_lock.acquire(blocking=self.seeded_at is None):
+                try:
+                    if self._seed_due():
+                        self.seed()
+                        return
+                finally:
+                    self.seed_lock.release()
+
+        if time.time() - self.refreshed_at > refresh_interval:
+            with self.lock:
+                if time.time() - self.refreshed_at > refresh_interval:
+                    self.refresh()
+
+    def _seed_due(self):
+        return self.seeded_at is None or \
+            time.time() - self.seeded_at > reseed_interval
+
+    def record_solve(self, uid, tid, pid, timestamp):
+        """
+        Update the boards for a single correct submission.
+        """
+
+        with self.lock:
+            if self.seeded_at is None:
+                return
+
+            if self.uid_tids.get(uid, tid) not in self.teams:
+                team = api.team.get_team(tid=self.uid_tids.get(uid, tid))
+                if team["size"] == 0:
+                    return
+                self._load_team(team, self._hidden_tids())
+
+            changed = self._apply(uid, tid, pid, timestamp)
+            if changed is not None:
+                self._place(changed)
+
+    def get_board(self, eligible=None, country=None, start=0, end=None):
+        """
+        Returns the board entries between the given positions.
+        """
+
+        self.ensure_fresh()
+
+        with self.lock:
+            board = self.boards.get((eligible, country), Board())
+            return [{
+                "name": self.teams[tid]["name"],
+                "tid": tid,
+                "score": self.solves[tid]["score"],
+                "affiliation": self.teams[tid]["affiliation"]
+            } for tid in board.tids(start, end)]
+
+    def get_rank(self, tid, eligible=None, country=None):
+        """
+        Returns the 0-indexed rank of a team on a board, or None.
+        """
+
+        return self.get_position((eligible, country), tid)
+
+    def get_position(self, key, tid):
+        """
+        Returns the 0-indexed position of a team on any board, or None.
+        """
+
+        self.ensure_fresh()
+
+        with self.lock:
+            board = self.boards.get(key)
+            return board.rank(tid) if board is not None else None
+
+    def get_board_size(self, eligible=None, country=None):
+        """
+        Returns the number of ranked teams on a board.
+        """
+
+        self.ensure_fresh()
+
+        with self.lock:
+            return len(self.boards.get((eligible, country), ()))
+
+    def get_page(self, key, tid=None, cursor=None, start=0, limit=None):
+        """
+        Read one page of a board.
+
+        Args:
+            key: the board key
+            tid: a team whose rank should be looked up
+            cursor: continue after the team the cursor was made for
+            start: the position to start from when there is no cursor
+            limit: the page size, defaults to the rest of the board
+        Returns:
+            A dict with the page's entries, their 1-indexed rank, the cursor
+            of the next page, the board size and the team's 0-indexed rank.
+        """
+
+        self.ensure_fresh()
+
+        with self.lock:
+            board = self.boards.get(key, Board())
+            if cursor is not None:
+                start = board.after(cursor)
+            end = None if limit is None else start + limit
+
+            keys = board.keys[start:end]
+            entries = []
+            for rank, board_key in enumerate(keys, start + 1):
+                team = self.teams[board_key[-1]]
+                entries.append({
+                    "name": team["name"],
+                    "tid": board_key[-1],
+                    "score": -board_key[0],
+                    "affiliation": team["affiliation"],
+                    "eligible": team["eligible"],
+                    "rank": rank
+                })
+
+            more = end is not None and end < len(board)
+            return {
+                "scoreboard": entries,
+                "next": encode_cursor(keys[-1]) if keys and more else None,
+                "size": len(board),
+                "position": board.rank(tid) if tid is not None else None
+            }
+
+
+engine = ScoreboardEngine()
+
+
+def board_key(eligible=None, country=None, show_ineligible=False):
+    """
+    Translates get_all_team_scores style arguments into a board key.
+    """
+
+    if show_ineligible:
+        return (None, None)
+    return (bool(eligible), country)
+
+
+def record_solve(uid, tid, pid, timestamp):
+    """
+    Notify the engine of a correct submission.
+    """
+
+    engine.record_solve(uid, tid, pid, timestamp)
+
+
+def named_board_key(board, gid=None):
+    """
+    Translates a board name used by the scoreboard routes into a board key.
+
+    Args:
+        board: global, student or group
+        gid: the group id of a group board
+    """
+
+    if board == "global":
+        return (None, None)
+    elif board == "student":
+        return (True, None)
+    elif board == "group" and gid is not None:
+        return group_key(gid)
+    raise WebException("A valid board must be specified")
+
+
+def get_page(key, tid=None, cursor=None, limit=50):
+    """
+    Read a page of a board starting after a cursor. See
+    ScoreboardEngine.get_page.
+    """
+
+    if cursor is not None:
+        cursor = decode_cursor(cursor)
+    return engine.get_page(
+        key, tid=tid, cursor=cursor, limit=min(limit, max_page_size))
+
+
+def get_etag(page):
+    """
+    Returns the ETag of a page read with get_page. It is a hash of the page,
+    so every worker that has seen the same solves agrees on it.
+    """
+
+    data = json.dumps(page, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def reload_groups():
+    """
+    Notify the engine of a change to group membership or visibility.
+    """
+
+    engine.reload_groups()
+
+
+def reset():
+    """
+    Force the engine to reseed on its next read. Call after changes to
+    problems, team membership or group visibility.
+    """
+
+    engine.reset()
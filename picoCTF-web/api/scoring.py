@@ -0,0 +1,179 @@
+"""
+Bulk scoring for every team in a single aggregation over submissions.
+"""
+
+from collections import defaultdict
+
+import api
+
+
+def _solve_pipeline():
+    """
+    Builds the aggregation that scores every team.
+
+    Each user's solves are credited to the team the user is on now, looked
+    up in users, rather than to the tid recorded on the submission. Solves
+    of users that no longer exist stay with the team of their latest solve
+    of the problem.
+    A team scores each problem once, at the time any of its members first
+    solved it.
+    """
+
+    return [
+        {"$match": {"correct": True}},
+        {"$sort": {"timestamp": 1}},
+        # First correct submission per user and problem.
+        {"$group": {
+            "_id": {"uid": "$uid", "pid": "$pid"},
+            "tid": {"$last": "$tid"},
+            "timestamp": {"$min": "$timestamp"}
+        }},
+        {"$lookup": {
+            "from": "users",
+            "localField": "_id.uid",
+            "foreignField": "uid",
+            "as": "user"
+        }},
+        {"$project": {
+            "pid": "$_id.pid",
+            "timestamp": 1,
+            "tid": {"$ifNull": [{"$arrayElemAt": ["$user.tid", 0]}, "$tid"]}
+        }},
+        # First solve per team and problem.
+        {"$group": {
+            "_id": {"tid": "$tid", "pid": "$pid"},
+            "timestamp": {"$min": "$timestamp"}
+        }},
+        {"$lookup": {
+            "from": "problems",
+            "localField": "_id.pid",
+            "foreignField": "pid",
+            "as": "problem"
+        }},
+        {"$unwind": "$problem"},
+        {"$match": {"problem.disabled": False}},
+        {"$group": {
+            "_id": {"tid": "$_id.tid", "category": "$problem.category"},
+            "score": {"$sum": "$problem.score"},
+            "count": {"$sum": 1},
+            "lastsubmit": {"$max": "$timestamp"},
+            "pids": {"$push": "$_id.pid"}
+        }},
+        {"$group": {
+            "_id": "$_id.tid",
+            "score": {"$sum": "$score"},
+            "solved": {"$sum": "$count"},
+            "lastsubmit": {"$max": "$lastsubmit"},
+            "categories": {"$push": {"category": "$_id.category",
+                                     "count": "$count"}},
+            "pids": {"$push": "$pids"}
+        }}
+    ]
+
+
+@api.cache.memoize(
+    timeout=30,
+    fast=True,
+    depends={"problem": None, "submission": None, "team": None},
+    single_flight=True)
+def get_all_team_summaries():
+    """
+    Computes score, solve count, last solve time and per-category solve counts
+    for every team that has solved a problem.
+
+    The result is shared by the stats functions for a short time so a stats
+    refresh only runs the aggregation once.
+
+    Returns:
+        A dict of tid: {tid, score, solved, lastsubmit, categories, pids}
+    """
+
+    db = api.common.get_conn()
+
+    summaries = {}
+    for entry in db.submissions.aggregate(_solve_pipeline(), allowDiskUse=True):
+        summaries[entry["_id"]] = {
+            "tid": entry["_id"],
+            "score": entry["score"],
+            "solved": entry["solved"],
+            "lastsubmit": entry["lastsubmit"],
+            "categories": {
+                category["category"]: category["count"]
+                for category in entry["categories"]
+            },
+            "pids": [pid for pids in entry["pids"] for pid in pids]
+        }
+
+    return summaries
+
+
+def get_team_summary(tid, summaries=None):
+    """
+    Returns a team's summary, or an empty one if it has not solved anything.
+    """
+
+    if summaries is None:
+        summaries = get_all_team_summaries()
+
+    return summaries.get(tid, {
+        "tid": tid,
+        "score": 0,
+        "solved": 0,
+        "lastsubmit": None,
+        "categories": {},
+        "pids": []
+    })
+
+
+def get_member_breakdowns(tids=None):
+    """
+    Tallies every submission by team and user in a single aggregation.
+
+    Args:
+        tids: optional list of teams to restrict the breakdown to
+    Returns:
+        A dict of tid: {uid: breakdown}. Breakdowns default missing counts
+        to zero and include submits, correct, incorrect, times and a count
+        per solved category. Members without submissions map to None.
+    """
+
+    db = api.common.get_conn()
+
+    match = {}
+    if tids is not None:
+        match["tid"] = {"$in": list(tids)}
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"tid": "$tid", "uid": "$uid"},
+            "submits": {"$sum": 1},
+            "correct": {"$sum": {"$cond": ["$correct", 1, 0]}},
+            "times": {"$push": "$timestamp"},
+            "categories": {"$push": {"$cond": ["$correct", "$category", None]}}
+        }}
+    ]
+
+    breakdowns = defaultdict(dict)
+    if tids is not None:
+        for tid in tids:
+            breakdowns[tid] = {}
+
+    for entry in db.submissions.aggregate(pipeline, allowDiskUse=True):
+        breakdown = defaultdict(int)
+        breakdown["submits"] = entry["submits"]
+        breakdown["correct"] = entry["correct"]
+        breakdown["incorrect"] = entry["submits"] - entry["correct"]
+        breakdown["times"] = entry["times"]
+        for category in entry["categories"]:
+            if category is not None:
+                breakdown[category] += 1
+        breakdowns[entry["_id"]["tid"]][entry["_id"]["uid"]] = breakdown
+
+    member_match = {"disabled": False}
+    if tids is not None:
+        member_match["tid"] = {"$in": list(tids)}
+    for user in db.users.find(member_match, {"_id": 0, "uid": 1, "tid": 1}):
+        breakdowns[user["tid"]].setdefault(user["uid"], None)
+
+    return dict(breakdowns)
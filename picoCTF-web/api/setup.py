@@ -33,6 +33,8 @@ def index_mongo():
        db.submissions.create_index([("uid", 1), ("correct", 1)])
        db.submissions.create_index([("tid", 1), ("correct", 1)])
        db.submissions.create_index([("pid", 1), ("correct", 1)])
+       db.submissions.create_index([("correct", 1), ("timestamp", 1)])
+       db.submissions.create_index([("tid", 1), ("pid", 1), ("key", 1)])
     except:
        pass
     if "uid" not in db.submissions.index_information():
@@ -52,11 +54,40 @@ def index_mongo():
 
     if "expireAt" not in db.cache.index_information():
        db.cache.create_index("expireAt", expireAfterSeconds=0)
-    if "kwargs" not in db.cache.index_information():
-       db.cache.create_index("kwargs", name="kwargs")
-    try:
-       db.cache.create_index([("function", 1), ("ordered_kwargs", 1)])
-    except:
-       pass
-    if "args" not in db.cache.index_information():
-       db.cache.create_index("args", name="args")
+    if "key" not in db.cache.index_information():
+       # Entries of the old cache format have no key and would collide.
+       db.cache.delete_many({"key": {"$exists": False}})
+       db.cache.create_index("key", unique=True, name="key")
+    if "tags" not in db.cache.index_information():
+       db.cache.create_index("tags", name="tags")
+
+    if "time" not in db.cache_invalidations.index_information():
+       db.cache_invalidations.create_index("time", expireAfterSeconds=300, name="time")
+
+    if "owner" not in db.achievement_queue.index_information():
+       db.achievement_queue.create_index([("owner", 1), ("created", 1)], name="owner")
+    if "tid" not in db.achievement_queue.index_information():
+       db.achievement_queue.create_index("tid", name="tid")
+    if "tid" not in db.achievement_locks.index_information():
+       db.achievement_locks.create_index("tid", unique=True, name="tid")
+    if "expireAt" not in db.achievement_locks.index_information():
+       db.achievement_locks.create_index("expireAt", expireAfterSeconds=0, name="expireAt")
+
+    if "name" not in db.cache_leases.index_information():
+       db.cache_leases.create_index("name", unique=True, name="name")
+    if "expireAt" not in db.cache_leases.index_information():
+       db.cache_leases.create_index("expireAt", expireAfterSeconds=0, name="expireAt")
+
+    if "tid" not in db.team_state.index_information():
+       db.team_state.create_index("tid", unique=True, name="tid")
+    if "uid" not in db.user_state.index_information():
+       db.user_state.create_index("uid", unique=True, name="uid")
+    if "tid" not in db.user_state.index_information():
+       db.user_state.create_index("tid", name="tid")
+
+    if "sid_username" not in db.symlink_state.index_information():
+       db.symlink_state.create_index([("sid", 1), ("username", 1)], unique=True, name="sid_username")
+    if "username" not in db.symlink_state.index_information():
+       db.symlink_state.create_index("username", name="username")
+    if "sid_version" not in db.symlink_deltas.index_information():
+       db.symlink_deltas.create_index([("sid", 1), ("version", 1)], name="sid_version")
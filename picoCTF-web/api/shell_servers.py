@@ -1,4 +1,7 @@
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import api
 import pymongo
@@ -7,6 +10,20 @@ from api.common import (check, InternalException, safe_fail, validate,
                         WebException)
 from voluptuous import Length, Required, Schema
 
+log = api.logger.use(__name__)
+
+# Seconds a pooled connection may go unused before it is closed.
+connection_idle_timeout = 300
+
+# Seconds a pooled connection is trusted before it is checked again.
+connection_check_interval = 30
+
+# Shell servers whose status is checked at once.
+status_workers = 8
+
+__pool = {}
+__pool_lock = threading.Lock()
+
 server_schema = Schema(
     {
         Required("name"):
@@ -80,28 +97,161 @@ def get_server_number(sid):
     return server.get("server_number")
 
 
-def get_connection(sid):
+class PooledConnection(object):
     """
-    Attempts to connect to the given server and returns a connection.
+    An SSH connection to a shell server shared through the connection pool.
+    Behaves like a spur.SshShell, except that leaving a with block returns
+    the connection to the pool instead of closing it.
     """
 
-    server = get_server(sid)
-
-    try:
-        shell = spur.SshShell(
+    def __init__(self, sid, server):
+        self.sid = sid
+        self.credentials = _credentials(server)
+        self.shell = spur.SshShell(
             hostname=server["host"],
             username=server["username"],
             password=server["password"],
             port=server["port"],
             missing_host_key=spur.ssh.MissingHostKey.accept,
             connect_timeout=10)
-        shell.run(["echo", "connected"])
-    except spur.ssh.ConnectionError as e:
-        raise WebException(
-            "Cannot connect to {}@{}:{} with the specified password".format(
-                server["username"], server["host"], server["port"]))
+        self.lock = threading.Lock()
+        self.last_used = self.last_checked = 0
+
+    def check(self):
+        """
+        Runs a command to make sure the connection works.
+        """
+
+        self.shell.run(["echo", "connected"])
+        self.last_checked = time.time()
+
+    def __getattr__(self, name):
+        return getattr(self.shell, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.touch()
+        if exc_type is not None and issubclass(exc_type,
+                                               spur.ssh.ConnectionError):
+            discard_connection(self.sid, self)
+
+    def touch(self):
+        """
+        Keeps a connection that is in use, e.g., by a long running process,
+        from expiring.
+        """
 
-    return shell
+        self.last_used = time.time()
+
+    def close(self):
+        """
+        Returns the connection to the pool. Use discard_connection to close
+        it.
+        """
+
+        self.touch()
+
+
+def _credentials(server):
+    return (server["host"], server["port"], server["username"],
+            server["password"])
+
+
+def _expire_connections():
+    now = time.time()
+    with __pool_lock:
+        for sid, connection in list(__pool.items()):
+            if now - connection.last_used > connection_idle_timeout:
+                del __pool[sid]
+                connection.shell.close()
+
+
+def discard_connection(sid, connection=None):
+    """
+    Close the pooled connection to a server.
+
+    Args:
+        sid: the server id
+        connection: only discard this connection, not a newer replacement
+    """
+
+    with __pool_lock:
+        pooled = __pool.get(sid)
+        if pooled is None or (connection is not None and
+                              pooled is not connection):
+            return
+        del __pool[sid]
+
+    pooled.shell.close()
+
+
+def _pooled_connection(sid, server):
+    """
+    Returns the pooled connection to a server, replacing it if the server's
+    credentials changed.
+    """
+
+    with __pool_lock:
+        connection = __pool.get(sid)
+        if connection is None or connection.credentials != _credentials(
+                server):
+            stale, connection = connection, PooledConnection(sid, server)
+            __pool[sid] = connection
+            if stale is not None:
+                stale.shell.close()
+    return connection
+
+
+def get_connection(sid):
+    """
+    Returns a connection to the given server. Connections are pooled by
+    server and checked before reuse if they have not been checked recently. A
+    broken connection is replaced by a new one.
+    """
+
+    _expire_connections()
+
+    server = get_server(sid)
+
+    # a connection that worked before is given one reconnect
+    for attempt in range(2):
+        connection = _pooled_connection(sid, server)
+        try:
+            with connection.lock:
+                if time.time(
+                ) - connection.last_checked > connection_check_interval:
+                    connection.check()
+                connection.last_used = time.time()
+            return connection
+        except spur.ssh.ConnectionError as e:
+            discard_connection(sid, connection)
+            if not connection.last_checked:
+                break
+            log.info("Reconnecting to shell server %s.", server["name"])
+
+    raise WebException(
+        "Cannot connect to {}@{}:{} with the specified password".format(
+            server["username"], server["host"], server["port"]))
+
+
+def run_command(sid, command, **kwargs):
+    """
+    Runs a command on a shell server over its pooled connection, retrying
+    once on a new connection if the pooled one broke.
+
+    Returns:
+        The spur execution result.
+    """
+
+    connection = get_connection(sid)
+    try:
+        with connection:
+            return connection.run(command, **kwargs)
+    except spur.ssh.ConnectionError as e:
+        with get_connection(sid) as connection:
+            return connection.run(command, **kwargs)
 
 
 def ensure_setup(shell):
@@ -215,6 +365,7 @@ def remove_server(sid):
             "Shell server with sid '{}' does not exist.".format(sid))
 
     db.shell_servers.delete_many({"sid": sid})
+    discard_connection(sid)
 
 
 def get_servers(get_all=False):
@@ -246,7 +397,7 @@ def get_problem_status_from_server(sid):
     Connects to the server and checks the status of the problems running there.
     Runs `sudo shell_manager status --json` and parses its output.
 
-    Closes connection after running command.
+    Uses the pooled connection to the server.
 
     Args:
         sid: The sid of the server to check
@@ -257,13 +408,12 @@ def get_problem_status_from_server(sid):
             - The output data of shell_manager status --json
     """
 
-    shell = get_connection(sid)
-    ensure_setup(shell)
+    with get_connection(sid) as shell:
+        ensure_setup(shell)
 
-    with shell:
-        output = shell.run(
-            ["sudo", "/picoCTF-env/bin/shell_manager", "status",
-             "--json"]).output.decode("utf-8")
+    output = run_command(
+        sid, ["sudo", "/picoCTF-env/bin/shell_manager", "status",
+              "--json"]).output.decode("utf-8")
     data = json.loads(output)
 
     all_online = True
@@ -281,12 +431,47 @@ def get_problem_status_from_server(sid):
     return (all_online, data)
 
 
+def get_problem_status_from_servers(sids=None):
+    """
+    Checks the status of the problems on several servers at once.
+
+    Args:
+        sids: The sids of the servers to check. Defaults to every server.
+
+    Returns:
+        A dict keyed by sid of dicts containing:
+            all_online: True if all problems are online
+            data: The output data of shell_manager status --json
+            error: A message if the server could not be checked, in which
+                   case all_online is False and data is None
+    """
+
+    if sids is None:
+        sids = [server["sid"] for server in get_servers(get_all=True)]
+
+    def check_server(sid):
+        try:
+            all_online, data = get_problem_status_from_server(sid)
+            return {"all_online": all_online, "data": data, "error": None}
+        except Exception as e:
+            log.warning("Could not check the status of shell server %s: %s",
+                        sid, e)
+            return {"all_online": False, "data": None, "error": str(e)}
+
+    if len(sids) == 0:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(status_workers,
+                                            len(sids))) as pool:
+        return dict(zip(sids, pool.map(check_server, sids)))
+
+
 def load_problems_from_server(sid):
     """
     Connects to the server and loads the problems from its deployment state.
     Runs `sudo shell_manager publish` and captures its output.
 
-    Closes connection after running command.
+    Uses the pooled connection to the server.
 
     Args:
         sid: The sid of the server to load problems from.
@@ -295,10 +480,8 @@ def load_problems_from_server(sid):
         The number of problems loaded
     """
 
-    shell = get_connection(sid)
-
-    with shell:
-        result = shell.run(["sudo", "/picoCTF-env/bin/shell_manager", "publish"])
+    result = run_command(sid,
+                         ["sudo", "/picoCTF-env/bin/shell_manager", "publish"])
     data = json.loads(result.output.decode("utf-8"))
 
     # Pass along the server
@@ -0,0 +1,430 @@
+"""
+Materialized solve state of every team and user.
+
+The team_state and user_state collections hold each team's and user's solved
+pids, first solve times, score, solve count and per-category counts. Correct
+submissions update both documents in place, so reading a score is a single
+indexed fetch instead of a scan over submissions.
+
+Each state also keeps its score progression as an append-only series of
+[time, points] pairs, overall and per category. Reads accumulate the series
+and may downsample it to a fixed number of points.
+
+The documents can always be rebuilt from the submissions collection, which
+remains the source of truth. This is done after changes that alter scores
+retroactively, such as disabling a problem or a user switching teams, and
+once at startup when no states exist yet, as after an upgrade.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+import api
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+log = api.logger.use(__name__)
+
+# Seconds before a rebuild's snapshot from which solves are recorded again
+# afterwards, covering submissions graded while the snapshot was read.
+rebuild_overlap = 30
+
+# Seconds one worker may spend building missing states before another
+# worker tries.
+startup_rebuild_timeout = 600
+
+
+def empty_state():
+    """
+    Returns the state of a team or user without solves.
+    """
+
+    return {
+        "pids": [],
+        "solve_times": {},
+        "score": 0,
+        "solved": 0,
+        "categories": {},
+        "lastsubmit": None,
+        "progression": [],
+        "category_progression": {}
+    }
+
+
+def _solve_update(problem, timestamp):
+    pid = problem["pid"]
+    return {
+        "$addToSet": {
+            "pids": pid
+        },
+        "$min": {
+            "solve_times." + pid: timestamp
+        },
+        "$max": {
+            "lastsubmit": timestamp
+        },
+        "$inc": {
+            "score": problem["score"],
+            "solved": 1,
+            "categories." + problem["category"]: 1
+        },
+        "$push": {
+            "progression": [timestamp, problem["score"]],
+            "category_progression." + problem["category"]:
+            [timestamp, problem["score"]]
+        }
+    }
+
+
+def record_solve(uid, tid, problem, timestamp):
+    """
+    Add a correct submission to the user's and team's state. Recording the
+    same solve twice has no effect.
+
+    Args:
+        uid: the solving user
+        tid: the user's team
+        problem: the solved problem
+        timestamp: the time of the submission
+    """
+
+    db = api.common.get_conn()
+    pid = problem["pid"]
+
+    user_update = _solve_update(problem, timestamp)
+    user_update["$set"] = {"tid": tid}
+
+    for collection, match, update in [
+        (db.user_state, {"uid": uid}, user_update),
+        (db.team_state, {"tid": tid}, _solve_update(problem, timestamp))
+    ]:
+        match["pids"] = {"$ne": pid}
+        try:
+            collection.update_one(match, update, upsert=True)
+        except DuplicateKeyError:
+            # The document was created concurrently or already has the solve.
+            collection.update_one(match, update)
+
+
+def _get_state(collection, match):
+    state = empty_state()
+    state.update(collection.find_one(match, {"_id": 0}) or {})
+    return state
+
+
+def get_team_states(tids):
+    """
+    Retrieve the solve states of several teams with a single query.
+
+    Args:
+        tids: the team ids
+    Returns:
+        A dict of states keyed by tid. Every requested tid is present.
+    """
+
+    db = api.common.get_conn()
+
+    states = {tid: empty_state() for tid in tids}
+    for doc in db.team_state.find({"tid": {"$in": list(states)}}, {"_id": 0}):
+        states[doc.pop("tid")].update(doc)
+    return states
+
+
+def downsample(series, points):
+    """
+    Reduce a score series to at most the given number of points, keeping the
+    last point of each evenly sized run so the final score is preserved.
+    """
+
+    if points is None or len(series) <= points:
+        return series
+    return [
+        series[round((i + 1) * len(series) / points) - 1]
+        for i in range(points)
+    ]
+
+
+def get_progression(state, category=None, points=None):
+    """
+    Accumulate a state's progression into the score after each solve.
+
+    Args:
+        state: a team or user state
+        category: only count solves in this category
+        points: downsample to at most this many points
+    Returns:
+        A list of dicts containing score and time
+    """
+
+    if category is None:
+        series = state["progression"]
+    else:
+        series = state["category_progression"].get(category, [])
+
+    result = []
+    score = 0
+    for time, points_gained in sorted(series, key=lambda entry: entry[0]):
+        score += points_gained
+        result.append({"score": score, "time": int(time.timestamp())})
+
+    return downsample(result, points)
+
+
+def get_team_state(tid):
+    """
+    Retrieve the solve state of a team.
+
+    Args:
+        tid: the team id
+    Returns:
+        The team's state, see empty_state.
+    """
+
+    db = api.common.get_conn()
+    return _get_state(db.team_state, {"tid": tid})
+
+
+def get_user_state(uid):
+    """
+    Retrieve the solve state of a user.
+
+    Args:
+        uid: the user id
+    Returns:
+        The user's state, see empty_state.
+    """
+
+    db = api.common.get_conn()
+    return _get_state(db.user_state, {"uid": uid})
+
+
+def _add_solve(state, problem, timestamp):
+    pid = problem["pid"]
+    if pid in state["solve_times"]:
+        state["solve_times"][pid] = min(state["solve_times"][pid], timestamp)
+        return
+
+    state["pids"].append(pid)
+    state["solve_times"][pid] = timestamp
+    if not problem["disabled"]:
+        state["score"] += problem["score"]
+        state["solved"] += 1
+        state["categories"][problem["category"]] = \
+            state["categories"].get(problem["category"], 0) + 1
+        if state["lastsubmit"] is None or timestamp > state["lastsubmit"]:
+            state["lastsubmit"] = timestamp
+        state["progression"].append([timestamp, problem["score"]])
+        state["category_progression"].setdefault(problem["category"], []) \
+            .append([timestamp, problem["score"]])
+
+
+def fold_solves(solves, problems):
+    """
+    Computes team and user states from first solves.
+
+    Args:
+        solves: dicts of uid, tid, pid and timestamp, the first correct
+                submission of a problem by a user. tid is the user's current
+                team.
+        problems: a dict of pid: problem
+    Returns:
+        (team states keyed by tid, user states keyed by uid)
+    """
+
+    teams, users = {}, {}
+    for solve in sorted(solves, key=lambda solve: solve["timestamp"]):
+        problem = problems.get(solve["pid"])
+        if problem is None:
+            continue
+
+        user = users.setdefault(solve["uid"], empty_state())
+        user["tid"] = solve["tid"]
+        _add_solve(user, problem, solve["timestamp"])
+        _add_solve(teams.setdefault(solve["tid"], empty_state()), problem,
+                   solve["timestamp"])
+
+    return teams, users
+
+
+def _first_solves(match):
+    """
+    Finds the first correct submission of each problem by each user, moved to
+    the user's current team. Users that no longer exist keep the team of
+    their latest solve of the problem.
+    """
+
+    db = api.common.get_conn()
+    return db.submissions.aggregate([
+        {"$match": match},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": {"uid": "$uid", "pid": "$pid"},
+            "tid": {"$last": "$tid"},
+            "timestamp": {"$min": "$timestamp"}
+        }},
+        {"$lookup": {
+            "from": "users",
+            "localField": "_id.uid",
+            "foreignField": "uid",
+            "as": "user"
+        }},
+        {"$project": {
+            "_id": 0,
+            "uid": "$_id.uid",
+            "pid": "$_id.pid",
+            "timestamp": 1,
+            "tid": {"$ifNull": [{"$arrayElemAt": ["$user.tid", 0]}, "$tid"]}
+        }}
+    ], allowDiskUse=True)
+
+
+def _sync(collection, key, states, scoped, check):
+    """
+    Replace the stored states that differ from the computed ones.
+
+    Returns:
+        The ids whose stored state differed.
+    """
+
+    stored = {
+        doc.pop(key): doc
+        for doc in collection.find({key: {"$in": scoped}} if scoped is not None
+                                   else {}, {"_id": 0})
+    }
+
+    def normalize(state):
+        # Solves are recorded in arrival order, not solve order.
+        if not state:
+            return state
+        return dict(
+            state,
+            pids=sorted(state["pids"]),
+            progression=sorted(state.get("progression", [])),
+            category_progression={
+                category: sorted(series)
+                for category, series in state.get("category_progression",
+                                                  {}).items()
+            })
+
+    ids = scoped if scoped is not None else set(states) | set(stored)
+    changed = []
+    for _id in ids:
+        state = states.get(_id, empty_state())
+        if normalize(stored.get(_id)) != normalize(state):
+            changed.append(_id)
+
+    if not check and changed:
+        collection.bulk_write([
+            ReplaceOne({key: _id}, dict(states.get(_id, empty_state()),
+                                        **{key: _id}), upsert=True)
+            for _id in changed
+        ], ordered=False)
+
+    return changed
+
+
+def rebuild(tids=None, check=False):
+    """
+    Reconstruct team and user states from the submissions collection.
+
+    States are replaced with a snapshot, so solves recorded while the
+    snapshot is read may be overwritten. Every solve from shortly before the
+    snapshot is recorded again once the states are replaced.
+
+    Args:
+        tids: only rebuild these teams and their current members
+        check: report inconsistencies without fixing them
+    Returns:
+        A dict of the tids and uids whose stored state was wrong.
+    """
+
+    db = api.common.get_conn()
+
+    problems = {
+        problem["pid"]: problem
+        for problem in db.problems.find({}, {
+            "_id": 0,
+            "pid": 1,
+            "score": 1,
+            "category": 1,
+            "disabled": 1
+        })
+    }
+
+    match = {"correct": True}
+    uids = None
+    if tids is not None:
+        tids = list(tids)
+        uids = [
+            user["uid"] for user in db.users.find({
+                "tid": {
+                    "$in": tids
+                }
+            }, {"uid": 1})
+        ]
+        match["$or"] = [{"tid": {"$in": tids}}, {"uid": {"$in": uids}}]
+
+    started = datetime.utcnow()
+    solves = list(_first_solves(match))
+    if tids is not None:
+        solves = [solve for solve in solves if solve["tid"] in tids]
+
+    teams, users = fold_solves(solves, problems)
+
+    # Members without solves still belong to their team.
+    if uids is not None:
+        for user in db.users.find({"uid": {"$in": uids}}, {"uid": 1, "tid": 1}):
+            users.setdefault(user["uid"], empty_state())["tid"] = user["tid"]
+
+    changed = {
+        "teams": _sync(db.team_state, "tid", teams, tids, check),
+        "users": _sync(db.user_state, "uid", users, uids, check)
+    }
+
+    if not check and (changed["teams"] or changed["users"]):
+        match["timestamp"] = {
+            "$gte": started - timedelta(seconds=rebuild_overlap)
+        }
+        for solve in _first_solves(match):
+            problem = problems.get(solve["pid"])
+            if problem is None or problem["disabled"]:
+                continue
+            if tids is None or solve["tid"] in tids:
+                record_solve(solve["uid"], solve["tid"], problem,
+                             solve["timestamp"])
+
+    if changed["teams"] or changed["users"]:
+        log.info("Rebuilt %d team and %d user states.",
+                 len(changed["teams"]), len(changed["users"]))
+
+    return changed
+
+
+def ensure_built():
+    """
+    Build the states from the submissions collection if there are correct
+    submissions but no states, as after upgrading from a version without
+    them. Only one worker builds them; an interrupted build is finished with
+    api_manager database rebuild-solves.
+
+    Returns:
+        True if this worker built the states.
+    """
+
+    db = api.common.get_conn()
+    if db.team_state.find_one({}, {"_id": 1}) is not None or \
+            db.submissions.find_one({"correct": True}, {"_id": 1}) is None:
+        return False
+
+    leases = api.cache.get_backend()
+    owner = uuid.uuid4().hex
+    if not leases.acquire("solve_state_rebuild", owner,
+                          startup_rebuild_timeout):
+        return False
+
+    try:
+        log.info("Building solve states from existing submissions.")
+        rebuild()
+    finally:
+        leases.release("solve_state_rebuild", owner)
+    return True
@@ -1,19 +1,22 @@
 """ Module for getting competition statistics"""
 
-import datetime
 import statistics
 from collections import defaultdict
 from hashlib import sha1
 
 import api
-import pymongo
 from api.common import InternalException
 
 _get_problem_names = lambda problems: [problem['name'] for problem in problems]
 top_teams = 5
 
+# Points per score progression served to the scoreboard graphs.
+progression_points = 100
 
-@api.cache.memoize()
+
+@api.cache.memoize(
+    depends={"problem": None, "submission": "tid", "team": "tid"},
+    stale_while_revalidate=True)
 def get_score(tid=None, uid=None):
     """
     Get the score for a user or team.
@@ -24,11 +27,13 @@ def get_score(tid=None, uid=None):
     Returns:
         The users's or team's score
     """
-    score = sum([
-        problem['score']
-        for problem in api.problem.get_solved_problems(tid=tid, uid=uid)
-    ])
-    return score
+
+    if uid is not None and tid is None:
+        return api.solve_state.get_user_state(uid)["score"]
+
+    if tid is None:
+        tid = api.user.get_team()["tid"]
+    return api.solve_state.get_team_state(tid)["score"]
 
 
 def get_team_review_count(tid=None, uid=None):
@@ -44,7 +49,10 @@ def get_team_review_count(tid=None, uid=None):
 
 # This is on the /scoreboard handler hot path and should be cached. Stored by
 # the cache_stats daemon.
-@api.cache.memoize()
+@api.cache.memoize(
+    depends={"group": "gid", "problem": None, "submission": None, "team": None},
+    stale_while_revalidate=True,
+    single_flight=True)
 def get_group_scores(gid=None, name=None):
     """
     Get the group scores.
@@ -56,20 +64,22 @@ def get_group_scores(gid=None, name=None):
         A dictionary containing name, tid, and score
     """
 
-    members = [
-        api.team.get_team(tid=tid)
-        for tid in api.group.get_group(gid=gid, name=name)['members']
-    ]
+    members = api.group.get_group(gid=gid, name=name)['members']
+    summaries = api.scoring.get_all_team_summaries()
+    teams = api.team.get_teams_by_tids(
+        members,
+        projection=["team_name", "affiliation", "eligible", "size"])
 
     result = []
-    for team in members:
+    for team in teams.values():
         if team["size"] > 0:
             result.append({
                 "name": team['team_name'],
                 "tid": team['tid'],
                 "affiliation": team["affiliation"],
                 "eligible": team["eligible"],
-                "score": get_score(tid=team['tid'])
+                "score": api.scoring.get_team_summary(team['tid'],
+                                                      summaries)["score"]
             })
 
     return sorted(result, key=lambda entry: entry['score'], reverse=True)
@@ -91,12 +101,13 @@ def get_group_average_score(gid=None, name=None):
     return int(total_score / len(group_scores)) if len(group_scores) > 0 else 0
 
 
-# Stored by the cache_stats daemon
-@api.cache.memoize()
 def get_all_team_scores(eligible=None, country=None, show_ineligible=False):
     """
     Gets the score for every team in the database.
 
+    Reads from the in-memory scoreboard engine, which is kept up to date as
+    correct submissions are recorded.
+
     Args:
         eligible: required boolean field
         show_ineligible: ignore eligibility, show all
@@ -106,64 +117,13 @@ def get_all_team_scores(eligible=None, country=None, show_ineligible=False):
         A list of dictionaries with name and score
     """
 
-    if show_ineligible:
-        teams = api.team.get_all_teams(show_ineligible=True)
-    else:
-        if eligible is None:
-            raise InternalException("Eligible must be set to either true or false")
+    if not show_ineligible and eligible is None:
+        raise InternalException("Eligible must be set to either true or false")
 
-        if eligible:
-            teams = api.team.get_all_teams(eligible=True, country=country, ineligible=False)
-        else:
-            teams = api.team.get_all_teams(eligible=False, country=country, ineligible=True)
+    eligible, country = api.scoreboard.board_key(
+        eligible=eligible, country=country, show_ineligible=show_ineligible)
 
-    db = api.api.common.get_conn()
-
-    result = []
-    all_groups = api.group.get_all_groups()
-    for team in teams:
-        # Get the full version of the group.
-        groups = [
-            group for group in all_groups if team["tid"] in group["members"] or
-            team["tid"] in group["teachers"] or team["tid"] == group["owner"]
-        ]
-
-        # Determine if the user is exclusively a member of hidden groups.
-        # If they are, they won't be processed.
-        if len(groups) == 0 or any(
-            [not (group["settings"]["hidden"]) for group in groups]):
-            team_query = db.submissions.find({
-                'tid': team['tid'],
-                #'eligible': eligible,
-                'correct': True
-            })
-            if sum(1 for _ in team_query.clone()) > 0:
-                lastsubmit = team_query.sort(
-                    'timestamp', direction=pymongo.DESCENDING)[0]['timestamp']
-            else:
-                lastsubmit = datetime.datetime.now()
-            score = get_score(tid=team['tid'])
-            if score > 0:
-                result.append({
-                    "name": team['team_name'],
-                    "tid": team['tid'],
-                    "score": score,
-                    "affiliation": team["affiliation"],
-                    #"eligible": team["eligible"],
-                    "lastsubmit": lastsubmit
-                })
-    time_ordered = sorted(result, key=lambda entry: entry['lastsubmit'])
-    time_ordered_time_removed = [{
-        'name': x['name'],
-        #'eligible': x['eligible'],
-        'tid': x['tid'],
-        'score': x['score'],
-        'affiliation': x['affiliation']
-    } for x in time_ordered]
-    return sorted(
-        time_ordered_time_removed,
-        key=lambda entry: entry['score'],
-        reverse=True)
+    return api.scoreboard.engine.get_board(eligible=eligible, country=country)
 
 
 def get_all_user_scores():
@@ -186,7 +146,7 @@ def get_all_user_scores():
     return sorted(result, key=lambda entry: entry['score'], reverse=True)
 
 
-@api.cache.memoize(timeout=120, fast=True)
+@api.cache.memoize(timeout=120, fast=True, depends={"problem": None})
 def get_problems_by_category():
     """
     Gets the list of all problems divided into categories
@@ -203,7 +163,7 @@ def get_problems_by_category():
     return result
 
 
-@api.cache.memoize(timeout=120, fast=True)
+@api.cache.memoize(timeout=120, fast=True, depends={"problem": None})
 def get_pids_by_category():
     result = {
         cat: [x['pid'] for x in api.problem.get_all_problems(category=cat)
@@ -212,7 +172,7 @@ def get_pids_by_category():
     return result
 
 
-@api.cache.memoize(timeout=120, fast=True)
+@api.cache.memoize(timeout=120, fast=True, depends={"problem": None})
 def get_pid_categories():
     pid_map = {}
     for cat in api.problem.get_all_categories():
@@ -262,8 +222,10 @@ def get_problem_submission_stats(pid=None, name=None):
     }
 
 
-@api.cache.memoize()
-def get_score_progression(tid=None, uid=None, category=None):
+@api.cache.memoize(
+    depends={"problem": None, "submission": "tid", "team": "tid"},
+    stale_while_revalidate=True)
+def get_score_progression(tid=None, uid=None, category=None, points=None):
     """
     Finds the score and time after each correct submission of a team or user.
     NOTE: this is slower than get_score. Do not use this for getting current score.
@@ -272,28 +234,20 @@ def get_score_progression(tid=None, uid=None, category=None):
         tid: the tid of the user
         uid: the uid of the user
         category: category filter
+        points: downsample the progression to at most this many points
     Returns:
         A list of dictionaries containing score and time
     """
 
-    solved = api.problem.get_solved_problems(
-        tid=tid, uid=uid, category=category)
-
-    result = []
-    score = 0
-
-    problems_counted = set()
-
-    for problem in sorted(solved, key=lambda prob: prob["solve_time"]):
-        if problem['pid'] not in problems_counted:
-            score += problem["score"]
-            problems_counted.add(problem['pid'])
-        result.append({
-            "score": score,
-            "time": int(problem["solve_time"].timestamp())
-        })
+    if uid is not None and tid is None:
+        state = api.solve_state.get_user_state(uid)
+    else:
+        if tid is None:
+            tid = api.user.get_team()["tid"]
+        state = api.solve_state.get_team_state(tid)
 
-    return result
+    return api.solve_state.get_progression(
+        state, category=category, points=points)
 
 
 def get_top_teams(gid=None, eligible=None, country=None, show_ineligible=False):
@@ -319,7 +273,10 @@ def get_top_teams(gid=None, eligible=None, country=None, show_ineligible=False):
 
 
 # Stored by the cache_stats daemon
-@api.cache.memoize()
+@api.cache.memoize(
+    depends={"problem": "pid", "submission": None},
+    stale_while_revalidate=True,
+    single_flight=True)
 def get_problem_solves(name=None, pid=None):
     """
     Returns the number of solves for a particular problem.
@@ -341,7 +298,10 @@ def get_problem_solves(name=None, pid=None):
     return sum(1 for _ in db.submissions.find({'pid': problem["pid"], 'correct': True}))
 
 
-@api.cache.memoize()
+@api.cache.memoize(
+    depends={"group": "gid", "problem": None, "submission": None, "team": None},
+    stale_while_revalidate=True,
+    single_flight=True)
 def get_top_teams_score_progressions(gid=None, eligible=True, country=None, show_ineligible=False):
     """
     Gets the score_progressions for the top teams
@@ -357,11 +317,15 @@ def get_top_teams_score_progressions(gid=None, eligible=True, country=None, show
         A dict of {name: name, score_progression: score_progression}
     """
 
+    teams = get_top_teams(gid=gid, eligible=eligible, country=country, show_ineligible=show_ineligible)
+    states = api.solve_state.get_team_states([team["tid"] for team in teams])
+
     return [{
         "name": team["name"],
         "affiliation": team["affiliation"],
-        "score_progression": get_score_progression(tid=team["tid"]),
-    } for team in get_top_teams(gid=gid, eligible=eligible, country=country, show_ineligible=show_ineligible)]
+        "score_progression": api.solve_state.get_progression(
+            states[team["tid"]], points=progression_points),
+    } for team in teams]
 
 
 # Custom statistics not necessarily to be served publicly
@@ -553,39 +517,20 @@ def get_user_countries():
 
 def get_team_size_distribution(eligible=True):
     teams = api.team.get_all_teams(show_ineligible=(not eligible))
+    members = api.team.get_members_by_tids(
+        [t['tid'] for t in teams], show_disabled=False)
     size_dist = defaultdict(int)
     for t in teams:
-        members = api.team.get_team_members(tid=t['tid'], show_disabled=False)
-        if len(members) > api.team.max_team_users:
+        size = len(members[t['tid']])
+        if size > api.team.max_team_users:
             print("WARNING: Team %s has too many members" % t['team_name'])
-        size_dist[len(members)] += 1
+        size_dist[size] += 1
     return size_dist
 
 
 def get_team_member_solve_stats(eligible=True):
-    db = api.api.common.get_conn()
     teams = api.team.get_all_teams(show_ineligible=(not eligible))
-    user_breakdowns = {}
-    for t in teams:
-        uid_map = defaultdict(lambda: defaultdict(int))
-        members = api.team.get_team_members(tid=t['tid'], show_disabled=False)
-        subs = db.submissions.find({'tid': t['tid']})
-        for sub in subs:
-            uid = sub['uid']
-            uid_map[uid]['submits'] += 1
-            if uid_map[uid]['times'] == 0:
-                uid_map[uid]['times'] = list()
-            uid_map[uid]['times'].append(sub['timestamp'])
-            if sub['correct']:
-                uid_map[uid]['correct'] += 1
-                uid_map[uid][sub['category']] += 1
-            else:
-                uid_map[uid]['incorrect'] += 1
-        user_breakdowns[t['tid']] = uid_map
-        for member in members:
-            if member['uid'] not in uid_map:
-                uid_map[uid] = None
-    return user_breakdowns
+    return api.scoring.get_member_breakdowns(tids=[t['tid'] for t in teams])
 
 
 def get_team_participation_percentage(eligible=True, user_breakdown=None):
@@ -630,11 +575,12 @@ def get_average_achievement_number():
 
 def get_category_solves(eligible=True):
     teams = api.team.get_all_teams(show_ineligible=(not eligible))
+    summaries = api.scoring.get_all_team_summaries()
     category_breakdown = defaultdict(int)
     for team in teams:
-        problems = api.problem.get_solved_problems(tid=team['tid'])
-        for problem in problems:
-            category_breakdown[problem['category']] += 1
+        summary = api.scoring.get_team_summary(team['tid'], summaries)
+        for category, count in summary["categories"].items():
+            category_breakdown[category] += count
     team_count = len(api.team.get_all_teams(show_ineligible=False))
     return {x: y / team_count for x, y in category_breakdown.items()}
 
@@ -654,33 +600,61 @@ def get_days_active_breakdown(eligible=True, user_breakdown=None):
     return day_breakdown
 
 
-@api.cache.memoize(timeout=300)
+@api.cache.memoize(
+    timeout=300,
+    depends={"group": "gid", "problem": None, "submission": None})
 def check_invalid_instance_submissions(gid=None):
     db = api.api.common.get_conn()
-    badteams = set()
-    shared_key_submissions = []
 
-    group = None
+    problems = {
+        problem["pid"]: problem
+        for problem in api.problem.get_all_problems(show_disabled=True)
+    }
+    flags = {
+        pid: {instance['flag'] for instance in problem['instances']}
+        for pid, problem in problems.items()
+    }
+
+    match = {
+        'correct': False,
+        'key': {
+            '$in': list(set().union(*flags.values()))
+        }
+    }
     if gid is not None:
-        group = api.group.get_group(gid=gid)
-
-    for problem in api.problem.get_all_problems(show_disabled=True):
-        valid_keys = [instance['flag'] for instance in problem['instances']]
-        incorrect_submissions = db.submissions.find({
-            'pid': problem['pid'],
-            'correct': False
-        }, {"_id": 0})
-        for submission in incorrect_submissions:
-            if submission['key'] in valid_keys:
-                # make sure that the key is still invalid
-                if not api.problem.grade_problem(
-                        submission['pid'], submission['key'],
-                        tid=submission['tid'])['correct']:
-                    if group is None or submission['tid'] in group['members']:
-                        submission['username'] = api.user.get_user(
-                            uid=submission['uid'])['username']
-                        submission["problem_name"] = problem["name"]
-                        shared_key_submissions.append(submission)
+        match['tid'] = {'$in': api.group.get_group(gid=gid)['members']}
+
+    # Only the flag of another instance of the same problem is a shared key,
+    # not a wrong guess that happens to be some other problem's flag.
+    submissions = [
+        submission for submission in db.submissions.find(match, {"_id": 0})
+        if submission['key'] in flags.get(submission['pid'], ())
+    ]
+    teams = api.team.get_teams_by_tids(
+        {submission['tid'] for submission in submissions},
+        projection=["instances"])
+    users = api.user.get_users_by_uids(
+        {submission['uid'] for submission in submissions},
+        projection=["username"])
+
+    shared_key_submissions = []
+    for submission in submissions:
+        problem = problems[submission['pid']]
+        # make sure that the key is still invalid
+        iid = teams.get(submission['tid'], {}).get(
+            'instances', {}).get(submission['pid'])
+        instance = next(
+            (i for i in problem['instances'] if i['iid'] == iid), None)
+        if instance is not None:
+            grade = api.problem.grade_instance(problem, instance,
+                                               submission['key'])
+        else:
+            grade = api.problem.grade_problem(
+                submission['pid'], submission['key'], tid=submission['tid'])
+        if not grade['correct']:
+            submission['username'] = users[submission['uid']]['username']
+            submission["problem_name"] = problem["name"]
+            shared_key_submissions.append(submission)
 
     return shared_key_submissions
 
@@ -730,7 +704,7 @@ def print_review_comments():
                 print("'%s'" % comment)
 
 
-@api.cache.memoize()
+@api.cache.memoize(single_flight=True)
 def get_registration_count():
     db = api.common.get_conn()
     users = db.users.count_documents({})
@@ -0,0 +1,216 @@
+"""
+Incremental synchronization of problem symlinks to the shell servers.
+
+Each user's problems directory on a shell server links to the instances their
+team has unlocked on that server. Events that may change a team's unlocked
+problems are recorded in symlink_events. The share_instances daemon refreshes
+only those teams, storing the differences from the last known links as
+versioned per-user deltas, and each server is sent the deltas after the last
+version it acknowledged.
+"""
+
+import api
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument
+
+log = api.logger.use(__name__)
+
+
+def record_change(tid=None):
+    """
+    Record that the unlocked problems of a team may have changed.
+
+    Args:
+        tid: the team id. Defaults to every team, e.g., after problems change.
+    """
+
+    db = api.common.get_conn()
+    db.symlink_events.insert_one({"tid": tid})
+
+
+def get_version():
+    """
+    Returns the version of the latest recorded delta.
+    """
+
+    db = api.common.get_conn()
+    counter = db.counters.find_one({"_id": "symlinks"})
+    return None if counter is None else counter["version"]
+
+
+def _next_version():
+    db = api.common.get_conn()
+    return db.counters.find_one_and_update(
+        {"_id": "symlinks"}, {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER)["version"]
+
+
+def get_team_symlinks(tid, sids, members=None):
+    """
+    Computes the symlinks each member of a team should have.
+
+    Args:
+        tid: the team id
+        sids: the shell servers to compute symlinks for
+        members: the team's members, if already loaded
+    Returns:
+        A dict of (sid, username): {problem name: deployment directory}
+    """
+
+    by_server = {sid: {} for sid in sids}
+    for problem in api.problem.get_unlocked_problems(tid=tid):
+        if problem["should_symlink"] and problem["sid"] in by_server:
+            by_server[problem["sid"]][problem["name"]] = \
+                problem["deployment_directory"]
+
+    if members is None:
+        members = api.team.get_team_members(tid=tid)
+
+    return {(sid, user["username"]): links
+            for user in members for sid, links in by_server.items()}
+
+
+def refresh():
+    """
+    Recompute the symlinks of the teams with recorded changes and store the
+    differences as deltas. Every team is refreshed the first time.
+
+    Returns:
+        The number of (server, user) pairs whose symlinks changed.
+    """
+
+    db = api.common.get_conn()
+
+    events = list(db.symlink_events.find({}, {"_id": 1, "tid": 1}))
+    full = get_version() is None or any(
+        event["tid"] is None for event in events)
+    if not events and not full:
+        return 0
+
+    sids = [
+        server["sid"]
+        for server in api.shell_servers.get_servers(get_all=True)
+    ]
+
+    if full:
+        tids = [
+            team["tid"] for team in api.team.get_all_teams(show_ineligible=True)
+        ]
+    else:
+        tids = list({event["tid"] for event in events})
+
+    members = api.team.get_members_by_tids(tids)
+
+    stored_match = {}
+    if not full:
+        stored_match["username"] = {
+            "$in": [user["username"] for team in members.values() for user in team]
+        }
+
+    desired = {}
+    for tid in tids:
+        desired.update(get_team_symlinks(tid, sids, members[tid]))
+
+    stored = {(state["sid"], state["username"]): state["links"]
+              for state in db.symlink_state.find(stored_match, {"_id": 0})}
+
+    version = _next_version()
+    deltas, writes = [], []
+    for key in set(desired) | set(stored):
+        links, current = desired.get(key, {}), stored.get(key, {})
+        if links == current:
+            continue
+
+        sid, username = key
+        changes = {
+            name: target
+            for name, target in links.items() if current.get(name) != target
+        }
+        changes.update(
+            {name: None
+             for name in current if name not in links})
+        deltas.append({
+            "version": version,
+            "sid": sid,
+            "username": username,
+            "links": changes
+        })
+
+        match = {"sid": sid, "username": username}
+        if links:
+            writes.append(
+                ReplaceOne(match, dict(match, links=links), upsert=True))
+        else:
+            writes.append(DeleteOne(match))
+
+    if deltas:
+        db.symlink_deltas.insert_many(deltas)
+        db.symlink_state.bulk_write(writes, ordered=False)
+        log.info("Recorded symlink changes of %d users at version %d.",
+                 len(deltas), version)
+
+    db.symlink_events.delete_many(
+        {"_id": {"$in": [event["_id"] for event in events]}})
+
+    return len(deltas)
+
+
+def get_pending(sid, full=False):
+    """
+    Returns the symlink changes a shell server has not acknowledged.
+
+    Args:
+        sid: the shell server id
+        full: return every user's complete symlinks instead of the deltas
+    Returns:
+        A dict of version, full and users: {username: {name: target}}, where
+        a None target removes the symlink. None if the server is up to date.
+    """
+
+    db = api.common.get_conn()
+
+    version = get_version() or 0
+    acked = api.shell_servers.get_server(sid).get("symlinks_version")
+
+    if full or acked is None:
+        users = {
+            state["username"]: state["links"]
+            for state in db.symlink_state.find({"sid": sid}, {"_id": 0})
+        }
+        return {"version": version, "full": True, "users": users}
+
+    users = {}
+    for delta in db.symlink_deltas.find({
+            "sid": sid,
+            "version": {
+                "$gt": acked
+            }
+    }).sort("version", 1):
+        users.setdefault(delta["username"], {}).update(delta["links"])
+        version = delta["version"]
+
+    if not users:
+        return None
+    return {"version": version, "full": False, "users": users}
+
+
+def acknowledge(sid, version):
+    """
+    Record that a shell server applied the changes up to a version, and
+    discard the deltas every server has applied.
+    """
+
+    db = api.common.get_conn()
+    db.shell_servers.update_one({"sid": sid},
+                                {"$set": {
+                                    "symlinks_version": version
+                                }})
+
+    # servers that never acknowledged a version are sent complete symlinks
+    acked = [
+        server["symlinks_version"]
+        for server in api.shell_servers.get_servers(get_all=True)
+        if server.get("symlinks_version") is not None
+    ]
+    if acked:
+        db.symlink_deltas.delete_many({"version": {"$lte": min(acked)}})
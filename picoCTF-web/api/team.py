@@ -2,6 +2,8 @@
 API functions relating to team management.
 """
 
+from copy import deepcopy
+
 import api
 from api.annotations import log_action
 from api.common import (check, InternalException, safe_fail,
@@ -68,7 +70,7 @@ def get_team(tid=None, name=None):
     elif name is not None:
         match.update({'team_name': name})
     elif api.auth.is_logged_in():
-        match.update({"tid": api.user.get_user()["tid"]})
+        return deepcopy(api.auth.get_context().team)
     else:
         raise InternalException("Must supply tid or team name to get_team")
 
@@ -80,6 +82,31 @@ def get_team(tid=None, name=None):
     return team
 
 
+def get_teams_by_tids(tids, projection=None):
+    """
+    Retrieve several teams with a single query.
+
+    Args:
+        tids: the team ids
+        projection: the fields to return, defaults to the whole team
+    Returns:
+        A dict of team objects keyed by tid. Teams that do not exist are
+        left out.
+    """
+
+    db = api.common.get_conn()
+
+    fields = {"_id": 0}
+    if projection is not None:
+        fields.update({field: 1 for field in projection})
+        fields["tid"] = 1
+
+    return {
+        team["tid"]: team
+        for team in db.teams.find({"tid": {"$in": list(tids)}}, fields)
+    }
+
+
 def get_groups(tid=None, uid=None):
     """
     Get the group membership for a team.
@@ -91,6 +118,9 @@ def get_groups(tid=None, uid=None):
         List of group objects the team is a member of.
     """
 
+    if tid is None and uid is None and api.auth.is_logged_in():
+        return api.auth.get_context().groups
+
     db = api.common.get_conn()
 
     groups = []
@@ -137,6 +167,33 @@ def get_groups(tid=None, uid=None):
     return groups
 
 
+def get_group_names(tid):
+    """
+    Get the names of the groups a team owns, teaches or is a member of.
+
+    Args:
+        tid: The team id
+    Returns:
+        A list of group names.
+    """
+
+    db = api.common.get_conn()
+
+    groups = db.groups.find({
+        "$or": [{
+            'owner': tid
+        }, {
+            "teachers": tid
+        }, {
+            "members": tid
+        }]
+    }, {
+        'name': 1,
+        '_id': 0
+    })
+    return [group['name'] for group in groups]
+
+
 def create_new_team_request(params, uid=None):
     """
     Fulfills new team requests for users who have already registered.
@@ -238,6 +295,42 @@ def get_team_members(tid=None, name=None, show_disabled=True):
     ]
 
 
+def get_members_by_tids(tids, show_disabled=True):
+    """
+    Retrieves the members of several teams with a single query.
+
+    Args:
+        tids: the team ids to query
+        show_disabled: whether to include disabled users
+    Returns:
+        A dict of member lists keyed by tid. Every requested tid is present.
+    """
+
+    db = api.common.get_conn()
+
+    members = {tid: [] for tid in tids}
+    for user in db.users.find({
+            "tid": {
+                "$in": list(members)
+            }
+    }, {
+            "_id": 0,
+            "uid": 1,
+            "tid": 1,
+            "username": 1,
+            "disabled": 1,
+            "email": 1,
+            "teacher": 1,
+            "country": 1,
+            "usertype": 1,
+            "eligible": 1,
+    }):
+        if show_disabled or not user.get("disabled", False):
+            members[user.pop("tid")].append(user)
+
+    return members
+
+
 def get_team_uids(tid=None, name=None, show_disabled=True):
     """
     Gets the list of uids that belong to a team
@@ -255,19 +348,21 @@ def get_team_uids(tid=None, name=None, show_disabled=True):
     ]
 
 
-def get_team_information(tid=None, gid=None):
+def get_team_information(tid=None, gid=None, team=None, members=None):
     """
     Retrieves the information of a team.
 
     Args:
         tid: the team id
+        team: the team object, if it was already loaded
+        members: the team's enabled members, if they were already loaded
     Returns:
         A dict of team information.
             team_name
             members
     """
 
-    team_info = get_team(tid=tid)
+    team_info = team if team is not None else get_team(tid=tid)
 
     if tid is None:
         tid = team_info["tid"]
@@ -284,9 +379,11 @@ def get_team_information(tid=None, gid=None):
         "affiliation": member.get("affiliation", "None"),
         "country": member["country"],
         "usertype": member["usertype"],
-    } for member in get_team_members(tid=tid, show_disabled=False)]
+    } for member in (members if members is not None else
+                     get_team_members(tid=tid, show_disabled=False))]
     team_info["competition_active"] = api.utilities.check_competition_active()
-    team_info["progression"] = api.stats.get_score_progression(tid=tid)
+    team_info["progression"] = api.stats.get_score_progression(
+        tid=tid, points=api.stats.progression_points)
     team_info["flagged_submissions"] = [
         sub for sub in api.stats.check_invalid_instance_submissions()
         if sub['tid'] == tid
@@ -440,6 +537,10 @@ def join_team(team_name, password, uid=None):
                         api.group.join_group(gid=group["gid"], tid=desired_team["tid"])
 
 
+        # Solves follow the user to their new team
+        api.solve_state.rebuild(
+            tids=[current_team["tid"], desired_team["tid"]])
+
         # Called from within get_solved_problems, clear first
         api.cache.invalidate_memoization(api.problem.get_unlocked_pids,
                                          {"args": [desired_team["tid"]]})
@@ -457,6 +558,17 @@ def join_team(team_name, password, uid=None):
         api.cache.invalidate_memoization(api.stats.get_score_progression,
                                          {"kwargs.tid": desired_team["tid"]})
 
+        # Group scores and other team wide results
+        api.cache.invalidate_entity("team", current_team["tid"], stale=True)
+        api.cache.invalidate_entity("team", desired_team["tid"], stale=True)
+
+        # The user's problem symlinks follow the new team
+        api.symlinks.record_change(current_team["tid"])
+        api.symlinks.record_change(desired_team["tid"])
+
+        api.auth.invalidate_context()
+        api.scoreboard.reset()
+
         return True
     else:
         raise InternalException(
@@ -505,6 +617,7 @@ def update_password(tid, password):
     }, {'$set': {
         'password': api.common.hash_password(password)
     }})
+    api.auth.invalidate_context()
 
 
 def is_teacher_team(tid):
@@ -7,6 +7,7 @@ import re
 import string
 import urllib.parse
 import urllib.request
+from copy import deepcopy
 
 import api
 import flask
@@ -146,6 +147,9 @@ def get_team(uid=None):
         The user's team.
     """
 
+    if uid is None and api.auth.is_logged_in():
+        return deepcopy(api.auth.get_context().team)
+
     user = get_user(uid=uid)
     return api.team.get_team(tid=user["tid"])
 
@@ -155,6 +159,9 @@ def get_user(name=None, uid=None):
     Retrieve a user based on a property. If the user is logged in,
     it will return that user object.
 
+    The logged in user is read once per request, see api.auth.get_context.
+    Each call returns a copy, so callers may change it.
+
     Args:
         name: the user's username
         uid: the user's uid
@@ -162,19 +169,43 @@ def get_user(name=None, uid=None):
         Returns the corresponding user object or None if it could not be found
     """
 
-    db = api.common.get_conn()
+    if uid is None and name is None:
+        if not api.auth.is_logged_in():
+            raise InternalException(
+                "Uid or name must be specified for get_user")
+        return deepcopy(api.auth.get_context().user)
 
-    match = {}
+    if uid is not None:
+        context = api.auth.get_context()
+        if context is not None and context.uid == uid:
+            return deepcopy(context.user)
+
+    return load_user(name=name, uid=uid)
+
+
+def load_user(name=None, uid=None):
+    """
+    Read a user from the database, bypassing the request's cached user.
+
+    Args:
+        name: the user's username
+        uid: the user's uid
+    Returns:
+        The user object.
+    """
+
+    db = api.common.get_conn()
 
     if uid is not None:
-        match.update({'uid': uid})
+        match = {'uid': uid}
     elif name is not None:
-        match.update({'username': name})
-    elif api.auth.is_logged_in():
-        match.update({'uid': api.auth.get_uid()})
+        match = {'username': name}
     else:
         raise InternalException("Uid or name must be specified for get_user")
 
+    if flask.has_request_context():
+        flask.g.user_reads = flask.g.get("user_reads", 0) + 1
+
     user = db.users.find_one(match)
 
     if user is None:
@@ -183,6 +214,41 @@ def get_user(name=None, uid=None):
     return user
 
 
+def get_user_reads():
+    """
+    Returns the number of user documents read by the current request.
+    """
+
+    if not flask.has_request_context():
+        return 0
+    return flask.g.get("user_reads", 0)
+
+
+def get_users_by_uids(uids, projection=None):
+    """
+    Retrieve several users with a single query.
+
+    Args:
+        uids: the user ids
+        projection: the fields to return, defaults to the whole user
+    Returns:
+        A dict of user objects keyed by uid. Users that do not exist are
+        left out.
+    """
+
+    db = api.common.get_conn()
+
+    fields = {"_id": 0}
+    if projection is not None:
+        fields.update({field: 1 for field in projection})
+        fields["uid"] = 1
+
+    return {
+        user["uid"]: user
+        for user in db.users.find({"uid": {"$in": list(uids)}}, fields)
+    }
+
+
 def create_user(username,
                 firstname,
                 lastname,
@@ -420,6 +486,8 @@ def create_simple_user_request(params):
     if uid is None:
         raise InternalException("There was an error during registration.")
 
+    api.symlinks.record_change(team["tid"])
+
     # Join group after everything else has succeeded
     if params.get("gid", None):
         api.group.join_group(
@@ -476,6 +544,7 @@ def verify_user(uid, token_value):
 
     if token_user["uid"] == uid:
         db.users.find_one_and_update({"uid": uid}, {"$set": {"verified": True}})
+        api.auth.invalidate_context()
         api.token.delete_token({"uid": uid}, "email_verification")
         return True
     else:
@@ -527,6 +596,7 @@ def update_password(uid, password):
     }, {'$set': {
         'password_hash': api.common.hash_password(password)
     }})
+    api.auth.invalidate_context()
 
 
 def disable_account(uid):
@@ -563,6 +633,9 @@ def disable_account(uid):
             }},
             upsert=True)
 
+    # A disabled user is logged out by the next is_logged_in
+    api.auth.invalidate_context()
+
 
 @log_action
 def disable_account_request(params, uid=None, check_current=False):
@@ -600,3 +673,4 @@ def update_extdata(params):
     db = api.common.get_conn()
     params.pop('token', None)
     db.users.update_one({'uid': user['uid']}, {'$set': {'extdata': params}})
+    api.auth.invalidate_context()
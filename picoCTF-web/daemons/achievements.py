@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+
+import api
+
+
+def run():
+    print("Processing queued achievements...")
+    batches = api.achievement_queue.drain()
+    print("Processed achievements for {} team batches.".format(batches))
+
+    for path, timing in sorted(api.achievement.get_processor_stats().items()):
+        print("{}: {} calls, {:.3f}s mean, {:.3f}s max".format(
+            path, timing["calls"], timing["mean"], timing["max"]))
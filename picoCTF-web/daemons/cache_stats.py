@@ -5,20 +5,13 @@ import api
 
 
 def cache(f, *args, **kwargs):
-    result = f(cache=False, *args, **kwargs)
-    key = api.cache.get_mongo_key(f, *args, **kwargs)
-    api.cache.set(key, result)
-    return result
+    return api.cache.refresh(f, *args, **kwargs)
 
 
 def run():
     print("Caching registration stats.")
     cache(api.stats.get_registration_count)
 
-    print("Caching the public scoreboard entries...")
-    cache(api.stats.get_all_team_scores, eligible=True, country=None, show_ineligible=False)
-    cache(api.stats.get_all_team_scores, eligible=True, country=None, show_ineligible=True)
-
     print("Caching the public scoreboard graph...")
     cache(api.stats.get_top_teams_score_progressions, eligible=True, country=None, show_ineligible=False)
     cache(api.stats.get_top_teams_score_progressions, eligible=True, country=None, show_ineligible=True)
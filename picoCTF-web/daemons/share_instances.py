@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import json
+import queue
 import random
 import string
 from os.path import join
@@ -8,71 +9,187 @@ from os.path import join
 import api
 import spur
 
+# Seconds to wait for a shell server to apply a batch of changes.
+apply_timeout = 300
+
 script = \
 """
 import json
 import os
-import stat
 import pwd
+import select
 import subprocess
+import sys
 
 from os.path import join
 
-data = json.loads(raw_input())
+# Seconds between retries of users that have no shell account yet.
+RETRY_INTERVAL = 60
+
+# The script is loaded, so it can remove itself.
+os.remove(__file__)
+os.rmdir(os.path.dirname(__file__))
+
+prepared = set()
+pending = {}
 
-for user, correct_symlinks in data.items():
-    try:
-        home_dir = pwd.getpwnam(user).pw_dir
-    except KeyError as e:
-        # print "%s does not have a shell account"
-        continue
 
-    problems_path = join(home_dir, "problems")
+def problems_path(user):
+    home_dir = pwd.getpwnam(user).pw_dir
+    return join(home_dir, "problems")
 
-    if not os.path.isdir(problems_path):
-        if os.path.isfile(problems_path) or os.path.islink(problems_path):
-            os.unlink(problems_path)
-            print("Deleted %s because it was not a directory" % problems_path)
-        os.mkdir(problems_path)
-        print("Made new directory %s" % problems_path)
 
-    dirstat = os.stat(problems_path)
+def prepare(user, path, log):
+    if user in prepared:
+        return
 
-    # if only os.chattr() existed... but I guess the following hacks work
+    if not os.path.isdir(path):
+        if os.path.isfile(path) or os.path.islink(path):
+            os.unlink(path)
+            log.append("Deleted %s because it was not a directory" % path)
+        os.mkdir(path)
+        log.append("Made new directory %s" % path)
 
-    # if not dirstat.st_mode & stat.UF_NOUNLINK:
-    #    os.lchflags(problems_path, dirstat.st_flags | os.SF_NOUNLINK)
+    dirstat = os.stat(path)
 
-    if b"-u-" not in subprocess.check_output(["lsattr", "-d", problems_path]):
-        subprocess.check_output(["chattr", "+u", problems_path])
-        print("Made %s undeletable." % problems_path)
+    if b"-u-" not in subprocess.check_output(["lsattr", "-d", path]):
+        subprocess.check_output(["chattr", "+u", path])
+        log.append("Made %s undeletable." % path)
 
     if not (dirstat.st_uid == 0 and dirstat.st_gid == 0):
-        os.chown(problems_path, 0, 0)
-        print("Made %s owned by root:root" % problems_path)
-
-    current_symlink_keys = list(os.listdir(problems_path))
-    full_paths = map(lambda p : join(problems_path, p), current_symlink_keys)
-    current_symlinks = dict(zip(current_symlink_keys, map(os.readlink, full_paths)))
-
-    to_remove = []
-    for problem, src in current_symlinks.items():
-        if problem not in correct_symlinks.keys() or src != correct_symlinks[problem]:
-            link = join(problems_path, problem)
-            assert os.path.islink(link), "%s is not a symlink!" % link
+        os.chown(path, 0, 0)
+        log.append("Made %s owned by root:root" % path)
+
+    prepared.add(user)
+
+
+def apply_links(user, links, full, log):
+    try:
+        path = problems_path(user)
+    except KeyError:
+        # no shell account yet, retried later
+        if full or user not in pending:
+            pending[user] = {"links": dict(links), "full": full}
+        else:
+            pending[user]["links"].update(links)
+        return
+
+    prepare(user, path, log)
+
+    if full:
+        for problem in os.listdir(path):
+            link = join(path, problem)
+            if problem not in links:
+                assert os.path.islink(link), "%s is not a symlink!" % link
+                os.unlink(link)
+                log.append("Removed symlink %s" % link)
+
+    for problem, src in links.items():
+        link = join(path, problem)
+        if os.path.islink(link):
+            if src is not None and os.readlink(link) == src:
+                continue
             os.unlink(link)
-            current_symlinks.pop(problem)
-            print("Removed symlink %s -> %s" % (link, src))
+            log.append("Removed symlink %s" % link)
+        if src is not None:
+            os.symlink(src, link)
+            log.append("Added symlink %s --> %s" % (link, src))
+
+
+def retry_pending(log):
+    for user, entry in list(pending.items()):
+        try:
+            pwd.getpwnam(user)
+        except KeyError:
+            continue
+        del pending[user]
+        apply_links(user, entry["links"], entry["full"], log)
 
-    for problem, src in correct_symlinks.items():
-        if problem not in current_symlinks:
-            dst = join(problems_path, problem)
-            os.symlink(src, dst)
-            print("Added symlink %s --> %s" % (dst, src))
 
+while True:
+    log = []
+    ready, _, _ = select.select([sys.stdin], [], [], RETRY_INTERVAL)
+    if ready:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        message = json.loads(line)
+        for user, links in message["users"].items():
+            if message["full"]:
+                pending.pop(user, None)
+            try:
+                apply_links(user, links, message["full"], log)
+            except Exception as e:
+                log.append("Couldn't update symlinks of %s: %s" % (user, e))
+        retry_pending(log)
+        sys.stdout.write(json.dumps({"version": message["version"], "log": log}) + "\\n")
+        sys.stdout.flush()
+    else:
+        retry_pending(log)
 """
 
 
+class LineReader(object):
+    """
+    Collects the output of a process and splits it into lines.
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.lines = queue.Queue()
+
+    def write(self, data):
+        self.buffer += data
+        while b"\n" in self.buffer:
+            line, self.buffer = self.buffer.split(b"\n", 1)
+            self.lines.put(line.decode("utf-8"))
+
+
+class Agent(object):
+    """
+    The symlink agent running on a shell server. It stays running between
+    daemon runs and applies each batch of changes it is sent.
+    """
+
+    def __init__(self, sid, shell):
+        temp_dir = make_temp_dir(shell)
+        if temp_dir is None:
+            raise api.common.WebException(
+                "Couldn't make temporary directory on shell server")
+
+        script_path = join(temp_dir, "symlinker.py")
+        with shell.open(script_path, "w") as remote_script:
+            remote_script.write(script)
+
+        self.sid = sid
+        self.shell = shell
+        self.output = LineReader()
+        self.process = shell.spawn(["sudo", "python", script_path],
+                                   stdout=self.output)
+
+    def is_running(self):
+        return self.process.is_running()
+
+    def apply(self, changes):
+        """
+        Send changes from api.symlinks.get_pending and wait for them to be
+        applied.
+
+        Returns:
+            The agent's response with the applied version and a log.
+        """
+
+        self.process.stdin_write(json.dumps(changes) + "\n")
+        return json.loads(self.output.lines.get(timeout=apply_timeout))
+
+    def close(self):
+        # the agent exits once the connection carrying its input is closed
+        api.shell_servers.discard_connection(self.sid, self.shell)
+
+
+agents = {}
+
+
 def make_temp_dir(shell):
     path = "".join(random.choice(string.ascii_lowercase) for i in range(10))
 
@@ -85,65 +202,60 @@ def make_temp_dir(shell):
         return None
 
 
-def run():
-    global connections
+def sync_server(server):
+    """
+    Send a shell server the symlink changes it has not applied. A new agent
+    is first sent every user's symlinks, since users it could not yet apply
+    are only remembered by the agent that received them.
+    """
 
-    if api.utilities.check_competition_active():
-        teams = api.team.get_all_teams(show_ineligible=True)
+    sid = server["sid"]
 
-        for server in api.shell_servers.get_servers(get_all=True):
-            try:
-                shell = api.shell_servers.get_connection(server["sid"])
-            except api.common.WebException as e:
-                print("Can't connect to server \"%s\"" % server["name"])
-                continue
+    agent = agents.get(sid)
+    if agent is not None and not agent.is_running():
+        agents.pop(sid).close()
+        agent = None
+    elif agent is not None:
+        agent.shell.touch()
 
-            data = {}
-            for team in teams:
-                unlocked_problems = api.problem.get_unlocked_problems(
-                    tid=team["tid"])
-                correct_symlinks = {
-                    p["name"]: p["deployment_directory"]
-                    for p in unlocked_problems
-                    if p["should_symlink"] and p["sid"] == server["sid"]
-                }
-
-                data.update({
-                    user["username"]: correct_symlinks
-                    for user in api.team.get_team_members(tid=team["tid"])
-                })
-
-            temp_dir = make_temp_dir(shell)
-            if temp_dir is None:
-                print("Couldn't make temporary directory on shell server")
-                continue
+    changes = api.symlinks.get_pending(sid, full=agent is None)
+    if changes is None:
+        return
 
-            script_path = join(temp_dir, "symlinker.py")
-            try:
-                with shell.open(script_path, "w") as remote_script:
-                    remote_script.write(script)
-            except Exception as e:
-                print("Couldn't open script file")
-                continue
+    if agent is None:
+        try:
+            shell = api.shell_servers.get_connection(sid)
+        except api.common.WebException as e:
+            print("Can't connect to server \"%s\"" % server["name"])
+            return
 
-            try:
-                process = shell.spawn(["sudo", "python", script_path])
-                process.stdin_write(json.dumps(data) + "\n")
-                result = process.wait_for_result()
-                output = result.output.decode('utf-8')
-                if output == "":
-                    print("Everything up to date")
-                else:
-                    print(output)
-            except api.common.WebException as e:
-                print("Couldn't run script to create symlinks")
+        try:
+            agent = agents[sid] = Agent(sid, shell)
+        except Exception as e:
+            print("Couldn't start symlink agent on server \"%s\"" %
+                  server["name"])
+            return
 
-            try:
-                with shell:
-                    shell.run(["sudo", "rm", "-r", temp_dir])
-            except api.common.WebException as e:
-                print("Couldn't remove temporary directory on shell server")
-            except Exception as e:
-                print("Unknown error.")
+    try:
+        result = agent.apply(changes)
+    except Exception as e:
+        print("Couldn't apply symlink changes on server \"%s\"" %
+              server["name"])
+        agents.pop(sid).close()
+        return
+
+    api.symlinks.acknowledge(sid, result["version"])
+    for line in result["log"]:
+        print(line)
+
+
+def run():
+    if api.utilities.check_competition_active():
+        changed = api.symlinks.refresh()
+        if changed == 0:
+            print("Everything up to date")
+
+        for server in api.shell_servers.get_servers(get_all=True):
+            sync_server(server)
     else:
         print("Competition is not active.")
@@ -0,0 +1,105 @@
+"""
+Achievement Processor Registry Testing Module
+"""
+
+import os
+import time
+
+import api.achievement
+import api.config
+import pytest
+from api.achievement import ProcessorRegistry
+from api.common import InternalException
+
+
+def write_processor(base_path, source, mtime, name="solved"):
+    path = base_path.join(name, name + ".py")
+    path.write(source, ensure=True)
+    os.utime(str(path), (mtime, mtime))
+    return "{0}/{0}.py".format(name)
+
+
+class TestProcessorRegistry(object):
+    """
+    Tests loading, reloading and timing processors.
+    """
+
+    def registry(self, base_path):
+        registry = ProcessorRegistry()
+        registry.base_path = str(base_path)
+        registry.checked = time.time()
+        return registry
+
+    def test_reload_on_change(self, tmpdir):
+        """
+        Tests that processors are reloaded only when their file changes.
+        """
+
+        registry = self.registry(tmpdir)
+        path = write_processor(
+            tmpdir, "def process(api, data):\n    return True, {}\n", 1000)
+
+        module = registry.load(path)
+        assert registry.load(path) is module, "Unchanged processor reloaded."
+
+        write_processor(
+            tmpdir, "def process(api, data):\n    return False, {}\n", 2000)
+        assert registry.load(path).process(None, {}) == (False, {})
+
+    def test_invalid_processor(self, tmpdir):
+        """
+        Tests that processors without a process function are rejected.
+        """
+
+        registry = self.registry(tmpdir)
+        path = write_processor(tmpdir, "x = 1\n", 1000)
+
+        with pytest.raises(InternalException):
+            registry.load(path)
+        with pytest.raises(InternalException):
+            registry.load("missing/missing.py")
+
+    def test_broken_processor(self, tmpdir, monkeypatch):
+        """
+        Tests that a processor which fails to import is skipped without
+        keeping the others from loading.
+        """
+
+        registry = self.registry(tmpdir)
+        good = write_processor(
+            tmpdir, "def process(api, data):\n    return True, {}\n", 1000)
+        broken = write_processor(
+            tmpdir, "def process(api, data)\n", 1000, name="broken")
+        failing = write_processor(
+            tmpdir, "raise ValueError()\n", 1000, name="failing")
+
+        with pytest.raises(InternalException):
+            registry.load(broken)
+
+        monkeypatch.setattr(api.config, "get_settings", lambda: {
+            "achievements": {"processor_base_path": str(tmpdir)}
+        })
+        monkeypatch.setattr(
+            api.achievement, "get_all_achievements",
+            lambda show_disabled=False: [{"aid": path, "processor": path}
+                                         for path in [broken, good, failing]])
+
+        registry.load_all()
+        assert list(registry.processors) == [good]
+
+    def test_timings(self, tmpdir):
+        """
+        Tests that runs are counted per processor.
+        """
+
+        registry = self.registry(tmpdir)
+        path = write_processor(
+            tmpdir, "def process(api, data):\n    return True, {}\n", 1000)
+        registry.paths["aid"] = path
+
+        assert registry.run("aid", {}) == (True, {})
+        assert registry.run("aid", {}) == (True, {})
+
+        timing = registry.get_stats()[path]
+        assert timing["calls"] == 2
+        assert timing["max"] >= timing["mean"] >= 0
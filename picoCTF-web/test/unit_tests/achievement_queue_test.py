@@ -0,0 +1,141 @@
+"""
+Achievement Queue Testing Module
+"""
+
+import threading
+import time
+
+import api.achievement_queue
+import api.setup
+from api.achievement_queue import LocalQueue, MongoQueue
+from common import clear_collections
+from conftest import setup_db, teardown_db
+
+
+class TestLocalQueue(object):
+    """
+    Tests batching and retries against the in-process queue.
+    """
+
+    def fill(self, queue):
+        # Events are pushed directly so no worker thread is started.
+        for tid, pid in [("t1", "a"), ("t2", "a"), ("t1", "b")]:
+            queue.events.append({
+                "event": "submit",
+                "tid": tid,
+                "data": {"tid": tid, "pid": pid},
+                "owner": None,
+                "attempts": 0
+            })
+
+    def test_claim_batches_team(self):
+        """
+        Tests that a claim takes every pending event of one team.
+        """
+
+        queue = LocalQueue()
+        self.fill(queue)
+
+        tid, events = queue.claim("w1")
+        assert tid == "t1"
+        assert [event["data"]["pid"] for event in events] == ["a", "b"]
+
+        assert queue.claim("w2")[0] == "t2"
+        assert queue.claim("w3") is None
+
+        queue.ack("w1")
+        assert queue.size() == 1
+
+    def test_release_retries(self):
+        """
+        Tests that failed batches are retried a limited number of times.
+        """
+
+        queue = LocalQueue()
+        self.fill(queue)
+
+        for _ in range(api.achievement_queue.max_attempts):
+            queue.claim("w1")
+            queue.release("w1")
+
+        assert queue.claim("w1")[0] == "t2"
+        assert queue.size() == 1
+
+    def test_drain(self, monkeypatch):
+        """
+        Tests that draining hands each team's events to the processor once.
+        """
+
+        processed = []
+        monkeypatch.setattr(api.achievement, "process_team_events",
+                            lambda tid, events: processed.append(
+                                (tid, len(events))))
+
+        queue = LocalQueue()
+        self.fill(queue)
+        api.achievement_queue.set_queue(queue)
+        try:
+            assert api.achievement_queue.drain() == 2
+        finally:
+            api.achievement_queue.set_queue(None)
+
+        assert sorted(processed) == [("t1", 2), ("t2", 1)]
+        assert queue.size() == 0
+
+
+class TestMongoQueue(object):
+    """
+    Tests the durable queue against a database.
+    """
+
+    def setup_class(self):
+        setup_db()
+        api.setup.index_mongo()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @clear_collections("achievement_queue", "achievement_locks")
+    def test_team_claimed_once(self, monkeypatch):
+        """
+        Tests that concurrent workers never process one team at once, even
+        when events for the team arrive while it is being processed.
+        """
+
+        queue = MongoQueue()
+        active = set()
+        overlaps = []
+        processed = []
+        lock = threading.Lock()
+
+        def process(tid, events):
+            with lock:
+                if tid in active:
+                    overlaps.append(tid)
+                active.add(tid)
+                processed.extend(events)
+
+            if events[0]["data"]["round"] == 0:
+                queue.push("submit", {"tid": tid, "round": 1})
+            time.sleep(0.01)
+
+            with lock:
+                active.discard(tid)
+
+        monkeypatch.setattr(api.achievement, "process_team_events", process)
+        monkeypatch.setattr(api.achievement_queue, "workers", 8)
+
+        for i in range(20):
+            queue.push("submit", {"tid": "t{}".format(i % 4), "round": 0})
+
+        api.achievement_queue.set_queue(queue)
+        try:
+            while queue.size() > 0:
+                api.achievement_queue.drain()
+        finally:
+            api.achievement_queue.set_queue(None)
+
+        assert overlaps == []
+        assert len([e for e in processed if e["data"]["round"] == 0]) == 20
+        assert api.common.get_conn().achievement_locks.count_documents(
+            {}) == 0
@@ -0,0 +1,96 @@
+"""
+Authentication Testing Module
+"""
+
+import api.app
+import api.auth
+import api.team
+import api.user
+from flask import session
+
+
+class TestRequestContext(object):
+    """
+    Tests that a request loads the logged in user and team once.
+    """
+
+    def fake_documents(self, monkeypatch):
+        loads = []
+
+        def load_user(uid=None, name=None):
+            loads.append(("user", uid))
+            return {"uid": uid, "tid": "t-" + uid, "disabled": False}
+
+        def get_team(tid=None, name=None):
+            loads.append(("team", tid))
+            return {"tid": tid, "team_name": "team"}
+
+        monkeypatch.setattr(api.user, "load_user", load_user)
+        monkeypatch.setattr(api.team, "get_team", get_team)
+        return loads
+
+    def test_loaded_once(self, monkeypatch):
+        """
+        Tests that repeated checks reuse the loaded documents.
+        """
+
+        loads = self.fake_documents(monkeypatch)
+
+        with api.app.app.test_request_context():
+            assert not api.auth.is_logged_in()
+            assert api.auth.get_context() is None
+
+            session["uid"] = "u1"
+            for _ in range(3):
+                assert api.auth.is_logged_in()
+                assert api.auth.get_uid() == "u1"
+                assert api.user.get_user(uid="u1")["tid"] == "t-u1"
+                assert api.auth.get_context().team["tid"] == "t-u1"
+
+            assert api.user.get_user(uid="u2")["uid"] == "u2"
+
+        assert loads == [("user", "u1"), ("team", "t-u1"), ("user", "u2")]
+
+    def test_reloaded_after_change(self, monkeypatch):
+        """
+        Tests that the documents are reloaded after the session user changes
+        or the context is invalidated.
+        """
+
+        loads = self.fake_documents(monkeypatch)
+
+        with api.app.app.test_request_context():
+            session["uid"] = "u1"
+            assert api.auth.get_context().user["uid"] == "u1"
+
+            session["uid"] = "u2"
+            assert api.auth.get_context().user["uid"] == "u2"
+
+            api.auth.invalidate_context()
+            assert api.auth.get_context().user["uid"] == "u2"
+
+        assert loads == [("user", "u1"), ("user", "u2"), ("user", "u2")]
+
+    def test_copies_returned(self, monkeypatch):
+        """
+        Tests that changing a returned user or team leaves the request's
+        documents alone.
+        """
+
+        get_team = api.team.get_team
+        self.fake_documents(monkeypatch)
+
+        with api.app.app.test_request_context():
+            session["uid"] = "u1"
+            api.user.get_user()["score"] = 10
+            api.user.get_user(uid="u1")["tid"] = "other"
+            api.user.get_team()["members"] = []
+            get_team()["team_name"] = "changed"
+
+            context = api.auth.get_context()
+            assert context.user == {
+                "uid": "u1",
+                "tid": "t-u1",
+                "disabled": False
+            }
+            assert context.team == {"tid": "t-u1", "team_name": "team"}
@@ -0,0 +1,611 @@
+"""
+Cache Testing Module
+"""
+
+import fnmatch
+import socket
+import threading
+import time
+
+import api.cache
+from api.cache import LRUCache
+from api.cache_backends import (INVALIDATE_SCRIPT, SET_SCRIPT, MemoryBackend,
+                                RedisBackend, RedisConnection)
+
+
+def memoized(tid=None, category=None):
+    pass
+
+
+class FakeRedis(object):
+    """
+    An in-process stand-in for the commands RedisBackend sends.
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.sets = {}
+        self.set_expires = {}
+        self.zsets = {}
+
+    def _members(self, name):
+        expires = self.set_expires.get(name)
+        if expires is not None and expires < time.time():
+            self.sets.pop(name, None)
+            self.set_expires.pop(name)
+        return self.sets.get(name, set())
+
+    def _remove(self, name, member):
+        members = self._members(name)
+        members.discard(member)
+        if not members:
+            # redis deletes empty sets
+            self.sets.pop(name, None)
+            self.set_expires.pop(name, None)
+
+    def _set_script(self, prefix, key, value, ttl, *tags):
+        member = key.encode("utf-8")
+        key_tags = prefix + ":tags:" + key
+
+        for tag in list(self._members(key_tags)):
+            self._remove(prefix + ":tag:" + tag.decode("utf-8"), member)
+        self._execute("DEL", key_tags, prefix + ":stale:" + key)
+
+        expiry = ["PX", ttl] if ttl != "" else []
+        self._execute("SET", prefix + ":cache:" + key, value, *expiry)
+
+        for tag in tags:
+            name = prefix + ":tag:" + tag
+            existed = bool(self._members(name))
+            self.sets.setdefault(name, set()).add(member)
+            self.sets.setdefault(key_tags, set()).add(tag.encode("utf-8"))
+            if ttl == "":
+                self.set_expires.pop(name, None)
+            else:
+                expires = time.time() + ttl / 1000
+                current = self.set_expires.get(name)
+                if not existed or (current is not None and current < expires):
+                    self.set_expires[name] = expires
+        if ttl != "" and tags:
+            self.set_expires[key_tags] = time.time() + ttl / 1000
+        return 1
+
+    def _invalidate_script(self, prefix, stale, *groups):
+        count, i = 0, 0
+        while i < len(groups):
+            size = groups[i]
+            tags = [prefix + ":tag:" + tag for tag in groups[i + 1:i + size + 1]]
+            i += size + 1
+
+            members = set.intersection(*[set(self._members(tag)) for tag in tags])
+            for member in members:
+                key = member.decode("utf-8")
+                ttl = self._execute("PTTL", prefix + ":cache:" + key)
+                if ttl == -2 or stale == "0":
+                    key_tags = prefix + ":tags:" + key
+                    for tag in list(self._members(key_tags)):
+                        self._remove(prefix + ":tag:" + tag.decode("utf-8"),
+                                     member)
+                    for tag in tags:
+                        self._remove(tag, member)
+                    self._execute("DEL", prefix + ":cache:" + key, key_tags,
+                                  prefix + ":stale:" + key)
+                elif ttl == -1:
+                    self._execute("SET", prefix + ":stale:" + key, 1)
+                else:
+                    self._execute("SET", prefix + ":stale:" + key, 1, "PX", ttl)
+                if ttl != -2:
+                    count += 1
+        return count
+
+    def _execute(self, command, *args):
+        if command == "GET":
+            entry = self.strings.get(args[0])
+            if entry is None or (entry[1] is not None and entry[1] < time.time()):
+                return None
+            return entry[0]
+        elif command == "PTTL":
+            entry = self.strings.get(args[0])
+            if entry is None:
+                return -2
+            return -1 if entry[1] is None else int((entry[1] - time.time()) * 1000)
+        elif command == "SET":
+            if "NX" in args and self._execute("GET", args[0]) is not None:
+                return None
+            expires = None
+            if "PX" in args:
+                expires = time.time() + args[args.index("PX") + 1] / 1000
+            self.strings[args[0]] = (args[1], expires)
+            return "OK"
+        elif command == "EXISTS":
+            return int(self._execute("GET", args[0]) is not None or
+                       bool(self._members(args[0])))
+        elif command == "EVAL":
+            # Stands in for each script RedisBackend runs.
+            if args[0] == SET_SCRIPT:
+                return self._set_script(*args[2:])
+            elif args[0] == INVALIDATE_SCRIPT:
+                return self._invalidate_script(*args[2:])
+            if self._execute("GET", args[2]) == args[3]:
+                return self._execute("DEL", args[2])
+            return 0
+        elif command == "SADD":
+            members = self.sets.setdefault(args[0], set())
+            members.update(arg.encode("utf-8") for arg in args[1:])
+            return len(args) - 1
+        elif command == "SREM":
+            self.sets.get(args[0], set()).discard(args[1].encode("utf-8"))
+            return 1
+        elif command == "SISMEMBER":
+            return int(args[1].encode("utf-8") in self.sets.get(args[0], ()))
+        elif command == "SINTER":
+            return list(set.intersection(
+                *[self.sets.get(key, set()) for key in args]))
+        elif command == "DEL":
+            return sum(1 for key in args
+                       if self.strings.pop(key, None) is not None or
+                       self.sets.pop(key, None) is not None)
+        elif command == "SCAN":
+            keys = [key for key in list(self.strings) + list(self.sets)
+                    if fnmatch.fnmatch(key, args[2])]
+            return [b"0", keys]
+        elif command == "ZADD":
+            self.zsets.setdefault(args[0], []).append((args[1], args[2]))
+            return 1
+        elif command == "ZREMRANGEBYSCORE":
+            entries = self.zsets.get(args[0], [])
+            self.zsets[args[0]] = [e for e in entries if e[0] > args[2]]
+            return len(entries) - len(self.zsets[args[0]])
+        elif command == "ZRANGEBYSCORE":
+            return [member for score, member in self.zsets.get(args[0], [])
+                    if score >= args[1]]
+        raise NotImplementedError(command)
+
+    def pipeline(self, commands):
+        return [self._execute(*command) for command in commands]
+
+    def execute(self, *command):
+        return self._execute(*command)
+
+
+class TestLRUCache(object):
+    """
+    Tests for the local cache tier.
+    """
+
+    def test_entry_limit(self):
+        """
+        Tests that the least recently used entry is evicted first.
+        """
+
+        cache = LRUCache(2, 1024)
+        cache.set("a", 1, 1)
+        cache.set("b", 2, 1)
+        cache.get("a")
+        cache.set("c", 3, 1)
+
+        assert cache.get("b") is None, "Least recently used entry was kept."
+        assert cache.get("a")["value"] == 1
+        assert cache.get("c")["value"] == 3
+
+    def test_size_limit(self):
+        """
+        Tests that entries are evicted to respect the byte budget.
+        """
+
+        cache = LRUCache(10, 100)
+        cache.set("a", "a", 60)
+        cache.set("b", "b", 60)
+        cache.set("huge", "huge", 101)
+
+        assert cache.get("a") is None
+        assert cache.get("b")["value"] == "b"
+        assert cache.get("huge") is None, "Oversized entry was stored."
+        assert cache.stats()["bytes"] == 60
+
+    def test_timeout(self):
+        """
+        Tests that expired entries are not returned.
+        """
+
+        cache = LRUCache(10, 100)
+        cache.set("a", 1, 1, timeout=-1)
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_invalidate(self):
+        """
+        Tests invalidation by argument tags.
+        """
+
+        cache = LRUCache(10, 100)
+        for tid in ["t1", "t2"]:
+            cache.set(tid, tid, 1, tags=api.cache.get_tags(memoized, tid=tid))
+
+        cache.invalidate(
+            api.cache.get_tag_groups(memoized, {"kwargs.tid": "t1"}))
+
+        assert cache.get("t1") is None
+        assert cache.get("t2")["value"] == "t2"
+
+        cache.invalidate(api.cache.get_tag_groups(memoized), stale=True)
+        assert cache.get("t2")["stale"]
+
+
+class TestKeys(object):
+    """
+    Tests key serialization and invalidation tags.
+    """
+
+    def test_keys(self):
+        """
+        Tests that keys ignore argument order and omitted arguments.
+        """
+
+        assert api.cache.get_key(memoized, tid="t1", category=None) == \
+            api.cache.get_key(memoized, tid="t1")
+        assert api.cache.get_key(memoized, category="c", tid="t1") == \
+            api.cache.get_key(memoized, tid="t1", category="c")
+        assert api.cache.get_key(memoized, "t1") != \
+            api.cache.get_key(memoized, tid="t1")
+
+    def test_tags_from_key(self):
+        """
+        Tests that the tags of a shared entry can be rebuilt from its key.
+        """
+
+        key = api.cache.get_key(memoized, "t1", category="c")
+        assert api.cache._tags_from_key(key) == \
+            api.cache.get_tags(memoized, "t1", category="c")
+
+    def test_tag_groups(self):
+        """
+        Tests translation of invalidation conditions.
+        """
+
+        tags = api.cache.get_tags(memoized, "t1", uid="u1")
+        match = lambda *conditions: any(
+            set(group) <= tags
+            for group in api.cache.get_tag_groups(memoized, *conditions))
+
+        assert match({"args": "t1"})
+        assert match({"args": ["t1"]})
+        assert match({"kwargs.tid": "t1"}, {"kwargs.uid": "u1"})
+        assert match()
+        assert not match({"kwargs.uid": "u2"})
+        assert not match({"args": "t2"})
+
+    def test_dependency_tags(self):
+        """
+        Tests that entity invalidations reach exactly the dependent results.
+        """
+
+        depends = {"team": "tid", "problem": None}
+        team_tags = api.cache.get_dependency_tags(memoized, depends, "t1")
+        all_tags = api.cache.get_dependency_tags(memoized, depends)
+        category_tags = api.cache.get_dependency_tags(
+            memoized, {"problem": None}, category="c")
+
+        match = lambda tags, *args: any(
+            set(group) <= tags
+            for group in api.cache.get_entity_tag_groups(*args))
+
+        assert match(team_tags, "team", "t1")
+        assert not match(team_tags, "team", "t2")
+        assert match(all_tags, "team", "t2"), "Unset id did not match."
+        assert match(team_tags, "team")
+        assert match(team_tags, "problem", "p1")
+        assert not match(category_tags, "team", "t1")
+        assert not match(category_tags, "bundle")
+
+
+class TestBackends(object):
+    """
+    Runs the same checks against each shared backend.
+    """
+
+    def check_backend(self, backend):
+        tags = api.cache.get_tags(memoized, tid="t1", category="c")
+        backend.set("a", {"score": 10}, timeout=60, tags=tags)
+        backend.set("b", [1, 2], tags=api.cache.get_tags(memoized, tid="t2"))
+
+        entry = backend.get("a")
+        assert entry["value"] == {"score": 10}
+        assert entry["expires"] > time.time()
+        assert entry["tags"] == tags
+        assert not entry["stale"]
+        assert backend.get("b")["expires"] is None
+        assert backend.get("missing") is None
+
+        backend.invalidate(
+            api.cache.get_tag_groups(memoized, {"kwargs.tid": "t1",
+                                                "kwargs.category": "d"}))
+        assert backend.get("a") is not None, "Partial group invalidated."
+
+        backend.invalidate(
+            api.cache.get_tag_groups(memoized, {"kwargs.tid": "t1"}),
+            stale=True)
+        assert backend.get("a")["stale"]
+        assert not backend.get("b")["stale"]
+
+        backend.set("a", {"score": 11}, tags=tags)
+        assert not backend.get("a")["stale"], "Setting did not refresh."
+
+        backend.invalidate(
+            api.cache.get_tag_groups(memoized, {"kwargs.tid": "t1"}))
+        assert backend.get("a") is None
+        assert backend.get("b") is not None
+
+        since = time.time() - 1
+        _id = backend.publish({"tag_groups": None})
+        assert (_id, {"tag_groups": None}) in backend.poll(since)
+
+        assert backend.acquire("lease", "w1", 60)
+        assert not backend.acquire("lease", "w2", 60)
+        backend.release("lease", "w2")
+        assert not backend.acquire("lease", "w2", 60), "Released by non-owner."
+        backend.release("lease", "w1")
+        assert backend.acquire("lease", "w2", 60)
+
+        backend.clear()
+        assert backend.get("b") is None
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryBackend())
+
+    def test_redis_backend(self):
+        self.check_backend(RedisBackend(FakeRedis()))
+
+    def test_redis_tag_sets(self):
+        """
+        Tests that redis tag sets expire with their keys and lose the keys
+        that are deleted.
+        """
+
+        redis = FakeRedis()
+        backend = RedisBackend(redis, prefix="p")
+        function = api.cache.get_tags(memoized).pop()
+        t1 = api.cache.get_tags(memoized, tid="t1")
+        t2 = api.cache.get_tags(memoized, tid="t2")
+        (t1_tag,) = t1 - {function}
+
+        backend.set("a", 1, timeout=60, tags=t1)
+        assert redis.set_expires["p:tag:" + t1_tag] > time.time() + 59
+        assert redis.set_expires["p:tag:" + function] > time.time() + 59
+
+        backend.set("b", 2, tags=t2)
+        assert "p:tag:" + function not in redis.set_expires, \
+            "Tag expires before one of its keys."
+
+        backend.invalidate(api.cache.get_tag_groups(memoized, {"kwargs.tid": "t1"}),
+                           stale=True)
+        assert redis.strings["p:stale:a"][1] is not None, \
+            "Stale marker outlives its key."
+
+        backend.invalidate(api.cache.get_tag_groups(memoized, {"kwargs.tid": "t1"}))
+        assert "p:tag:" + t1_tag not in redis.sets
+        assert "p:tags:a" not in redis.sets
+        assert "p:stale:a" not in redis.strings
+        assert redis.sets["p:tag:" + function] == {b"b"}
+
+        # keys that expired on their own are pruned by the next invalidation
+        backend.set("c", 3, timeout=0.001, tags=t1)
+        time.sleep(0.01)
+        backend.invalidate([[function]])
+        assert "p:tag:" + function not in redis.sets
+
+
+class TestRedisConnection(object):
+    """
+    Tests the redis protocol client against a local socket.
+    """
+
+    def test_protocol(self):
+        assert RedisConnection.encode(("SET", "k", b"v\r\n")) == \
+            b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$3\r\nv\r\n\r\n"
+
+        server, client = socket.socketpair()
+        connection = RedisConnection()
+        connection.sock = client
+        connection.reader = client.makefile("rb")
+
+        server.sendall(b"+OK\r\n:5\r\n$-1\r\n*2\r\n$1\r\na\r\n$2\r\nbc\r\n")
+        assert connection.pipeline([("SET", "k", "v"), ("INCR", "n"),
+                                    ("GET", "x"), ("SMEMBERS", "s")]) == \
+            ["OK", 5, None, [b"a", b"bc"]]
+
+        assert server.recv(4096).startswith(b"*3\r\n$3\r\nSET")
+
+        connection.close()
+        server.close()
+
+
+class TestMemoize(object):
+    """
+    Tests memoization against the in-process backend.
+    """
+
+    def setup_method(self):
+        api.cache.set_backend(MemoryBackend())
+
+    def test_memoize(self):
+        calls = []
+
+        @api.cache.memoize()
+        def get_score(tid=None):
+            calls.append(tid)
+            return {"score": len(calls)}
+
+        assert get_score(tid="t1") == {"score": 1}
+        assert get_score(tid="t1") == {"score": 1}
+        assert get_score(tid="t2") == {"score": 2}
+
+        # Hits are copies, so callers can mutate results.
+        get_score(tid="t1")["score"] = 100
+        assert get_score(tid="t1") == {"score": 1}
+
+        api.cache.invalidate_memoization(get_score, {"kwargs.tid": "t1"})
+        assert get_score(tid="t1") == {"score": 3}
+        assert get_score(tid="t2") == {"score": 2}
+
+        assert get_score(tid="t2", cache=False) == {"score": 4}
+        assert api.cache.refresh(get_score, tid="t2") == {"score": 5}
+        assert get_score(tid="t2") == {"score": 5}
+
+    def test_remote_invalidation(self):
+        """
+        Tests that invalidations published elsewhere evict the local tier.
+        """
+
+        calls = []
+
+        @api.cache.memoize()
+        def get_score(tid=None):
+            calls.append(tid)
+            return len(calls)
+
+        assert get_score(tid="t1") == 1
+
+        backend = api.cache.get_backend()
+        groups = api.cache.get_tag_groups(get_score, {"kwargs.tid": "t1"})
+        backend.invalidate(groups)
+        backend.publish({"tag_groups": groups})
+
+        assert get_score(tid="t1") == 1, "Local tier was not used."
+        api.cache.poll_invalidations(force=True)
+        assert get_score(tid="t1") == 2
+
+    def test_stale_while_revalidate(self):
+        """
+        Tests that stale results are served while they are recomputed.
+        """
+
+        calls = []
+
+        @api.cache.memoize(depends={"team": "tid"}, stale_while_revalidate=True)
+        def get_score(tid=None):
+            calls.append(tid)
+            return len(calls)
+
+        @api.cache.memoize(depends={"team": "tid"})
+        def get_solves(tid=None):
+            calls.append(tid)
+            return len(calls)
+
+        assert get_score(tid="t1") == 1
+        assert get_solves(tid="t1") == 2
+        assert get_score(tid="t2") == 3
+
+        api.cache.invalidate_entity("team", "t1", stale=True)
+        assert get_solves(tid="t1") == 4, "Stale result was served."
+        assert get_score(tid="t2") == 3, "Unrelated result was invalidated."
+        assert get_score(tid="t1") == 1, "Stale result was not served."
+
+        for _ in range(100):
+            if len(api.cache._revalidating) == 0:
+                break
+            time.sleep(0.01)
+        assert get_score(tid="t1") == 5
+
+    def test_revalidation_bounded(self, monkeypatch):
+        """
+        Tests that a burst of stale results is recomputed by a bounded pool.
+        """
+
+        monkeypatch.setattr(api.cache, "revalidation_workers", 2)
+        monkeypatch.setattr(api.cache, "revalidation_queue_size", 3)
+        release = threading.Event()
+        calls = []
+
+        @api.cache.memoize(depends={"team": None}, stale_while_revalidate=True)
+        def get_score(tid=None):
+            calls.append(tid)
+            if len(calls) > 10:
+                release.wait(5)
+            return tid
+
+        for i in range(10):
+            get_score(tid=i)
+
+        threads = threading.active_count()
+        api.cache.invalidate_entity("team", stale=True)
+        for _ in range(2):
+            for i in range(10):
+                assert get_score(tid=i) == i, "Stale result was not served."
+
+        assert len(api.cache._revalidating) == 3
+        assert threading.active_count() <= threads + 2
+
+        release.set()
+        for _ in range(100):
+            if len(api.cache._revalidating) == 0:
+                break
+            time.sleep(0.01)
+        assert len(calls) == 13, "Keys were revalidated more than once."
+
+    def test_single_flight(self):
+        """
+        Tests that callers without the lease wait for the holder's result.
+        """
+
+        calls = []
+
+        @api.cache.memoize(single_flight=True)
+        def get_scores(gid=None):
+            calls.append(gid)
+            return len(calls)
+
+        key = api.cache.get_key(get_scores, gid="g1")
+        backend = api.cache.get_backend()
+        assert backend.acquire(key, "other worker", 60)
+
+        threading.Timer(0.1, api.cache.set, [key, "computed elsewhere"]).start()
+        assert get_scores(gid="g1") == "computed elsewhere"
+        assert len(calls) == 0
+
+        assert get_scores(gid="g2") == 1
+        stats = api.cache.get_stats()["single_flight"]
+        counts = stats[api.cache._function_name(get_scores)]
+        assert counts["coalesced"] == 1
+        assert counts["computed"] == 1
+
+    def test_single_flight_wait(self, monkeypatch):
+        """
+        Tests that waiting callers back off while another worker computes,
+        and wait without polling while this worker does.
+        """
+
+        reads = []
+        get_entry = api.cache.get_entry
+
+        def counting_get_entry(key, fast=False):
+            reads.append(threading.current_thread())
+            return get_entry(key, fast=fast)
+
+        monkeypatch.setattr(api.cache, "get_entry", counting_get_entry)
+
+        started, release = threading.Event(), threading.Event()
+
+        @api.cache.memoize(single_flight=True)
+        def get_scores(gid=None):
+            started.set()
+            release.wait(5)
+            return gid
+
+        key = api.cache.get_key(get_scores, gid="g1")
+        assert api.cache.get_backend().acquire(key, "other worker", 60)
+        threading.Timer(0.8, api.cache.set, [key, "computed elsewhere"]).start()
+        assert get_scores(gid="g1") == "computed elsewhere"
+        assert len(reads) <= 7, "Waiter polled without backing off."
+
+        holder = threading.Thread(target=get_scores, kwargs={"gid": "g2"})
+        holder.start()
+        started.wait(5)
+
+        del reads[:]
+        threading.Timer(0.5, release.set).start()
+        assert get_scores(gid="g2") == "g2"
+        holder.join()
+        waiter_reads = [t for t in reads if t is threading.current_thread()]
+        assert len(waiter_reads) == 2, "Waiter polled a local computation."
@@ -0,0 +1,47 @@
+"""
+Settings Snapshot Testing Module
+"""
+
+import api.common
+import api.config
+from common import clear_collections
+from conftest import setup_db, teardown_db
+
+
+class TestSettingsSnapshot(object):
+    """
+    Tests that settings are served from the snapshot until a new version.
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @clear_collections("settings")
+    def test_snapshot(self, monkeypatch):
+        db = api.common.get_conn()
+        db.settings.insert_one({"version": 1, "max_team_size": 5})
+        monkeypatch.setattr(api.config, "settings_poll_interval", 60)
+        monkeypatch.setattr(api.config, "_snapshot", {
+            "settings": None,
+            "version": None,
+            "checked": 0
+        })
+
+        assert api.config.get_settings() == {"max_team_size": 5}
+        assert api.config.get_settings_version() == 1
+
+        db.settings.update_one({}, {"$set": {"max_team_size": 4}})
+        monkeypatch.setattr(api.config, "settings_poll_interval", 0)
+        assert api.config.get_settings()["max_team_size"] == 5, \
+            "Settings were reloaded without a new version."
+
+        db.settings.update_one({}, {"$set": {"version": 2, "max_team_size": 3}})
+        monkeypatch.setattr(api.config, "settings_poll_interval", 60)
+        assert api.config.get_settings()["max_team_size"] == 5
+
+        monkeypatch.setattr(api.config, "settings_poll_interval", 0)
+        assert api.config.get_settings()["max_team_size"] == 3
+        assert api.config.get_settings_version() == 2
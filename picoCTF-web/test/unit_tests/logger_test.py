@@ -0,0 +1,127 @@
+"""
+Logger Testing Module
+"""
+
+from datetime import datetime
+
+import api.common
+from api.logger import StatsWriter
+from bson import ObjectId
+from common import clear_collections
+from conftest import setup_db, teardown_db
+from pymongo.errors import ConnectionFailure
+
+
+class TestStatsWriter(object):
+    """
+    Tests buffering and spilling of statistics records.
+    """
+
+    def make_writer(self, tmpdir, monkeypatch, **kwargs):
+        writer = StatsWriter(
+            spill_path=str(tmpdir.join("statistics.jsonl")), **kwargs)
+        # Records are only collected by the tests, no thread is started.
+        monkeypatch.setattr(writer, "_start", lambda: None)
+
+        writer.inserted = []
+        monkeypatch.setattr(writer, "insert", writer.inserted.extend)
+        return writer
+
+    def test_batches(self, tmpdir, monkeypatch):
+        """
+        Tests that buffered records are written in batches.
+        """
+
+        writer = self.make_writer(tmpdir, monkeypatch, batch_size=2)
+        for i in range(3):
+            writer.push({"event": i})
+
+        assert [record["event"] for record in writer._collect(0)] == [0, 1]
+
+        writer.flush()
+        assert [record["event"] for record in writer.inserted] == [2]
+
+    def test_spill_and_replay(self, tmpdir, monkeypatch):
+        """
+        Tests that records beyond the buffer are spilled and replayed.
+        """
+
+        writer = self.make_writer(tmpdir, monkeypatch, queue_size=1)
+        now = datetime(2019, 1, 1)
+        for i in range(3):
+            writer.push({"event": i, "time": now})
+
+        assert len(tmpdir.join("statistics.jsonl").readlines()) == 2
+
+        assert writer.replay() == 2
+        assert writer.inserted == [{"event": 1, "time": now},
+                                   {"event": 2, "time": now}]
+        assert tmpdir.listdir() == []
+        assert writer.replay() == 0
+
+    def test_failed_write_spills(self, tmpdir, monkeypatch):
+        """
+        Tests that records are kept when the database is unavailable.
+        """
+
+        writer = self.make_writer(tmpdir, monkeypatch)
+
+        def fail(records):
+            raise ConnectionFailure()
+
+        monkeypatch.setattr(writer, "insert", fail)
+        assert not writer.write([{"event": 0}])
+        assert writer.dropped == 0
+        assert len(tmpdir.join("statistics.jsonl").readlines()) == 1
+
+
+class TestStatsStorage(object):
+    """
+    Tests writing statistics records to the database.
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @clear_collections("statistics")
+    def test_partial_write_replayed_once(self, tmpdir):
+        """
+        Tests that records spilled after a partial write are stored once
+        when replayed.
+        """
+
+        db = api.common.get_conn()
+        writer = StatsWriter(spill_path=str(tmpdir.join("statistics.jsonl")))
+
+        # the first record was stored before the connection was lost
+        records = [{"_id": ObjectId(), "event": i} for i in range(2)]
+        db.statistics.insert_one(dict(records[0]))
+        writer.spill(records)
+
+        assert writer.replay() == 2
+        assert sorted(record["event"]
+                      for record in db.statistics.find()) == [0, 1]
+        assert not tmpdir.join("statistics.jsonl").check()
+
+    @clear_collections("statistics")
+    def test_other_write_errors_spill(self, tmpdir):
+        """
+        Tests that write errors other than duplicates still spill records.
+        """
+
+        db = api.common.get_conn()
+        db.drop_collection("statistics")
+        db.create_collection(
+            "statistics", validator={"event": {"$exists": True}})
+        writer = StatsWriter(spill_path=str(tmpdir.join("statistics.jsonl")))
+
+        try:
+            stored = {"_id": ObjectId(), "event": 0}
+            db.statistics.insert_one(dict(stored))
+            assert not writer.write([stored, {"invalid": True}])
+            assert len(tmpdir.join("statistics.jsonl").readlines()) == 2
+        finally:
+            db.drop_collection("statistics")
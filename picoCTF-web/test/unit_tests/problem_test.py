@@ -3,12 +3,13 @@ Problem Testing Module
 """
 
 import re
+from datetime import datetime
 
 import api
 import pytest
-from api.common import APIException
-from common import (clear_cache, clear_collections, ensure_empty_collections,
-                    new_team_user)
+from api.common import APIException, WebException
+from common import (base_user, clear_cache, clear_collections,
+                    ensure_empty_collections, new_team_user)
 from conftest import setup_db, teardown_db
 
 
@@ -304,6 +305,107 @@ class TestProblems(object):
         for pid in self.enabled_pids:
             assert pid in unlocked_pids, "Level1 problem didn't unlock"
 
+    @ensure_empty_collections("submissions")
+    @clear_collections("submissions")
+    @clear_cache()
+    def test_submission_checks(self):
+        """
+        Tests the checks made before a submission is recorded.
+
+        Covers:
+            problem.submit_key
+            problem.get_team_state
+        """
+
+        pid = self.base_problems[0]['pid']
+
+        # locked problem
+        with pytest.raises(APIException):
+            api.problem.submit_key(
+                self.tid, self.level1_problems[0]['pid'], self.correct,
+                "game", uid=self.uid)
+
+        # duplicate key
+        api.problem.submit_key(self.tid, pid, self.wrong, "game", uid=self.uid)
+        with pytest.raises(WebException) as error:
+            api.problem.submit_key(
+                self.tid, pid, self.wrong, "game", uid=self.uid)
+        assert error.value.data["code"] == "repeat"
+
+        # already solved, by a teammate whose solve this worker has not seen
+        api.problem.get_team_state(self.tid)
+        db = api.common.get_conn()
+        db.submissions.insert_one({
+            "uid": self.uid,
+            "tid": self.tid,
+            "pid": pid,
+            "key": "another key",
+            "correct": True,
+            "timestamp": datetime.utcnow()
+        })
+        with pytest.raises(WebException) as error:
+            api.problem.submit_key(
+                self.tid, pid, self.correct, "game", uid=self.uid)
+        assert error.value.data["code"] == "solved"
+
+        # already solved
+        other = self.base_problems[1]['pid']
+        api.problem.submit_key(self.tid, other, self.correct, "game",
+                               uid=self.uid)
+        with pytest.raises(WebException) as error:
+            api.problem.submit_key(
+                self.tid, other, self.correct, "game", uid=self.uid)
+        assert error.value.data["code"] == "solved"
+
+    @ensure_empty_collections("submissions")
+    @clear_collections("submissions")
+    @clear_cache()
+    def test_team_summaries(self):
+        """
+        Tests that the scoring aggregations match the per team results.
+
+        Covers:
+            scoring.get_all_team_summaries
+            scoring.get_member_breakdowns
+        """
+
+        # a member without submissions
+        idle_uid = api.user.create_simple_user_request(base_user)
+
+        for problem in self.base_problems[:3]:
+            api.problem.submit_key(
+                self.tid, problem['pid'], self.correct, "game", uid=self.uid)
+        api.problem.submit_key(
+            self.tid, self.base_problems[3]['pid'], self.wrong, "game",
+            uid=self.uid)
+
+        summaries = api.scoring.get_all_team_summaries(cache=False)
+        summary = api.scoring.get_team_summary(self.tid, summaries)
+
+        assert summary["score"] == api.stats.get_score(tid=self.tid)
+        assert sorted(summary["pids"]) == sorted(
+            api.problem.get_solved_pids(tid=self.tid))
+        assert summary["solved"] == 3
+        assert summary["categories"] == {"Binary Exploitation": 3}
+        assert summary["lastsubmit"] == max(
+            submission["timestamp"]
+            for submission in api.problem.get_submissions(tid=self.tid)
+            if submission["correct"])
+
+        assert api.scoring.get_team_summary("missing", summaries)["score"] == 0
+
+        breakdowns = api.scoring.get_member_breakdowns(tids=[self.tid])
+        members = breakdowns[self.tid]
+        assert members[idle_uid] is None, \
+            "Member without submissions was not listed."
+
+        breakdown = members[self.uid]
+        assert breakdown["submits"] == 4
+        assert breakdown["correct"] == 3
+        assert breakdown["incorrect"] == 1
+        assert breakdown["Binary Exploitation"] == 3
+        assert len(breakdown["times"]) == 4
+
     @ensure_empty_collections("submissions")
     @clear_collections("submissions", "problems")
     @clear_cache()
@@ -327,3 +429,47 @@ class TestProblems(object):
             assert api.stats.get_score(
                 uid=self.uid
             ) == correct_total, "User score is calculating incorrectly!"
+
+    @ensure_empty_collections("submissions")
+    @clear_collections("submissions", "problems")
+    @clear_cache()
+    def test_invalid_instance_submissions(self):
+        pids = []
+        for name, flags in [("shared-a", ["flag-a0", "flag-a1"]),
+                            ("shared-b", ["flag-b0"])]:
+            problem = {
+                "name": name,
+                "sanitized_name": name,
+                "score": 10,
+                "author": "haxxor",
+                "category": "Cryptography",
+                "description": "Shared key problem",
+                "hints": [],
+                "instances": [{
+                    "description": "Shared key problem",
+                    "flag": flag,
+                    "iid": iid,
+                    "server": "hack.com",
+                    "instance_number": iid
+                } for iid, flag in enumerate(flags)]
+            }
+            pid = api.problem.insert_problem(problem, self.fake_sid)
+            api.problem.update_problem(pid, {"disabled": False})
+            pids.append(pid)
+
+        pid_a, pid_b = pids
+        api.problem.submit_key(self.tid, pid_b, "wrong", "game", uid=self.uid)
+        flag_b = api.problem.get_instance_data(pid_b, self.tid)["flag"]
+        iid_a = api.problem.get_instance_data(pid_a, self.tid)["iid"]
+        other_flag_a = ["flag-a0", "flag-a1"][1 - iid_a]
+
+        api.problem.submit_key(self.tid, pid_a, flag_b, "game", uid=self.uid)
+        assert api.stats.check_invalid_instance_submissions() == [], \
+            "Another problem's flag was flagged as a shared key."
+
+        # the report is cached for five minutes
+        api.cache.clear_all()
+        api.problem.submit_key(
+            self.tid, pid_a, other_flag_a, "game", uid=self.uid)
+        shared = api.stats.check_invalid_instance_submissions()
+        assert [(s["pid"], s["key"]) for s in shared] == [(pid_a, other_flag_a)]
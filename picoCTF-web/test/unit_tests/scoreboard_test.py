@@ -0,0 +1,305 @@
+"""
+Scoreboard Engine Testing Module
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import api.common
+import api.scoreboard
+import pytest
+from api.common import WebException
+from api.scoreboard import Board, ScoreboardEngine
+from common import clear_collections
+from conftest import setup_db, teardown_db
+
+start = datetime(2018, 1, 1)
+
+
+def make_engine():
+    """
+    An engine with two teams and two problems that never reseeds.
+    """
+
+    engine = ScoreboardEngine()
+    engine.problem_scores = {"p1": 10, "p2": 20}
+    engine.uid_tids = {"u1": "t1", "u2": "t2", "u3": "t2"}
+    engine.teams = {
+        "t1": {
+            "name": "one",
+            "affiliation": "A",
+            "eligible": True,
+            "country": "US",
+            "visible": True
+        },
+        "t2": {
+            "name": "two",
+            "affiliation": "B",
+            "eligible": False,
+            "country": "CA",
+            "visible": True
+        }
+    }
+    engine.seeded_at = engine.refreshed_at = float("inf")
+    return engine
+
+
+class TestBoard(object):
+    """
+    Tests for the rank ordered board.
+    """
+
+    def test_ordering(self):
+        """
+        Tests that teams are ordered by score then by earliest last solve.
+        """
+
+        board = Board()
+        board.update("a", 10, start + timedelta(minutes=3))
+        board.update("b", 20, start + timedelta(minutes=2))
+        board.update("c", 10, start + timedelta(minutes=1))
+        board.update("d", 0, start)
+
+        assert board.tids() == ["b", "c", "a"], "Board is out of order."
+        assert board.rank("a") == 2
+        assert board.rank("d") is None, "Teams without points are ranked."
+
+    def test_update_moves_team(self):
+        """
+        Tests that updating a team repositions it.
+        """
+
+        board = Board()
+        board.update("a", 10, start)
+        board.update("b", 20, start)
+        board.update("a", 30, start + timedelta(minutes=1))
+
+        assert board.tids() == ["a", "b"]
+        assert len(board) == 2
+
+        board.remove("a")
+        assert board.tids() == ["b"]
+        assert board.rank("a") is None
+
+
+class TestScoreboardEngine(object):
+    """
+    Tests for the in-memory engine without touching the database.
+    """
+
+    def test_record_solve(self):
+        """
+        Tests that solves are counted once and placed on the right boards.
+        """
+
+        engine = make_engine()
+        engine.record_solve("u1", "t1", "p1", start)
+        engine.record_solve("u1", "t1", "p1", start)
+        engine.record_solve("u2", "t2", "p2", start)
+
+        # A user's solves follow them to their current team
+        engine.record_solve("u3", "old", "p2", start + timedelta(minutes=1))
+
+        assert engine.solves["t1"]["score"] == 10, "Repeat solve was counted."
+        assert engine.solves["t2"]["score"] == 20
+
+        assert [t["tid"] for t in engine.get_board()] == ["t2", "t1"]
+        assert [t["tid"] for t in engine.get_board(eligible=True)] == ["t1"]
+        assert engine.get_board(eligible=False, country="US") == []
+        assert engine.get_rank("t1") == 1
+        assert engine.get_board_size(eligible=False, country="CA") == 1
+
+    def test_single_reseed(self, monkeypatch):
+        """
+        Tests that concurrent reads of a stale engine reseed it once, and
+        only wait for the seed when there are no boards yet.
+        """
+
+        engine = make_engine()
+        engine.seeded_at = None
+        seeds = []
+
+        def build(fresh):
+            seeds.append(fresh)
+            time.sleep(0.2)
+
+        monkeypatch.setattr(ScoreboardEngine, "_build", build)
+        monkeypatch.setattr(engine, "refresh", lambda: None)
+
+        def read():
+            engine.ensure_fresh()
+            assert engine.seeded_at is not None, "Read before the first seed."
+
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(seeds) == 1, "Seeded more than once."
+
+        # a stale engine keeps serving its boards while one thread reseeds
+        engine.seeded_at -= api.scoreboard.reseed_interval + 1
+        stale = engine.seeded_at
+        reseed = threading.Thread(target=engine.ensure_fresh)
+        reseed.start()
+        time.sleep(0.05)
+        engine.ensure_fresh()
+        assert engine.seeded_at == stale and len(seeds) == 2
+        reseed.join()
+        assert engine.seeded_at > stale
+
+    def test_unknown_problem_ignored(self):
+        """
+        Tests that disabled or unknown problems do not count.
+        """
+
+        engine = make_engine()
+        engine.record_solve("u1", "t1", "disabled", start)
+
+        assert engine.get_board() == []
+        assert engine.watermark is None
+
+    def test_board_key(self):
+        """
+        Tests translation of get_all_team_scores arguments.
+        """
+
+        assert api.scoreboard.board_key(show_ineligible=True) == (None, None)
+        assert api.scoreboard.board_key(eligible=True, country="US") == \
+            (True, "US")
+
+    def test_pages(self):
+        """
+        Tests reading a board a page at a time with cursors.
+        """
+
+        engine = make_engine()
+        engine.record_solve("u1", "t1", "p1", start)
+        engine.record_solve("u2", "t2", "p2", start)
+
+        first = engine.get_page((None, None), tid="t1", limit=1)
+        assert [t["tid"] for t in first["scoreboard"]] == ["t2"]
+        assert first["scoreboard"][0]["rank"] == 1
+        assert first["size"] == 2 and first["position"] == 1
+
+        cursor = api.scoreboard.decode_cursor(first["next"])
+        second = engine.get_page((None, None), cursor=cursor, limit=1)
+        assert [t["tid"] for t in second["scoreboard"]] == ["t1"]
+        assert second["scoreboard"][0]["rank"] == 2
+        assert second["next"] is None, "Last page has a next cursor."
+
+    def test_cursor(self):
+        """
+        Tests that cursors survive encoding and reject garbage.
+        """
+
+        key = (-10, 0, start + timedelta(microseconds=7), "t1")
+        assert api.scoreboard.decode_cursor(
+            api.scoreboard.encode_cursor(key)) == key
+
+        key = (0, 1, 0, "t1")
+        assert api.scoreboard.decode_cursor(
+            api.scoreboard.encode_cursor(key)) == key
+
+        with pytest.raises(WebException):
+            api.scoreboard.decode_cursor("not a cursor")
+
+    def test_group_board(self):
+        """
+        Tests that group boards keep unscored and hidden members.
+        """
+
+        engine = make_engine()
+        engine._load_groups([{
+            "gid": "g1",
+            "owner": "t3",
+            "members": ["t1", "t2"],
+            "teachers": [],
+            "settings": {
+                "hidden": True
+            }
+        }])
+        for tid in engine.teams:
+            engine._place(tid)
+
+        key = api.scoreboard.group_key("g1")
+        etag = api.scoreboard.get_etag(engine.get_page(key))
+        assert engine.get_board_size() == 0, "Hidden teams are ranked."
+        assert engine.get_page(key)["size"] == 2
+
+        engine.record_solve("u1", "t1", "p1", start)
+        page = engine.get_page(key)
+        assert [t["tid"] for t in page["scoreboard"]] == ["t1", "t2"]
+        assert api.scoreboard.get_etag(page) != etag, "ETag did not change."
+
+    def test_etag_shared(self):
+        """
+        Tests that workers which have seen the same solves agree on the ETag,
+        whatever order they saw them in.
+        """
+
+        first = make_engine()
+        first.record_solve("u1", "t1", "p1", start)
+        first.record_solve("u2", "t2", "p2", start + timedelta(seconds=1))
+
+        second = make_engine()
+        second.record_solve("u2", "t2", "p2", start + timedelta(seconds=1))
+        second.record_solve("u1", "t1", "p1", start)
+
+        key = (None, None)
+        etag = api.scoreboard.get_etag(first.get_page(key, tid="t1"))
+        assert etag == api.scoreboard.get_etag(second.get_page(key, tid="t1"))
+        assert etag != api.scoreboard.get_etag(second.get_page(key, tid="t2"))
+
+
+class TestScoreboardRefresh(object):
+    """
+    Tests for pulling solves recorded by other workers from the database.
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @clear_collections("submissions")
+    def test_interleaved_workers(self):
+        """
+        Tests that a worker's own solves do not hide earlier solves recorded
+        by other workers.
+        """
+
+        db = api.common.get_conn()
+        first, second = make_engine(), make_engine()
+
+        def insert(uid, tid, pid, timestamp):
+            db.submissions.insert_one({
+                "uid": uid,
+                "tid": tid,
+                "pid": pid,
+                "timestamp": timestamp,
+                "correct": True
+            })
+
+        def submit(engine, uid, tid, pid, timestamp):
+            insert(uid, tid, pid, timestamp)
+            engine.record_solve(uid, tid, pid, timestamp)
+
+        submit(second, "u2", "t2", "p2", start + timedelta(seconds=1))
+        submit(first, "u1", "t1", "p1", start + timedelta(seconds=2))
+        assert first.watermark is None, "A local solve moved the watermark."
+
+        first.refresh()
+        assert first.solves["t2"]["score"] == 20, "Missed the other solve."
+        assert first.watermark == start + timedelta(seconds=2)
+
+        # Inserted late by another worker, just before the watermark
+        insert("u3", "t2", "p1", start + timedelta(seconds=1))
+        first.refresh()
+        assert first.solves["t2"]["score"] == 30, "Missed a late insert."
+
+        second.refresh()
+        assert [t["tid"] for t in second.get_board()] == \
+            [t["tid"] for t in first.get_board()] == ["t2", "t1"]
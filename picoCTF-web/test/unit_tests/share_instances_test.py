@@ -0,0 +1,190 @@
+"""
+Symlink Agent Testing Module
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import api.shell_servers
+import api.symlinks
+import daemons.share_instances as share_instances
+
+# Runs the agent with accounts read from a file instead of the password
+# database, and with the problems directories already undeletable.
+HARNESS = """
+import json
+import pwd
+import runpy
+import subprocess
+import sys
+
+
+class Account(object):
+
+    def __init__(self, home):
+        self.pw_dir = home
+
+
+def getpwnam(user):
+    with open(sys.argv[2]) as f:
+        homes = json.load(f)
+    if user not in homes:
+        raise KeyError(user)
+    return Account(homes[user])
+
+
+pwd.getpwnam = getpwnam
+subprocess.check_output = lambda cmd: b"-----u----"
+runpy.run_path(sys.argv[1], run_name="__main__")
+"""
+
+
+class TestAgent(object):
+    """
+    Tests the agent applying symlink changes on a shell server.
+    """
+
+    def start(self, tmpdir, homes):
+        script = tmpdir.join("agent", "symlinker.py")
+        script.write(share_instances.script, ensure=True)
+        self.accounts = tmpdir.join("accounts.json")
+        self.accounts.write(json.dumps(homes))
+
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", HARNESS,
+             str(script), str(self.accounts)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True)
+        return script
+
+    def send(self, message):
+        self.process.stdin.write(json.dumps(message) + "\n")
+        self.process.stdin.flush()
+        return json.loads(self.process.stdout.readline())
+
+    def stop(self):
+        self.process.stdin.close()
+        assert self.process.wait(timeout=10) == 0
+
+    def test_messages(self, tmpdir):
+        """
+        Tests full and incremental messages, and users without a shell
+        account whose changes are applied once the account exists.
+        """
+
+        alice = tmpdir.mkdir("alice")
+        stale = alice.mkdir("problems").join("stale")
+        stale.mksymlinkto("/problems/stale")
+        script = self.start(tmpdir, {"alice": str(alice)})
+
+        try:
+            result = self.send({
+                "version": 3,
+                "full": True,
+                "users": {
+                    "alice": {"p1": "/problems/p1", "p2": "/problems/p2"},
+                    "bob": {"p1": "/problems/p1"}
+                }
+            })
+            assert not script.check(), "The agent did not remove itself."
+            assert result["version"] == 3
+            problems = alice.join("problems")
+            assert sorted(p.basename for p in problems.listdir()) == [
+                "p1", "p2"
+            ], "A full message kept a stale symlink."
+            assert os.readlink(str(problems.join("p1"))) == "/problems/p1"
+
+            result = self.send({
+                "version": 4,
+                "full": False,
+                "users": {
+                    "alice": {"p1": None, "p3": "/problems/p3"},
+                    "bob": {"p2": "/problems/p2"}
+                }
+            })
+            assert result["version"] == 4
+            assert sorted(p.basename for p in problems.listdir()) == [
+                "p2", "p3"
+            ]
+
+            # bob's account is created, his pending changes are merged
+            bob = tmpdir.mkdir("bob")
+            self.accounts.write(
+                json.dumps({"alice": str(alice), "bob": str(bob)}))
+            self.send({"version": 5, "full": False, "users": {}})
+            assert sorted(p.basename
+                          for p in bob.join("problems").listdir()) == [
+                              "p1", "p2"
+                          ]
+        finally:
+            self.stop()
+
+
+class FakeAgent(object):
+
+    def __init__(self, sid, shell):
+        self.sid = sid
+        self.shell = shell
+        self.running = True
+        self.closed = False
+        self.sent = []
+
+    def is_running(self):
+        return self.running
+
+    def apply(self, changes):
+        self.sent.append(changes)
+        return {"version": changes["version"], "log": []}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeShell(object):
+
+    def touch(self):
+        pass
+
+
+class TestSyncServer(object):
+    """
+    Tests which changes the daemon sends each shell server.
+    """
+
+    def test_new_agent_resyncs(self, monkeypatch):
+        """
+        Tests that a new agent is sent every symlink and a running one only
+        the deltas.
+        """
+
+        requests, acknowledged = [], []
+        monkeypatch.setattr(share_instances, "Agent", FakeAgent)
+        monkeypatch.setattr(share_instances, "agents", {})
+        monkeypatch.setattr(api.shell_servers, "get_connection",
+                            lambda sid: FakeShell())
+        monkeypatch.setattr(
+            api.symlinks, "get_pending",
+            lambda sid, full=False: requests.append(full) or {
+                "version": len(requests),
+                "full": full,
+                "users": {}
+            })
+        monkeypatch.setattr(
+            api.symlinks, "acknowledge",
+            lambda sid, version: acknowledged.append(version))
+
+        server = {"sid": "s1", "name": "shell"}
+        share_instances.sync_server(server)
+        share_instances.sync_server(server)
+
+        agent = share_instances.agents["s1"]
+        agent.running = False
+        share_instances.sync_server(server)
+
+        assert requests == [True, False, True]
+        assert acknowledged == [1, 2, 3]
+        assert agent.closed
+        assert share_instances.agents["s1"] is not agent
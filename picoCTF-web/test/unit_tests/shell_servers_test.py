@@ -0,0 +1,191 @@
+"""
+Shell Server Connection Pool Testing Module
+"""
+
+import api.common
+import api.shell_servers
+import pytest
+import spur
+from api.common import WebException
+from common import clear_collections
+from conftest import setup_db, teardown_db
+
+
+class FakeShell(object):
+    """
+    Stands in for spur.SshShell, failing the commands of broken servers.
+    """
+
+    shells = []
+    broken = set()
+    # every connection fails, as when the server is unreachable
+    down = False
+
+    def __init__(self, hostname, username, password, port, **kwargs):
+        self.password = password
+        self.commands = 0
+        self.closed = False
+        FakeShell.shells.append(self)
+
+    def run(self, command, **kwargs):
+        self.commands += 1
+        if self.closed or self in FakeShell.broken or FakeShell.down:
+            raise spur.ssh.ConnectionError("Connection lost")
+        return command
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def patch_pool(test, monkeypatch):
+    """
+    Connects to a fake shell through an empty pool with a controlled clock.
+    """
+
+    FakeShell.shells = []
+    FakeShell.broken = set()
+    FakeShell.down = False
+    test.clock = FakeClock()
+    test.server = {
+        "sid": "s1",
+        "name": "shell",
+        "host": "localhost",
+        "port": 22,
+        "username": "hacksports",
+        "password": "password"
+    }
+
+    monkeypatch.setattr(spur, "SshShell", FakeShell)
+    monkeypatch.setattr(api.shell_servers, "time", test.clock)
+    monkeypatch.setattr(api.shell_servers, "__pool", {})
+    monkeypatch.setattr(api.shell_servers, "get_server",
+                        lambda sid: dict(test.server))
+
+
+class TestConnectionPool(object):
+    """
+    Tests reusing, checking and replacing pooled connections.
+    """
+
+    @pytest.fixture(autouse=True)
+    def pool(self, monkeypatch):
+        patch_pool(self, monkeypatch)
+
+    def test_reuse_and_check_interval(self):
+        """
+        Tests that connections are reused and checked once per interval.
+        """
+
+        connection = api.shell_servers.get_connection("s1")
+        assert api.shell_servers.get_connection("s1") is connection
+        assert len(FakeShell.shells) == 1
+        assert connection.shell.commands == 1
+
+        self.clock.now += api.shell_servers.connection_check_interval + 1
+        assert api.shell_servers.get_connection("s1") is connection
+        assert connection.shell.commands == 2
+
+        assert api.shell_servers.run_command("s1", ["ls"]) == ["ls"]
+        assert len(FakeShell.shells) == 1
+
+    def test_single_reconnect(self):
+        """
+        Tests that a connection which stopped working is replaced once, and
+        one that never worked is not retried.
+        """
+
+        connection = api.shell_servers.get_connection("s1")
+        FakeShell.broken.add(connection.shell)
+        self.clock.now += api.shell_servers.connection_check_interval + 1
+
+        replacement = api.shell_servers.get_connection("s1")
+        assert replacement is not connection
+        assert connection.shell.closed
+
+        FakeShell.down = True
+        self.clock.now += api.shell_servers.connection_check_interval + 1
+        with pytest.raises(WebException):
+            api.shell_servers.get_connection("s1")
+        assert len(FakeShell.shells) == 3, "Reconnected more than once."
+
+        # a new connection that fails is not retried
+        with pytest.raises(WebException):
+            api.shell_servers.get_connection("s1")
+        assert len(FakeShell.shells) == 4
+
+    def test_run_command_retries(self):
+        """
+        Tests that a command is rerun on a new connection if the pooled one
+        broke after its check.
+        """
+
+        connection = api.shell_servers.get_connection("s1")
+        FakeShell.broken.add(connection.shell)
+
+        assert api.shell_servers.run_command("s1", ["ls"]) == ["ls"]
+        assert connection.shell.closed
+        assert len(FakeShell.shells) == 2
+
+    def test_idle_expiry(self):
+        """
+        Tests that unused connections are closed.
+        """
+
+        connection = api.shell_servers.get_connection("s1")
+        self.clock.now += api.shell_servers.connection_idle_timeout + 1
+
+        assert api.shell_servers.get_connection("s1") is not connection
+        assert connection.shell.closed
+
+    def test_credentials_change(self):
+        """
+        Tests that a connection is replaced once the server's credentials
+        change.
+        """
+
+        connection = api.shell_servers.get_connection("s1")
+        self.server["password"] = "changed"
+
+        replacement = api.shell_servers.get_connection("s1")
+        assert replacement is not connection
+        assert replacement.shell.password == "changed"
+        assert connection.shell.closed
+
+
+class TestRemoveServer(object):
+    """
+    Tests that removed servers leave the connection pool.
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @pytest.fixture(autouse=True)
+    def pool(self, monkeypatch):
+        patch_pool(self, monkeypatch)
+
+    @clear_collections("shell_servers")
+    def test_remove_server(self):
+        """
+        Tests that removing a server closes its connection.
+        """
+
+        api.common.get_conn().shell_servers.insert_one(dict(self.server))
+
+        connection = api.shell_servers.get_connection("s1")
+        api.shell_servers.remove_server("s1")
+
+        assert connection.shell.closed
+        assert api.shell_servers.get_connection("s1") is not connection
@@ -0,0 +1,193 @@
+"""
+Solve State Testing Module
+"""
+
+from datetime import datetime, timedelta
+
+import api.cache
+import api.common
+import api.solve_state
+from api.cache_backends import MemoryBackend
+from api.solve_state import (downsample, empty_state, fold_solves,
+                             get_progression)
+from common import clear_collections
+from conftest import setup_db, teardown_db
+
+start = datetime(2018, 1, 1)
+
+problems = {
+    "p1": {"pid": "p1", "score": 10, "category": "Web", "disabled": False},
+    "p2": {"pid": "p2", "score": 20, "category": "Crypto", "disabled": False},
+    "p3": {"pid": "p3", "score": 40, "category": "Web", "disabled": True}
+}
+
+
+class TestFoldSolves(object):
+    """
+    Tests for rebuilding states from first solves.
+    """
+
+    def test_team_and_user_states(self):
+        """
+        Tests that teams count a problem once, at its first solve.
+        """
+
+        solves = [
+            {"uid": "u2", "tid": "t1", "pid": "p1", "timestamp": start},
+            {"uid": "u1", "tid": "t1", "pid": "p1",
+             "timestamp": start + timedelta(minutes=1)},
+            {"uid": "u1", "tid": "t1", "pid": "p2",
+             "timestamp": start + timedelta(minutes=2)},
+        ]
+
+        teams, users = fold_solves(solves, problems)
+
+        assert teams["t1"]["score"] == 30
+        assert teams["t1"]["solved"] == 2
+        assert teams["t1"]["solve_times"]["p1"] == start
+        assert teams["t1"]["lastsubmit"] == start + timedelta(minutes=2)
+        assert teams["t1"]["categories"] == {"Web": 1, "Crypto": 1}
+
+        assert users["u1"]["score"] == 30 and users["u1"]["tid"] == "t1"
+        assert users["u2"]["pids"] == ["p1"]
+
+    def test_disabled_and_unknown_problems(self):
+        """
+        Tests that disabled problems are recorded but not scored.
+        """
+
+        solves = [
+            {"uid": "u1", "tid": "t1", "pid": "p3", "timestamp": start},
+            {"uid": "u1", "tid": "t1", "pid": "gone", "timestamp": start},
+        ]
+
+        teams, users = fold_solves(solves, problems)
+
+        expected = empty_state()
+        expected["pids"] = ["p3"]
+        expected["solve_times"] = {"p3": start}
+        assert teams["t1"] == expected, "Disabled problem was scored."
+
+
+class TestProgression(object):
+    """
+    Tests for reading score progressions.
+    """
+
+    def test_progression(self):
+        """
+        Tests that progressions accumulate in solve order per category.
+        """
+
+        solves = [
+            {"uid": "u1", "tid": "t1", "pid": "p2",
+             "timestamp": start + timedelta(minutes=1)},
+            {"uid": "u1", "tid": "t1", "pid": "p1", "timestamp": start},
+        ]
+        state = fold_solves(solves, problems)[0]["t1"]
+
+        # Series stored out of order, as concurrent solves may be.
+        state["progression"].reverse()
+
+        assert [p["score"] for p in get_progression(state)] == [10, 30]
+        assert [p["score"] for p in get_progression(
+            state, category="Crypto")] == [20]
+        assert get_progression(state, category="Forensics") == []
+
+    def test_downsample(self):
+        """
+        Tests that downsampling is bounded and keeps the final score.
+        """
+
+        series = list(range(1000))
+
+        assert downsample(series, None) == series
+        assert downsample(series[:10], 50) == series[:10]
+
+        sampled = downsample(series, 100)
+        assert len(sampled) == 100
+        assert sampled[-1] == 999, "Final score was dropped."
+        assert sampled == sorted(sampled)
+
+
+class TestRebuild(object):
+    """
+    Tests for rebuilding stored states.
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @clear_collections("problems", "submissions", "team_state", "user_state")
+    def test_recent_solves_reapplied(self, monkeypatch):
+        """
+        Tests that solves near the snapshot are recorded again after the
+        states are replaced, so concurrent solves are not lost.
+        """
+
+        db = api.common.get_conn()
+        db.problems.insert_many([dict(p) for p in problems.values()])
+
+        now = datetime.utcnow()
+        db.submissions.insert_many([{
+            "uid": "u1",
+            "tid": "t1",
+            "pid": pid,
+            "timestamp": timestamp,
+            "correct": True
+        } for pid, timestamp in [("p1", start), ("p2", now), ("p3", now)]])
+
+        matches = []
+        first_solves = api.solve_state._first_solves
+
+        def record_match(match):
+            matches.append(dict(match))
+            return first_solves(match)
+
+        recorded = []
+        monkeypatch.setattr(api.solve_state, "_first_solves", record_match)
+        monkeypatch.setattr(
+            api.solve_state, "record_solve",
+            lambda uid, tid, problem, timestamp: recorded.append(
+                (uid, tid, problem["pid"])))
+
+        api.solve_state.rebuild()
+
+        assert len(matches) == 2
+        assert matches[1]["timestamp"]["$gte"] > start
+        assert recorded == [("u1", "t1", "p2")], "Disabled solve recorded."
+        assert db.team_state.find_one({"tid": "t1"})["score"] == 30
+
+        matches[:] = []
+        assert api.solve_state.rebuild(check=True) == {
+            "teams": [],
+            "users": []
+        }
+        assert len(matches) == 1, "Checking changed the states."
+
+    @clear_collections("submissions", "team_state")
+    def test_ensure_built(self, monkeypatch):
+        """
+        Tests that states are built once when only submissions exist.
+        """
+
+        rebuilds = []
+        monkeypatch.setattr(api.solve_state, "rebuild",
+                            lambda: rebuilds.append(True))
+        monkeypatch.setattr(api.cache, "get_backend", MemoryBackend)
+
+        db = api.common.get_conn()
+        db.submissions.insert_one({"correct": True})
+        assert api.solve_state.ensure_built()
+
+        db.team_state.insert_one({"tid": "t1"})
+        assert not api.solve_state.ensure_built()
+
+        db.team_state.delete_many({})
+        db.submissions.delete_many({})
+        assert not api.solve_state.ensure_built()
+
+        assert rebuilds == [True]
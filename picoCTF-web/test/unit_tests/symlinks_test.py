@@ -0,0 +1,137 @@
+"""
+Symlink Synchronization Testing Module
+"""
+
+import api.common
+import api.problem
+import api.shell_servers
+import api.symlinks
+import api.team
+from common import clear_collections
+from conftest import setup_db, teardown_db
+
+
+class FakeTeams(object):
+    """
+    Teams of one member each, unlocking problems on server s1 of servers s1
+    and s2.
+    """
+
+    def __init__(self, monkeypatch):
+        db = api.common.get_conn()
+        db.shell_servers.insert_many([{"sid": sid} for sid in ["s1", "s2"]])
+        monkeypatch.setattr(
+            api.shell_servers, "get_servers", lambda get_all=False: list(
+                db.shell_servers.find({}, {"_id": 0})))
+
+        self.unlocked = {"t1": ["p1"], "t2": []}
+        monkeypatch.setattr(api.team, "get_all_teams",
+                            lambda show_ineligible=False: [{
+                                "tid": tid
+                            } for tid in self.unlocked])
+        monkeypatch.setattr(api.team, "get_members_by_tids",
+                            lambda tids: {tid: [{
+                                "username": "user-" + tid
+                            }] for tid in tids})
+        monkeypatch.setattr(api.problem, "get_unlocked_problems",
+                            lambda tid: [{
+                                "name": name,
+                                "sid": "s1",
+                                "should_symlink": True,
+                                "deployment_directory": "/problems/" + name
+                            } for name in self.unlocked[tid]])
+
+
+class TestSymlinks(object):
+    """
+    Tests for refreshing symlinks and sending servers their changes.
+    """
+
+    def setup_class(self):
+        setup_db()
+
+    def teardown_class(self):
+        teardown_db()
+
+    @clear_collections("symlink_events", "symlink_state", "symlink_deltas",
+                       "counters", "shell_servers")
+    def test_refresh_deltas(self, monkeypatch):
+        """
+        Tests that only changed teams are refreshed into per-user deltas.
+        """
+
+        teams = FakeTeams(monkeypatch)
+        db = api.common.get_conn()
+
+        assert api.symlinks.refresh() == 1, "Every team is refreshed first."
+        assert api.symlinks.refresh() == 0
+
+        teams.unlocked = {"t1": ["p2"], "t2": ["p3"]}
+        api.symlinks.record_change(tid="t1")
+        assert api.symlinks.refresh() == 1, "An unchanged team was refreshed."
+
+        delta = db.symlink_deltas.find_one({"version": 2})
+        assert delta["username"] == "user-t1" and delta["sid"] == "s1"
+        assert delta["links"] == {"p1": None, "p2": "/problems/p2"}
+        assert db.symlink_events.count_documents({}) == 0
+
+        api.symlinks.record_change()
+        assert api.symlinks.refresh() == 1
+        assert [(state["username"], state["links"])
+                for state in db.symlink_state.find().sort("username")] == [
+                    ("user-t1", {"p2": "/problems/p2"}),
+                    ("user-t2", {"p3": "/problems/p3"})
+                ]
+
+    @clear_collections("symlink_events", "symlink_state", "symlink_deltas",
+                       "counters", "shell_servers")
+    def test_pending_changes(self, monkeypatch):
+        """
+        Tests that deltas are merged across versions, new servers get every
+        symlink and acknowledged deltas are pruned.
+        """
+
+        teams = FakeTeams(monkeypatch)
+        db = api.common.get_conn()
+        api.symlinks.refresh()
+
+        pending = api.symlinks.get_pending("s1")
+        assert pending == {
+            "version": 1,
+            "full": True,
+            "users": {"user-t1": {"p1": "/problems/p1"}}
+        }
+        api.symlinks.acknowledge("s1", 1)
+        assert api.symlinks.get_pending("s1") is None
+
+        for unlocked in [["p1", "p2"], ["p2", "p3"]]:
+            teams.unlocked["t1"] = unlocked
+            api.symlinks.record_change(tid="t1")
+            api.symlinks.refresh()
+
+        assert api.symlinks.get_pending("s1") == {
+            "version": 3,
+            "full": False,
+            "users": {
+                "user-t1": {
+                    "p1": None,
+                    "p2": "/problems/p2",
+                    "p3": "/problems/p3"
+                }
+            }
+        }
+        assert api.symlinks.get_pending("s1", full=True)["users"] == {
+            "user-t1": {"p2": "/problems/p2", "p3": "/problems/p3"}
+        }
+
+        # s2 never acknowledged, so nothing is kept for it
+        api.symlinks.acknowledge("s1", 2)
+        assert [d["version"] for d in db.symlink_deltas.find()] == [3]
+
+        api.symlinks.acknowledge("s2", 1)
+        api.symlinks.acknowledge("s1", 3)
+        assert [d["version"] for d in db.symlink_deltas.find()] == [3], \
+            "A delta s2 still needs was pruned."
+
+        api.symlinks.acknowledge("s2", 3)
+        assert db.symlink_deltas.count_documents({}) == 0
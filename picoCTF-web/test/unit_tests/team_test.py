@@ -84,6 +84,46 @@ class TestTeams(object):
 
             assert team_from_tid == team_from_name, "Team lookup from tid and name are not the same."
 
+    @ensure_empty_collections("teams", "users")
+    @clear_collections("teams", "users")
+    def test_batch_lookups(self, teams=5):
+        """
+        Tests looking up several teams and users at once.
+
+        Covers:
+            team.get_teams_by_tids
+            team.get_members_by_tids
+            user.get_users_by_uids
+        """
+
+        tids = []
+        for i in range(teams):
+            team = base_team.copy()
+            team["team_name"] += str(i)
+            tids.append(api.team.create_team(team))
+
+        teams = api.team.get_teams_by_tids(tids + ["missing"])
+        assert sorted(teams) == sorted(tids), "Not all teams were found."
+        for tid in tids:
+            assert teams[tid] == api.team.get_team(tid=tid), \
+                "Batch lookup does not match get_team."
+
+        names = api.team.get_teams_by_tids(tids, projection=["team_name"])
+        assert all(set(team) == {"tid", "team_name"}
+                   for team in names.values()), "Projection was not applied."
+
+        uid = api.user.create_simple_user_request(base_user.copy())
+        tid = api.user.get_user(uid=uid)["tid"]
+
+        users = api.user.get_users_by_uids([uid], projection=["username"])
+        assert users == {uid: {"uid": uid, "username": base_user["username"]}}
+
+        members = api.team.get_members_by_tids(tids + [tid])
+        assert [member["uid"] for member in members[tid]] == [uid], \
+            "Team members are not grouped by team."
+        assert all(members[tid] == [] for tid in tids), \
+            "Empty teams should have no members."
+
     @ensure_empty_collections("teams", "users")
     @clear_collections("teams", "users")
     def test_get_team_uids(self):
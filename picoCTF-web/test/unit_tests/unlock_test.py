@@ -0,0 +1,74 @@
+"""
+Unlock Index Testing Module
+"""
+
+from api.problem import UnlockIndex
+
+
+def problem(pid, category="Web"):
+    return {"pid": pid, "sanitized_name": "name-" + pid, "category": category}
+
+
+problems = [problem("a"), problem("b"), problem("c", "Crypto"), problem("d")]
+
+bundle = {
+    "problems": ["name-a", "name-b", "name-c", "name-d"],
+    "dependencies_enabled": True,
+    "dependencies": {
+        "name-c": {
+            "threshold": 2,
+            "weightmap": {
+                "name-a": 1,
+                "name-b": 1,
+                "name-missing": 5
+            }
+        },
+        "name-d": {
+            "threshold": 1,
+            "weightmap": {
+                "name-c": 1
+            }
+        }
+    }
+}
+
+
+class TestUnlockIndex(object):
+    """
+    Tests for the compiled bundle dependencies.
+    """
+
+    def test_unlocked(self):
+        """
+        Tests that thresholds are checked against the solved set.
+        """
+
+        index = UnlockIndex(problems, [bundle])
+
+        assert index.get_unlocked([]) == ["a", "b"]
+        assert index.get_unlocked(["a"]) == ["a", "b"]
+        assert index.get_unlocked(["a", "b"]) == ["a", "b", "c"]
+        assert index.get_unlocked(["a", "b"], category="Crypto") == ["c"]
+        assert index.get_unlocked(["a", "b", "c"]) == ["a", "b", "c", "d"]
+
+    def test_disabled_dependencies(self):
+        """
+        Tests that bundles without enabled dependencies lock nothing.
+        """
+
+        disabled = dict(bundle, dependencies_enabled=False)
+        index = UnlockIndex(problems, [disabled])
+
+        assert index.get_unlocked([]) == ["a", "b", "c", "d"]
+
+    def test_newly_unlocked(self):
+        """
+        Tests deriving the problems unlocked by a single solve.
+        """
+
+        index = UnlockIndex(problems, [bundle])
+
+        assert index.get_newly_unlocked(["a"], "a") == []
+        assert index.get_newly_unlocked(["a", "b"], "b") == ["c"]
+        assert index.get_newly_unlocked(["a", "b", "c"], "c") == ["d"]
+        assert index.get_newly_unlocked(["a", "b", "c", "d"], "d") == []